@@ -8,7 +8,6 @@ admin.site.register(models.TechnicalManager)
 admin.site.register(models.NormalUser)
 admin.site.register(models.ManagerUser)
 admin.site.register(models.Customer)
-admin.site.register(models.Specialist)
 admin.site.register(models.Speciality)
 
 
@@ -20,3 +19,16 @@ class CustomUserAdmin(UserAdmin):
     add_fieldsets = UserAdmin.add_fieldsets + (
         (None, {'fields': ('email', 'phone', 'role')}),
     )
+
+
+@admin.register(models.Specialist)
+class SpecialistAdmin(admin.ModelAdmin):
+    readonly_fields = ('active_request_count',)
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            super().save_model(request, obj, form, change)
+            return
+        # the count is kept by core.signals, writing the form's copy back could undo their changes
+        obj.save(update_fields=[field.name for field in obj._meta.concrete_fields
+                                if not field.primary_key and field.name != 'active_request_count'])
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.9 on 2026-10-18 17:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_alter_normaluser_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='normaluser',
+            name='score_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='normaluser',
+            name='score_sum',
+            field=models.FloatField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.9 on 2026-10-18 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_normaluser_score_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='specialist',
+            name='active_request_count',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -8,6 +8,7 @@ from phone_field import PhoneField
 
 from accounts.constants import *
 from utils.Singleton import Singleton
+from utils.cache import VersionedLocalCache, CatalogueCache
 from utils.helper_funcs import ListAdapter
 
 
@@ -80,6 +81,9 @@ class NormalUser(models.Model):
     user = models.OneToOneField(
         User, on_delete=models.CASCADE, related_name="normal_user_user")
     score = models.FloatField(default=0)
+    # running totals of the metric scores other users gave this user, maintained by feedback.models.ScoreCalculator
+    score_sum = models.FloatField(default=0)
+    score_count = models.IntegerField(default=0)
 
     def __str__(self):
         return self.user.__str__()
@@ -141,37 +145,99 @@ class Speciality(models.Model):
         self.parent = parent
 
 
-class SpecialityCatalogue(metaclass=Singleton):
-    @property
-    def specialities(self):
-        return Speciality.objects.all()
+class SpecialityTree(metaclass=Singleton):
+    """In-memory snapshot of the whole Speciality tree, rebuilt after a Speciality is saved or deleted."""
+
+    def __init__(self):
+        self._snapshot = VersionedLocalCache('speciality-tree', self._build)
+
+    def _build(self):
+        nodes = {node['id']: node for node in
+                 Speciality.objects.order_by('id').values('id', 'title', 'description', 'parent_id')}
+        children = {pk: [] for pk in nodes}
+        for node in nodes.values():
+            if node['parent_id'] in children:
+                children[node['parent_id']].append(node['id'])
+        return nodes, children
+
+    def invalidate(self):
+        self._snapshot.invalidate()
+
+    def get(self, pk):
+        return self._snapshot.get()[0].get(pk)
+
+    def get_ids(self):
+        return list(self._snapshot.get()[0])
+
+    def get_children_ids(self, pk):
+        return self._snapshot.get()[1].get(pk, [])
+
+    def get_ancestor_ids(self, pk):
+        nodes = self._snapshot.get()[0]
+        ancestors = []
+        node = nodes.get(pk)
+        while node and node['parent_id'] in nodes and node['parent_id'] not in ancestors:
+            ancestors.append(node['parent_id'])
+            node = nodes[node['parent_id']]
+        return ancestors
 
     def search(self, query):
-        result = self.specialities
+        """Same filters as SpecialityCatalogue.search, answered from the snapshot. Returns matching ids."""
+        nodes, children = self._snapshot.get()
+        return self._search(nodes, children, query)
+
+    def _search(self, nodes, children, query):
+        ids = list(nodes)
         if query.get('id'):
-            result = result.filter(
-                pk__in=ListAdapter().python_ensure_list(query.get('id')))
+            wanted = set(ListAdapter().python_ensure_list(query.get('id')))
+            ids = [pk for pk in ids if pk in wanted]
         for field in ['title', 'description']:
             if query.get(field):
-                result = result.filter(
-                    Q(**{field + '__icontains': query[field]}))
+                needle = str(query[field]).casefold()
+                ids = [pk for pk in ids if needle in nodes[pk][field].casefold()]
         if query.get('is_leaf', 0):
-            result = result.filter(parent__isnull=False)
+            ids = [pk for pk in ids if nodes[pk]['parent_id'] is not None]
         if query.get('is_category', 0):
-            result = result.filter(parent__isnull=True)
+            ids = [pk for pk in ids if nodes[pk]['parent_id'] is None]
         if query.get('parent'):
-            parent_query = {
-                **query.get('parent'),
-            }
-            parent = SpecialityCatalogue().search(query=parent_query)
-            result = result.filter(parent__in=parent)
+            parents = set(self._search(nodes, children, query.get('parent')))
+            ids = [pk for pk in ids if nodes[pk]['parent_id'] in parents]
         if query.get('children'):
-            children_query = {
-                **query.get('children'),
-            }
-            children = SpecialityCatalogue().search(query=children_query)
-            result = result.filter(children__in=children)
-        return result
+            matched_children = set(self._search(nodes, children, query.get('children')))
+            ids = [pk for pk in ids if matched_children.intersection(children[pk])]
+        return ids
+
+    def to_representation(self, pk, with_parent=True):
+        """The dict SpecialitySerializer would produce for this node, including the nested children.
+
+        The snapshot is read once and the whole subtree is built from it, so a deep tree costs a single
+        version check against the shared cache.
+        """
+        nodes, children = self._snapshot.get()
+        return self._represent(nodes, children, pk)
+
+    def _represent(self, nodes, children, pk):
+        node = nodes.get(pk)
+        if node is None:
+            return None
+        parent = nodes.get(node['parent_id']) if node['parent_id'] is not None else None
+        return {
+            'id': node['id'],
+            'title': node['title'],
+            'description': node['description'],
+            'parent': {'id': parent['id'], 'title': parent['title'], 'description': parent['description']}
+            if parent else None,
+            'children': [self._represent(nodes, children, child) for child in children.get(pk, [])],
+        }
+
+
+class SpecialityCatalogue(metaclass=Singleton):
+    @property
+    def specialities(self):
+        return Speciality.objects.all()
+
+    def search(self, query):
+        return self.specialities.filter(pk__in=SpecialityTree().search(query))
 
 
 class Specialist(models.Model):
@@ -185,10 +251,16 @@ class Specialist(models.Model):
     documents = models.FileField(upload_to='documents/', blank=True, null=True)
     is_validated = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True)
+    # requests of this specialist that are not done or canceled, maintained by core.signals; save other changes
+    # to a specialist with update_fields so a stale copy of the count is not written back
+    active_request_count = models.IntegerField(default=0)
 
     def __str__(self):
         return self.normal_user.__str__()
 
+    def get_active_request_count(self):
+        return self.active_request_count
+
     def add_speciality(self, speciality: "Speciality"):
         self.speciality.add(speciality)
 
@@ -223,7 +295,7 @@ class ManagerUser(models.Model):
 
     def confirm_specialist(self, specialist: Specialist):
         specialist.set_validated(True)
-        specialist.save()
+        specialist.save(update_fields=['is_validated'])
 
     def __str__(self):
         return self.user.__str__()
@@ -257,6 +329,9 @@ class TechnicalManager(models.Model):
 
 
 class UserCatalogue(metaclass=Singleton):
+    def __init__(self):
+        self._cache = CatalogueCache('users', User)
+
     @property
     def users(self):
         return User.objects.all()
@@ -264,58 +339,61 @@ class UserCatalogue(metaclass=Singleton):
     VALID_SORT_FIELDS = ['score', 'first_name', 'last_name',
                          'phone', 'username', 'email', 'role', 'date_joined']
 
+    def invalidate(self, **kwargs):
+        self._cache.invalidate()
+
     def search(self, query):
-        result = self.users
-        print("QUERY", query)
+        return self._cache.search(query, self._search)
+
+    def build_filter(self, query, prefix=''):
+        """The filters of search as one Q over fields reached through prefix, e.g. 'customer__normal_user__user__'.
 
+        Nothing is annotated or ordered, so other catalogues can join it into their own queries.
+        """
+        condition = Q()
         if not query:
-            return result
+            return condition
         for field in ['id']:
             if query.get(field):
-                result = result.filter(
-                    pk__in=ListAdapter().python_ensure_list(query[field]))
+                condition &= Q(**{prefix + 'pk__in': ListAdapter().python_ensure_list(query[field])})
 
         for field in ['first_name', 'last_name', 'phone', 'username', 'email']:
             if query.get(field):
-                result = result.filter(
-                    Q(**{field + '__icontains': query[field]}))
+                condition &= Q(**{prefix + field + '__icontains': query[field]})
 
         if query.get('name'):
-            result = result.filter(
-                Q(**{'first_name__icontains': query['name']}) |
-                Q(**{'last_name__icontains': query['name']}) |
-                Q(**{'username__icontains': query['name']}))
+            condition &= Q(**{prefix + 'first_name__icontains': query['name']}) | \
+                         Q(**{prefix + 'last_name__icontains': query['name']}) | \
+                         Q(**{prefix + 'username__icontains': query['name']})
 
         if query.get('role'):
-            print(query.get('role'))
-            result = result.filter(Q(role=query['role']))
+            condition &= Q(**{prefix + 'role': query['role']})
         elif query.get('roles'):
-            roles = query['roles'].split(',')
-            result = result.filter(Q(role__in=roles))
+            condition &= Q(**{prefix + 'role__in': query['roles'].split(',')})
 
         if query.get('specialist_id'):
-            result = result.filter(
-                Q(normal_user_user__specialist_normal_user__exact=query['specialist_id']))
+            condition &= Q(**{prefix + 'normal_user_user__specialist_normal_user__exact': query['specialist_id']})
 
         if query.get('speciality'):
-            print("result", result)
-            specialists_result = result.filter(
-                Q(role=User.UserRole.Specialist))
-            other_roles_result = result.exclude(
-                Q(role=User.UserRole.Specialist))
-            speciality_ids = ListAdapter().python_ensure_list(
-                query['speciality'])
-            specialists_result = specialists_result.filter(
-                Q(**{'normal_user_user__specialist_normal_user__speciality__in': speciality_ids}))
-
-            print("SP", specialists_result)
-            print("OTHHTHTHT", other_roles_result)
-            result = specialists_result | other_roles_result
+            # only specialists are filtered by speciality, a subquery keeps the many-to-many from repeating rows
+            specialists = Specialist.objects.filter(
+                speciality__in=ListAdapter().python_ensure_list(query['speciality'])).values('pk')
+            is_specialist = Q(**{prefix + 'role': User.UserRole.Specialist})
+            condition &= (is_specialist & Q(**{prefix + 'normal_user_user__specialist_normal_user__in': specialists})) \
+                | ~is_specialist
 
         if query.get('requester_type'):
             if query.get('requester_type') == User.UserRole.Customer:
-                result = result.exclude(Q(role__in=[User.UserRole.Specialist]) & Q(
-                    normal_user_user__specialist_normal_user__is_validated=False))
+                condition &= ~(Q(**{prefix + 'role__in': [User.UserRole.Specialist]}) &
+                               Q(**{prefix + 'normal_user_user__specialist_normal_user__is_validated': False}))
+        return condition
+
+    def _search(self, query):
+        result = self.users
+
+        if not query:
+            return result
+        result = result.filter(self.build_filter(query))
 
         if query.get('sort'):
             result = result.annotate(
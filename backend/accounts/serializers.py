@@ -2,7 +2,7 @@ from rest_framework import serializers
 from rest_framework.serializers import ModelSerializer, SerializerMethodField
 
 from accounts.models import User, Customer, Specialist, TechnicalManager, CompanyManager, Speciality, NormalUser, \
-    ManagerUser
+    ManagerUser, SpecialityTree
 
 
 class FlattenMixin(object):
@@ -99,6 +99,13 @@ class SpecialitySerializer(ModelSerializer):
         fields['children'] = SpecialitySerializer(many=True)
         return fields
 
+    def to_representation(self, instance):
+        # the tree snapshot already holds parent and children, so nothing below this node is queried
+        representation = SpecialityTree().to_representation(instance.pk)
+        if representation is None:
+            return super(SpecialitySerializer, self).to_representation(instance)
+        return representation
+
     class Meta:
         model = Speciality
         fields = ('id', 'title', 'description', 'parent', 'children')
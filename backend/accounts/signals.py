@@ -0,0 +1,22 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from accounts.models import Speciality, SpecialityTree, User, NormalUser, Customer, Specialist, \
+    UserCatalogue
+
+
+@receiver([post_save, post_delete], sender=Speciality)
+def invalidate_speciality_tree(sender, **kwargs):
+    SpecialityTree().invalidate()
+
+
+@receiver([post_save, post_delete], sender=User)
+@receiver([post_save, post_delete], sender=NormalUser)
+@receiver([post_save, post_delete], sender=Customer)
+@receiver([post_save, post_delete], sender=Specialist)
+@receiver(m2m_changed, sender=Specialist.speciality.through)
+def invalidate_users(sender, update_fields=None, **kwargs):
+    # logging in only touches last_login, which no user search reads
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    UserCatalogue().invalidate()
@@ -1,3 +1,60 @@
+from unittest import mock
+
+from django.core.cache import cache
 from django.test import TestCase
 
-# Create your tests here.
+from accounts.models import User, UserCatalogue, SpecialityTree
+from utils.cache import CatalogueCache
+from utils.testing import create_customer, create_speciality
+
+
+class CatalogueCacheTest(TestCase):
+    QUERY = {'role': User.UserRole.Customer, 'sort': '-score,username'}
+
+    def setUp(self):
+        # scores repeat, so the order also depends on the second sort field
+        for i in range(60):
+            create_customer(score=i % 7)
+
+    def get_ids(self, queryset):
+        return list(queryset.values_list('pk', flat=True))
+
+    def test_cached_search_keeps_the_order_of_the_query(self):
+        expected = self.get_ids(UserCatalogue()._search(self.QUERY))
+        cache = CatalogueCache('test-users-ordered', User)
+        self.assertEqual(self.get_ids(cache.search(self.QUERY, UserCatalogue()._search)), expected)
+        # the second call is answered from the cache
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_ids(cache.search(self.QUERY, UserCatalogue()._search)), expected)
+
+    def test_cached_search_drops_annotations(self):
+        cache = CatalogueCache('test-users-annotations', User)
+        cache.search(self.QUERY, UserCatalogue()._search)
+        self.assertFalse(hasattr(cache.search(self.QUERY, UserCatalogue()._search).first(), 'score'))
+
+    def test_results_over_max_ids_are_not_cached(self):
+        cache = CatalogueCache('test-users-large', User, max_ids=10)
+        for _ in range(2):
+            result = cache.search(self.QUERY, UserCatalogue()._search)
+            # the builder's own queryset, annotations included
+            self.assertTrue(hasattr(result.first(), 'score'))
+        self.assertEqual(self.get_ids(result), self.get_ids(UserCatalogue()._search(self.QUERY)))
+
+
+class SpecialityTreeTest(TestCase):
+    def setUp(self):
+        self.root = create_speciality('root')
+        for i in range(3):
+            child = create_speciality('child', parent=self.root)
+            for j in range(3):
+                create_speciality('grandchild', parent=child)
+        SpecialityTree().invalidate()
+
+    def test_serializing_a_tree_reads_the_shared_cache_once(self):
+        SpecialityTree().to_representation(self.root.pk)
+        with mock.patch('utils.cache.cache.get', wraps=cache.get) as cache_get:
+            representation = SpecialityTree().to_representation(self.root.pk)
+        self.assertEqual(cache_get.call_count, 1)
+        self.assertEqual(len(representation['children']), 3)
+        self.assertEqual(sum(len(child['children']) for child in representation['children']), 9)
+        self.assertEqual(representation['children'][0]['parent']['id'], self.root.pk)
@@ -26,6 +26,7 @@ from feedback.serializers import EvaluationMetricSerializer, FeedbackReadOnlySer
 from accounts.constants import *
 from arno.settings import MEDIA_ROOT
 from log.models import Logger
+from utils.pagination import OffsetPaginator
 from utils.permissions import PermissionFactory, IsReadyOnlyRequest, IsPostRequest
 from .models import User, UserCatalogue, Speciality, Specialist, NormalUser, CompanyManager, ManagerUser, \
     TechnicalManager, Customer, SpecialityCatalogue
@@ -180,7 +181,7 @@ class EditProfileView(APIView):
             if 'is_active' in request.data:
                 is_active = request.data.get('is_active', True)
                 user.full_user.set_active(is_active)
-                user.full_user.save()
+                user.full_user.save(update_fields=['is_active'])
 
         user.save()
 
@@ -408,8 +409,8 @@ class DocumentUploadView(APIView):
         spec = request.user.full_user
         with open(MEDIA_ROOT + "/" + full_name, 'rb') as fh:
             with ContentFile(fh.read()) as file_content:
-                spec.documents.save(full_name, file_content)
-                spec.save()
+                spec.documents.save(full_name, file_content, save=False)
+                spec.save(update_fields=['documents'])
 
         return Response(up_file.name, HTTP_201_CREATED)
 
@@ -442,49 +443,36 @@ class UserSatisfactionView(APIView):
         if role not in [User.UserRole.Customer, User.UserRole.Specialist]:
             return JsonResponse({'error': INVALID_ROLE}, status=status.HTTP_400_BAD_REQUEST)
 
-        users = UserCatalogue().search({'role': role})
-        print(users)
+        summaries = FeedbackCatalogue().search_satisfaction(role, threshold, after, ordering)
+        page = list(OffsetPaginator(unique_field='user').paginate(summaries, query.get('offset'), query.get('limit')))
+        user_ids = [summary['user'] for summary in page]
 
-        user_serialized_data = []
         if role == User.UserRole.Customer:
-            user_serialized_data = [CustomerFullSerializer(
-                u.full_user).data for u in users]
+            full_users = Customer.objects.filter(normal_user__in=user_ids).select_related('normal_user__user')
+            user_serializer = CustomerFullSerializer
         else:
-            user_serialized_data = [SpecialistFullSerializer(
-                u.full_user).data for u in users]
+            full_users = Specialist.objects.filter(normal_user__in=user_ids).select_related('normal_user__user') \
+                .prefetch_related('speciality')
+            user_serializer = SpecialistFullSerializer
+        full_users = {full_user.normal_user_id: full_user for full_user in full_users}
+
+        bad_feedbacks = FeedbackCatalogue().with_average_score(FeedbackCatalogue().search({'after': after})) \
+            .filter(user__in=user_ids, average_score__lt=threshold) \
+            .select_related('user__user').prefetch_related('metric_scores__metric')
+        bad_feedbacks_by_user = {}
+        for feedback in bad_feedbacks:
+            bad_feedbacks_by_user.setdefault(feedback.user_id, []).append(feedback)
 
         result = []
-        for i, user in enumerate(users):
-            feedback_query = {'user': user.id}
-            if after:
-                feedback_query['after'] = after
-            user_feedbacks = FeedbackCatalogue().search(feedback_query)
-
-            bad_feedbacks = []
-            bad_metrics = set()
-            average_sum = 0
-            for feedback in user_feedbacks:
-                average_sum += feedback.get_average_score()
-                if feedback.get_average_score() < threshold:
-                    bad_feedbacks.append(feedback)
-                    for metric_score in feedback.metric_scores.all():
-                        if metric_score.score < threshold:
-                            bad_metrics.add(metric_score.metric)
-
-            if len(bad_feedbacks) > 0:
-                result.append({'user': user_serialized_data[i],
-                               'total_feedbacks_count': user_feedbacks.count(),
-                               'bad_feedbacks': FeedbackReadOnlySerializer(bad_feedbacks, many=True).data,
-                               'bad_metrics': EvaluationMetricSerializer(list(bad_metrics), many=True).data,
-                               'average_score': average_sum / user_feedbacks.count()})
-
-        if ordering == 'bad_feedbacks':
-            result.sort(key=lambda a: -len(a['bad_feedbacks']))
-        elif ordering == 'total_feedbacks':
-            result.sort(key=lambda a: -a['total_feedbacks_count'])
-        elif ordering == 'ratio':
-            result.sort(key=lambda a: -len(a['bad_feedbacks'])/a['total_feedbacks_count'])
-        else:
-            result.sort(key=lambda a: a['average_score'])
+        for summary in page:
+            user_bad_feedbacks = bad_feedbacks_by_user.get(summary['user'], [])
+            bad_metrics = {metric_score.metric_id: metric_score.metric
+                           for feedback in user_bad_feedbacks
+                           for metric_score in feedback.metric_scores.all() if metric_score.score < threshold}
+            result.append({'user': user_serializer(full_users[summary['user']]).data,
+                           'total_feedbacks_count': summary['total_feedbacks_count'],
+                           'bad_feedbacks': FeedbackReadOnlySerializer(user_bad_feedbacks, many=True).data,
+                           'bad_metrics': EvaluationMetricSerializer(list(bad_metrics.values()), many=True).data,
+                           'average_score': summary['average_score']})
 
         return JsonResponse(result, safe=False)
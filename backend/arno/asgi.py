@@ -2,6 +2,7 @@
 ASGI config for arno project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP is served by Django, websockets by the consumers in notification.routing.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
@@ -13,4 +14,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'arno.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# imported after setup, consumers load models
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+
+from notification.routing import websocket_urlpatterns  # noqa: E402
+from utils.websocket import TokenAuthMiddleware  # noqa: E402
+
+application = ProtocolTypeRouter({
+    'http': django_application,
+    'websocket': TokenAuthMiddleware(URLRouter(websocket_urlpatterns)),
+})
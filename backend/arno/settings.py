@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 import os
+import sys
 
 import environ
 from corsheaders.defaults import default_headers
@@ -48,6 +49,68 @@ DEBUG = env("DEBUG")
 
 USE_SCORE_LIMIT = True
 
+# Ranking of core.matching.SpecialistMatcher: points per unit of score, minus points per active request and per
+# kilometer away; distances are capped at MATCHING_MAX_DISTANCE_KM, which specialists with no known location count as
+MATCHING_SCORE_WEIGHT = config("MATCHING_SCORE_WEIGHT", default=1.0, cast=float)
+MATCHING_LOAD_WEIGHT = config("MATCHING_LOAD_WEIGHT", default=10.0, cast=float)
+MATCHING_DISTANCE_WEIGHT = config("MATCHING_DISTANCE_WEIGHT", default=0.5, cast=float)
+MATCHING_MAX_DISTANCE_KM = config("MATCHING_MAX_DISTANCE_KM", default=50.0, cast=float)
+MATCHING_MAX_LIMIT = config("MATCHING_MAX_LIMIT", default=50, cast=int)
+
+# The cache holds the version counters utils.cache uses to tell every worker that a catalogue changed, so it
+# must be shared by all of them: rediscache://host:6379/1 with CACHE_BACKEND=django_redis.cache.RedisCache (as
+# docker-compose sets up), or filecache:///var/tmp/arno when every worker runs on one host. The locmemcache://
+# default is per process and is only correct for a single process, e.g. tests.
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+if config("CACHE_BACKEND", default=''):
+    CACHES['default']['BACKEND'] = config("CACHE_BACKEND")
+# How long utils.cache.CatalogueCache keeps catalogue results, and the largest search result it keeps
+CATALOGUE_CACHE_TIMEOUT = config("CATALOGUE_CACHE_TIMEOUT", default=300, cast=int)
+CATALOGUE_CACHE_MAX_IDS = config("CATALOGUE_CACHE_MAX_IDS", default=500, cast=int)
+
+# Threads available to utils.background.BackgroundRunner for work kept off the request path
+BACKGROUND_WORKERS = config("BACKGROUND_WORKERS", default=2, cast=int)
+
+# Buffered log sink used by log.models.Logger
+# off under 'manage.py test', so records are written inside the test's transaction like any other row
+LOG_BUFFER_ENABLED = config("LOG_BUFFER_ENABLED", default=sys.argv[1:2] != ['test'], cast=bool)
+LOG_BUFFER_SIZE = config("LOG_BUFFER_SIZE", default=10000, cast=int)
+LOG_BUFFER_BATCH_SIZE = config("LOG_BUFFER_BATCH_SIZE", default=500, cast=int)
+LOG_BUFFER_FLUSH_INTERVAL = config("LOG_BUFFER_FLUSH_INTERVAL", default=2.0, cast=float)
+# 'drop' discards records when the buffer is full, 'block' waits up to LOG_BUFFER_BLOCK_TIMEOUT seconds
+LOG_BUFFER_OVERFLOW = config("LOG_BUFFER_OVERFLOW", default='drop')
+LOG_BUFFER_BLOCK_TIMEOUT = config("LOG_BUFFER_BLOCK_TIMEOUT", default=0.5, cast=float)
+
+# Days each log level is kept before `manage.py prune_logs` archives and deletes it, None keeps it forever
+LOG_RETENTION_DAYS = {
+    'D': 7,
+    'I': 30,
+    'W': 90,
+    'E': 180,
+    'C': 365,
+}
+LOG_RETENTION_BATCH_SIZE = config("LOG_RETENTION_BATCH_SIZE", default=5000, cast=int)
+LOG_ARCHIVE_DIR = config("LOG_ARCHIVE_DIR", default=os.path.join(CORE_DIR, 'log_archive'))
+
+# Longest a notification poll with ?wait= may block for a change, and how often it checks while waiting
+NOTIFICATION_LONG_POLL_MAX_WAIT = config("NOTIFICATION_LONG_POLL_MAX_WAIT", default=25, cast=int)
+NOTIFICATION_LONG_POLL_INTERVAL = config("NOTIFICATION_LONG_POLL_INTERVAL", default=0.5, cast=float)
+
+# Channel layer behind the websocket push in notification.consumers; the in-memory layer only reaches
+# sockets of the same process, use e.g. channels_redis.core.RedisChannelLayer with CHANNEL_LAYER_HOSTS on more nodes
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': config("CHANNEL_LAYER_BACKEND", default='channels.layers.InMemoryChannelLayer'),
+        'CONFIG': {
+            'hosts': config("CHANNEL_LAYER_HOSTS", default='', cast=lambda v: [h for h in v.split(',') if h]),
+        },
+    },
+}
+if not CHANNEL_LAYERS['default']['CONFIG']['hosts']:
+    del CHANNEL_LAYERS['default']['CONFIG']
+
 AUTH_USER_MODEL = 'accounts.User'
 
 ALLOWED_HOSTS = [
@@ -68,7 +131,10 @@ INSTALLED_APPS = [
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
+    # before staticfiles, so runserver serves websockets too
+    'channels',
     'django.contrib.staticfiles',
+    'django.contrib.gis',
     'accounts.apps.AccountsConfig',
     'core.apps.CoreConfig',
     'feedback.apps.FeedbackConfig',
@@ -114,9 +180,14 @@ CORS_ALLOW_HEADERS  = list(default_headers) + [
     "pragma",
     "Pragma",
     "Expires",
-    "expires"
+    "expires",
+    "If-None-Match",
+    "if-none-match",
 ]
 
+# lets browser clients read the version of the notification list for conditional requests
+CORS_EXPOSE_HEADERS = ["ETag"]
+
 
 ROOT_URLCONF = 'arno.urls'
 
@@ -137,6 +208,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'arno.wsgi.application'
+ASGI_APPLICATION = 'arno.asgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
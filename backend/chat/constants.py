@@ -0,0 +1 @@
+INVALID_CURSOR_ERROR = u"نشانگر صفحه نامعتبر است"
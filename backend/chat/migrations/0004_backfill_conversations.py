@@ -0,0 +1,34 @@
+from django.db import migrations
+from django.db.models import Max, Count
+
+
+def backfill_conversations(apps, schema_editor):
+    Message = apps.get_model('chat', 'Message')
+    Conversation = apps.get_model('chat', 'Conversation')
+
+    latest = {}
+    for row in Message.objects.values('sender', 'receiver').annotate(last_id=Max('id')):
+        for owner, peer in ((row['sender'], row['receiver']), (row['receiver'], row['sender'])):
+            latest[owner, peer] = max(latest.get((owner, peer), 0), row['last_id'])
+    unread = {
+        (row['receiver'], row['sender']): row['count']
+        for row in Message.objects.filter(is_read=False).values('sender', 'receiver').annotate(count=Count('id'))
+    }
+    messages = Message.objects.in_bulk(set(latest.values()))
+
+    Conversation.objects.bulk_create([
+        Conversation(owner_id=owner, peer_id=peer, last_message_id=last_id,
+                     updated_at=messages[last_id].created_at, unread_count=unread.get((owner, peer), 0))
+        for (owner, peer), last_id in latest.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_conversation'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_conversations, migrations.RunPython.noop),
+    ]
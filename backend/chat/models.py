@@ -1,10 +1,12 @@
-from django.db import models
-from django.db.models import Q, When, Case
+from django.db import models, transaction, IntegrityError
+from django.db.models import Q, When, Case, F, Count, Sum
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 import accounts.models
 from accounts.models import NormalUser
 from utils.Singleton import Singleton
+from utils.pagination import KeysetPaginator
 
 
 class Message(models.Model):
@@ -21,6 +23,11 @@ class Message(models.Model):
     type = models.CharField(max_length=1, choices=MessageType.choices)
     is_read = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['sender', 'receiver', '-created_at', '-id'], name='chat_message_pair_idx'),
+        ]
+
     def get_time(self):
         return self.created_at
 
@@ -34,12 +41,122 @@ class Message(models.Model):
         return self.text
 
 
+class Conversation(models.Model):
+    """One user's view of their chat with a peer; every exchanged message updates both sides."""
+    owner = models.ForeignKey(
+        accounts.models.NormalUser, on_delete=models.CASCADE, related_name='conversations')
+    peer = models.ForeignKey(
+        accounts.models.NormalUser, on_delete=models.CASCADE, related_name='+')
+    last_message = models.ForeignKey(Message, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    unread_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'peer'], name='chat_conversation_owner_peer'),
+        ]
+        indexes = [
+            models.Index(fields=['owner', '-updated_at', '-id'], name='chat_conversation_inbox_idx'),
+        ]
+
+    def get_peer(self):
+        return self.peer
+
+    def get_last_message(self):
+        return self.last_message
+
+    def get_unread_count(self):
+        return self.unread_count
+
+
+class ConversationCatalogue(metaclass=Singleton):
+    @property
+    def conversations(self):
+        return Conversation.objects.all()
+
+    def get_inbox(self, user: NormalUser):
+        return self.conversations.filter(owner=user).select_related('peer__user', 'last_message')
+
+    def record_message(self, message: Message):
+        self._upsert(message.sender, message.receiver, message, unread=0)
+        self._upsert(message.receiver, message.sender, message, unread=1)
+
+    def mark_read(self, user: NormalUser, peer: NormalUser):
+        self.conversations.filter(owner=user, peer=peer).update(unread_count=0)
+
+    def get_unread(self, user: NormalUser):
+        """The conversations of the user with unread messages."""
+        return self.conversations.filter(owner=user, unread_count__gt=0)
+
+    def get_unread_count(self, user: NormalUser):
+        return self.conversations.filter(owner=user).aggregate(total=Sum('unread_count'))['total'] or 0
+
+    def reconcile_unread(self):
+        """Rebuilds every unread count from the messages; returns the number of conversations changed."""
+        with transaction.atomic():
+            counts = {
+                (receiver, sender): count for receiver, sender, count in
+                Message.objects.filter(is_read=False).values_list('receiver', 'sender').annotate(Count('id'))
+            }
+            changed = []
+            for conversation in self.conversations.select_for_update().only('owner', 'peer', 'unread_count'):
+                count = counts.get((conversation.owner_id, conversation.peer_id), 0)
+                if conversation.unread_count != count:
+                    conversation.unread_count = count
+                    changed.append(conversation)
+            Conversation.objects.bulk_update(changed, ['unread_count'], batch_size=1000)
+        return len(changed)
+
+    def _upsert(self, owner, peer, message, unread):
+        changes = {'last_message': message, 'updated_at': message.created_at,
+                   'unread_count': F('unread_count') + unread}
+        if self.conversations.filter(owner=owner, peer=peer).update(**changes):
+            return
+        try:
+            with transaction.atomic():
+                Conversation.objects.create(owner=owner, peer=peer, last_message=message,
+                                            updated_at=message.created_at, unread_count=unread)
+        except IntegrityError:
+            # another request created the row first
+            self.conversations.filter(owner=owner, peer=peer).update(**changes)
+
+
 class MessageCatalogue(metaclass=Singleton):
-    messages = Message.objects.all()
+    @property
+    def messages(self):
+        return Message.objects.all()
+
+    def between(self, user: NormalUser, peer: NormalUser):
+        """The messages of a conversation, one queryset per direction so each walks its own index."""
+        return [
+            self.messages.filter(sender=user, receiver=peer),
+            self.messages.filter(sender=peer, receiver=user),
+        ]
+
+    def get_history(self, user: NormalUser, peer: NormalUser, cursor=None, limit=None):
+        """A page of the messages between two users, newest first, and the cursor of the next page."""
+        directions = [messages.select_related('sender__user', 'receiver__user')
+                      for messages in self.between(user, peer)]
+        return KeysetPaginator().paginate_many(directions, cursor, limit)
+
+    def send(self, sender: NormalUser, receiver: NormalUser, text: str, type=Message.MessageType.User):
+        message = Message(sender=sender, receiver=receiver, text=text, type=type)
+        with transaction.atomic():
+            message.save()
+            ConversationCatalogue().record_message(message)
+        return message
+
+    def mark_read(self, user: NormalUser, peer: NormalUser):
+        """Marks what the peer sent to the user as read; returns the number of messages changed."""
+        with transaction.atomic():
+            count = self.messages.filter(sender=peer, receiver=user, is_read=False).update(is_read=True)
+            ConversationCatalogue().mark_read(user, peer)
+        return count
 
     def search(self, user: NormalUser, peer_id: int = None):
+        messages = self.messages.select_related('sender__user', 'receiver__user')
         if not peer_id:
-            return self.messages \
+            return messages \
                 .filter(Q(sender__user__pk=user.pk) | Q(receiver__user__pk=user.pk)) \
                 .annotate(peer=Case(
                 When(sender__user__pk=user.pk, then='receiver'),
@@ -48,7 +165,7 @@ class MessageCatalogue(metaclass=Singleton):
                 .order_by('peer', '-created_at') \
                 .distinct('peer')
         else:
-            return self.messages \
+            return messages \
                 .filter(
                 (Q(sender__user__pk=user.pk) & Q(receiver__user__pk=peer_id)) |
                 (Q(sender__user__pk=peer_id) & Q(receiver__user__pk=user.pk))
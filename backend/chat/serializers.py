@@ -1,7 +1,7 @@
 from rest_framework.serializers import ModelSerializer
 from accounts.serializers import NormalUserSerializer
 
-from .models import Message
+from .models import Message, Conversation
 
 
 class MessageSerializer(ModelSerializer):
@@ -11,3 +11,18 @@ class MessageSerializer(ModelSerializer):
     class Meta:
         model = Message
         fields = '__all__'
+
+
+class ConversationMessageSerializer(ModelSerializer):
+    class Meta:
+        model = Message
+        fields = ('id', 'sender', 'receiver', 'text', 'type', 'is_read', 'created_at')
+
+
+class ConversationSerializer(ModelSerializer):
+    peer = NormalUserSerializer()
+    last_message = ConversationMessageSerializer()
+
+    class Meta:
+        model = Conversation
+        fields = ('id', 'peer', 'last_message', 'unread_count', 'updated_at')
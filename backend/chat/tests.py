@@ -1,3 +1,116 @@
+import gc
+import tracemalloc
+
 from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from chat.models import Message, MessageCatalogue
+from utils.testing import create_customer, create_specialist
+
+
+class ConversationsViewTest(APITestCase):
+    def setUp(self):
+        self.owner = create_customer().normal_user
+        self.peers = [create_specialist().normal_user for _ in range(3)]
+        for peer in self.peers:
+            MessageCatalogue().send(peer, self.owner, 'hello')
+        self.client.force_authenticate(self.owner.user)
+
+    def get_page(self, cursor=None):
+        params = {'limit': 1}
+        if cursor:
+            params['cursor'] = cursor
+        response = self.client.get(reverse('conversations'), params)
+        self.assertEqual(response.status_code, 200)
+        page = response.json()
+        return [conversation['id'] for conversation in page['conversations']], page['next_cursor']
+
+    def walk(self, on_first_page=None):
+        ids, cursor = self.get_page()
+        if on_first_page:
+            on_first_page()
+        while cursor:
+            page, cursor = self.get_page(cursor)
+            ids += page
+        return ids
+
+    def test_newest_conversation_comes_first(self):
+        self.assertEqual(len(self.walk()), 3)
+        MessageCatalogue().send(self.peers[0], self.owner, 'again')
+        first, _ = self.get_page()
+        self.assertEqual(len(first), 1)
+        self.assertEqual(self.walk()[0], first[0])
+
+    def test_conversation_updated_during_a_walk_is_not_repeated(self):
+        # the oldest conversation jumps ahead of the cursor, so the walk skips it instead of showing it twice
+        ids = self.walk(lambda: MessageCatalogue().send(self.peers[0], self.owner, 'again'))
+        self.assertEqual(len(ids), 2)
+        self.assertEqual(len(set(ids)), 2)
+
+
+class ChatHistoryViewTest(APITestCase):
+    def setUp(self):
+        self.owner = create_customer().normal_user
+        self.peer = create_specialist().normal_user
+        self.messages = [MessageCatalogue().send(self.peer, self.owner, str(i)) for i in range(3)]
+        self.client.force_authenticate(self.owner.user)
+
+    def get_history(self, **params):
+        response = self.client.get(reverse('chats', kwargs={'peer_id': self.peer.user_id}), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_history_is_a_plain_list_when_not_paged(self):
+        history = self.get_history()
+        self.assertEqual([message['id'] for message in history], [message.pk for message in reversed(self.messages)])
+        self.assertFalse(Message.objects.filter(receiver=self.owner, is_read=False).exists())
+
+    def test_history_is_paged_when_asked(self):
+        page = self.get_history(limit=2)
+        self.assertEqual([message['id'] for message in page['messages']],
+                         [self.messages[2].pk, self.messages[1].pk])
+        page = self.get_history(limit=2, cursor=page['next_cursor'])
+        self.assertEqual([message['id'] for message in page['messages']], [self.messages[0].pk])
+        self.assertIsNone(page['next_cursor'])
+
+
+class MessageCatalogueMemoryTest(TestCase):
+    def setUp(self):
+        self.user = create_customer().normal_user
+        self.peer = create_specialist().normal_user
+
+    def add_messages(self, count):
+        Message.objects.bulk_create([Message(sender=self.peer, receiver=self.user, text='x' * 100)
+                                     for _ in range(count)])
+
+    def retained_after_reads(self):
+        """Bytes still allocated after reading every page of the history ten times."""
+        gc.collect()
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            for _ in range(10):
+                cursor = None
+                while True:
+                    _, cursor = MessageCatalogue().get_history(self.user, self.peer, cursor, 100)
+                    if cursor is None:
+                        break
+            gc.collect()
+            return tracemalloc.get_traced_memory()[0] - before
+        finally:
+            tracemalloc.stop()
+
+    def test_messages_is_a_fresh_queryset(self):
+        self.add_messages(3)
+        list(MessageCatalogue().messages)
+        self.assertIsNot(MessageCatalogue().messages, MessageCatalogue().messages)
+        self.assertIsNone(MessageCatalogue().messages._result_cache)
 
-# Create your tests here.
+    def test_memory_does_not_grow_with_message_volume(self):
+        self.add_messages(200)
+        small = self.retained_after_reads()
+        self.add_messages(4800)
+        large = self.retained_after_reads()
+        # reading 25x the messages keeps nothing per message once the pages are dropped
+        self.assertLess(large - small, 256 * 1024)
@@ -1,8 +1,9 @@
 from django.urls import path
 
-from chat.views import ChatsView
+from chat.views import ChatsView, ConversationsView
 
 urlpatterns = [
     path('all/', ChatsView.as_view(), name='chats'),
     path('all/<int:peer_id>/', ChatsView.as_view(), name='chats'),
+    path('conversations/', ConversationsView.as_view(), name='conversations'),
 ]
@@ -1,13 +1,17 @@
 from django.http import JsonResponse
 from knox.auth import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.status import HTTP_400_BAD_REQUEST
 from rest_framework.views import APIView
 
 from accounts.models import NormalUser
-from chat.models import MessageCatalogue, Message
-from chat.serializers import MessageSerializer
+from chat.constants import *
+from chat.models import MessageCatalogue, ConversationCatalogue
+from chat.serializers import MessageSerializer, ConversationSerializer
 from log.models import Logger
 from notification.notifications import BaseNotification, NewMessageNotification
+from notification.push import PushPublisher
+from utils.pagination import KeysetPaginator, InvalidCursor
 
 
 class ChatsView(APIView):
@@ -20,15 +24,35 @@ class ChatsView(APIView):
 
         if not peer_id:
             messages = MessageCatalogue().search(user)
-        else:
+            serialized = MessageSerializer(messages, many=True)
+            return JsonResponse(serialized.data, safe=False)
+
+        paged = request.GET.get('cursor') is not None or request.GET.get('limit') is not None
+        try:
+            user_n = NormalUser.objects.get(user__pk=user.pk)
+            peer = NormalUser.objects.get(user__pk=peer_id)
+        except NormalUser.DoesNotExist:
+            return JsonResponse({'messages': [], 'next_cursor': None}) if paged else JsonResponse([], safe=False)
+
+        if not paged:
+            # clients that don't page still get the whole history as a plain list
             messages = MessageCatalogue().search(user, peer_id)
+            next_cursor = None
+        else:
+            try:
+                messages, next_cursor = MessageCatalogue().get_history(
+                    user_n, peer, request.GET.get('cursor'), request.GET.get('limit'))
+            except InvalidCursor:
+                return JsonResponse({'error': INVALID_CURSOR_ERROR}, status=HTTP_400_BAD_REQUEST)
 
         serialized = MessageSerializer(messages, many=True)
 
-        if peer_id:  # if user get messages from one person mark all of them as read
-            messages.filter(receiver__user__pk=user.pk).update(is_read=True)
+        # if user get messages from one person mark all of them as read
+        MessageCatalogue().mark_read(user_n, peer)
 
-        return JsonResponse(serialized.data, safe=False)
+        if not paged:
+            return JsonResponse(serialized.data, safe=False)
+        return JsonResponse({'messages': serialized.data, 'next_cursor': next_cursor})
 
     @Logger().log_name()
     def post(self, request, peer_id=None):
@@ -45,11 +69,37 @@ class ChatsView(APIView):
         except NormalUser.DoesNotExist:
             return JsonResponse()
 
-        message = Message(receiver=peer, sender=user_n, text=text,
-                          type=Message.MessageType.User)
-        message.save()
+        message = MessageCatalogue().send(user_n, peer, text)
+        serialized = MessageSerializer(message)
+        PushPublisher().publish(peer.user_id, 'message', serialized.data)
 
         self.notification_builder(message).build()
 
-        serialized = MessageSerializer(message)
         return JsonResponse(serialized.data, safe=False)
+
+
+class ConversationsView(APIView):
+    """The user's inbox, most recently active conversation first.
+
+    Pages are keyed on (updated_at, id). A new message moves its conversation ahead of any cursor already handed
+    out, so a walk through the pages never repeats a conversation but skips the ones that got a message while it
+    was under way; clients pick those up from the first page or from the 'message' push.
+    """
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    @Logger().log_name()
+    def get(self, request):
+        try:
+            user_n = NormalUser.objects.get(user__pk=request.user.pk)
+        except NormalUser.DoesNotExist:
+            return JsonResponse({'conversations': [], 'next_cursor': None})
+
+        try:
+            conversations, next_cursor = KeysetPaginator(time_field='updated_at').paginate(
+                ConversationCatalogue().get_inbox(user_n), request.GET.get('cursor'), request.GET.get('limit'))
+        except InvalidCursor:
+            return JsonResponse({'error': INVALID_CURSOR_ERROR}, status=HTTP_400_BAD_REQUEST)
+
+        serialized = ConversationSerializer(conversations, many=True)
+        return JsonResponse({'conversations': serialized.data, 'next_cursor': next_cursor})
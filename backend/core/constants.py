@@ -24,6 +24,8 @@ REQUEST_ALREADY_DONE_ERROR = u'درخواست از قبل انجام شده اس
 REQUEST_NOT_IN_PROGRESS = u'درخواست در حال انجام نیست'
 YOU_ALREADY_REQUESTED_THIS_SPECIALTY_ERROR = u"شما از قبل برای این تخصص درخواست داده‌اید"
 INVALID_REQUEST = u"درخواست نامعتبر"
+INVALID_TIMESTAMP_ERROR = u"زمان داده شده نامعتبر است"
+INVALID_LOCATION_ERROR = u"موقعیت مکانی داده شده نامعتبر است"
 CANNOT_EDIT_SOMEONE_ELSE_REQUEST = u"شما نمی‌توانید درخواست فرد دیگری را ویرایش کنید."
 REQUEST_NOT_IN_EDITABLE_STATE = u"درخواست در وضعیت قابل ویرایش نیست"
 CANNOT_EDIT_SPECIALSIT = "شما اجازه تغییر متخصص را ندارید"
@@ -34,3 +36,4 @@ SPECIALIST_ID_REQUIRED_ERROR = "specialist_id is required"
 REQUEST_ID_REQUIRED_ERROR = "request_id is required"
 
 REQUEST_LIMIT_REACHED_ERROR = u"شما با توجه به میزان امتیاز خود به سقف مجاز درخواست رسیده‌اید"
+SPECIALIST_REQUEST_LIMIT_REACHED_ERROR = u"متخصص انتخاب شده به سقف مجاز درخواست‌های خود رسیده است"
@@ -0,0 +1,117 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from accounts.models import Customer, NormalUser, Specialist, Speciality, SpecialityTree, User
+from core.matching import SpecialistMatcher
+from core.models import Location, Request, RequestCatalogue
+
+
+class Command(BaseCommand):
+    help = 'Times SpecialistMatcher against synthetic specialists, in a transaction that is rolled back afterwards'
+
+    # synthetic locations are spread over this (south, west, north, east) box
+    AREA = (35.55, 51.15, 35.85, 51.65)
+
+    def add_arguments(self, parser):
+        parser.add_argument('--specialists', type=int, default=100000)
+        parser.add_argument('--specialities', type=int, default=20)
+        parser.add_argument('--runs', type=int, default=50)
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--explain', action='store_true', help='print the plan of the last match')
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        try:
+            with transaction.atomic():
+                self.benchmark(options)
+                transaction.set_rollback(True)
+        finally:
+            # the tree was rebuilt with the rolled back specialities
+            SpecialityTree().invalidate()
+
+    def benchmark(self, options):
+        started = time.monotonic()
+        leaves, specialists, customer, locations = self.populate(options)
+        self.stdout.write(f"Created {len(specialists)} specialists in {time.monotonic() - started:.2f}s")
+
+        started = time.monotonic()
+        SpecialistMatcher().rebuild()
+        self.stdout.write(f"Rebuilt match profiles in {time.monotonic() - started:.2f}s")
+        # the requests were bulk created, so no signal counted them
+        started = time.monotonic()
+        RequestCatalogue().reconcile_active_counts()
+        self.stdout.write(f"Reconciled active request counts in {time.monotonic() - started:.2f}s")
+
+        requests = Request.objects.bulk_create([
+            Request(customer=customer, requested_speciality=random.choice(leaves), location=random.choice(locations),
+                    desired_start_time=timezone.now() + timedelta(days=1))
+            for _ in range(options['runs'])])
+        requests = Request.objects.select_related('location').filter(pk__in=[request.pk for request in requests])
+
+        timings, queries, found = [], [], []
+        for request in requests:
+            with CaptureQueriesContext(connection) as context:
+                started = time.monotonic()
+                found.append(len(list(SpecialistMatcher().match(request, options['limit']))))
+                timings.append((time.monotonic() - started) * 1000)
+            queries.append(len(context.captured_queries))
+        timings.sort()
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(timings)} matches: p50 {statistics.median(timings):.1f}ms, "
+            f"p95 {timings[int(len(timings) * 0.95) - 1]:.1f}ms, max {timings[-1]:.1f}ms, "
+            f"{statistics.mean(queries):.1f} queries and {statistics.mean(found):.1f} specialists each"))
+        if options['explain']:
+            self.stdout.write(SpecialistMatcher().match(requests[0], options['limit']).explain(analyze=True))
+
+    def populate(self, options):
+        count = options['specialists']
+        tag = random.randrange(10 ** 6)
+        category = Speciality.objects.create(title=f'benchmark {tag}', description='')
+        leaves = [Speciality.objects.create(title=f'benchmark {tag}-{i}', description='', parent=category)
+                  for i in range(options['specialities'])]
+
+        users = User.objects.bulk_create([
+            User(username=f'bench-{tag}-{i}', email=f'bench-{tag}-{i}@example.com', phone=f'+{tag:06d}{i:08d}',
+                 role=User.UserRole.Specialist if i < count else User.UserRole.Customer, password='!')
+            for i in range(count + 1)], batch_size=5000)
+        normal_users = NormalUser.objects.bulk_create([
+            NormalUser(user=user, score=random.uniform(0, 100)) for user in users], batch_size=5000)
+        customer = Customer.objects.create(normal_user=normal_users.pop())
+        specialists = Specialist.objects.bulk_create([
+            Specialist(normal_user=normal_user, is_validated=random.random() < 0.9) for normal_user in normal_users],
+            batch_size=5000)
+
+        through = Specialist.speciality.through
+        rows = []
+        for specialist in specialists:
+            for speciality in random.sample(leaves, random.randint(1, 3)):
+                rows.append(through(specialist_id=specialist.pk, speciality_id=speciality.pk))
+            if random.random() < 0.1:
+                rows.append(through(specialist_id=specialist.pk, speciality_id=category.pk))
+        through.objects.bulk_create(rows, batch_size=10000)
+
+        south, west, north, east = self.AREA
+        locations = []
+        for i in range(1000):
+            latitude, longitude = random.uniform(south, north), random.uniform(west, east)
+            locations.append(Location(address=f'benchmark {i}', latitude=latitude, longitude=longitude,
+                                      point=Point(longitude, latitude, srid=4326)))
+        locations = Location.objects.bulk_create(locations)
+
+        # about one request in progress, done or waiting for every two specialists, for load and last locations
+        statuses = [status for status in Request.RequestStatus.values if status != Request.RequestStatus.PENDING]
+        Request.objects.bulk_create([
+            Request(customer=customer, specialist=random.choice(specialists),
+                    requested_speciality=random.choice(leaves), location=random.choice(locations),
+                    status=random.choice(statuses), desired_start_time=timezone.now())
+            for _ in range(count // 2)], batch_size=5000)
+        return leaves, specialists, customer, locations
@@ -0,0 +1,14 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.matching import SpecialistMatcher
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the specialist match profiles from the specialists and their requests'
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        count = SpecialistMatcher().rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} match profiles in {time.monotonic() - started:.2f}s"))
@@ -0,0 +1,14 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.models import RequestPopularity
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the hourly and daily request popularity buckets from the requests'
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        count = RequestPopularity().rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Wrote {count} popularity buckets in {time.monotonic() - started:.2f}s"))
@@ -0,0 +1,14 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.models import RequestCatalogue
+
+
+class Command(BaseCommand):
+    help = "Rebuilds every specialist's active request count from their requests"
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        count = RequestCatalogue().reconcile_active_counts()
+        self.stdout.write(self.style.SUCCESS(f"Fixed {count} active request counts in {time.monotonic() - started:.2f}s"))
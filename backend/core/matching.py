@@ -0,0 +1,86 @@
+from django.contrib.gis.db.models.functions import GeometryDistance
+from django.db import transaction
+from django.db.models import Exists, ExpressionWrapper, F, FloatField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Least
+from django.utils import timezone
+
+from accounts.models import Specialist, SpecialityTree
+from arno.settings import MATCHING_SCORE_WEIGHT, MATCHING_LOAD_WEIGHT, MATCHING_DISTANCE_WEIGHT, \
+    MATCHING_MAX_DISTANCE_KM
+from core.models import Location, Request, SpecialistMatchProfile
+from feedback.models import ScorePolicyChecker
+from utils.Singleton import Singleton
+
+
+class SpecialistMatcher(metaclass=Singleton):
+    """Finds the specialists who can take a request and ranks them by score, current load and distance.
+
+    A specialist can take a request when their profile is eligible, they have the requested speciality or one of
+    its ancestors, and they are under the number of requests their score allows.
+    """
+    # statuses in which the specialist has been at the request's location
+    SERVED_STATUSES = [Request.RequestStatus.IN_PROGRESS, Request.RequestStatus.DONE]
+
+    @staticmethod
+    def get_eligible_specialists():
+        return Specialist.objects.filter(is_validated=True, is_active=True, normal_user__user__is_active=True)
+
+    def get_last_point(self):
+        return Subquery(Request.objects.filter(specialist=OuterRef('specialist'), status__in=self.SERVED_STATUSES,
+                                               location__isnull=False)
+                        .order_by('-updated_at').values('location__point')[:1])
+
+    def refresh(self, specialist_ids):
+        """Recomputes whether the specialists are eligible, creating their profiles if missing."""
+        specialist_ids = list(specialist_ids)
+        if not specialist_ids:
+            return
+        SpecialistMatchProfile.objects.bulk_create([SpecialistMatchProfile(specialist_id=pk) for pk in specialist_ids],
+                                                   ignore_conflicts=True)
+        SpecialistMatchProfile.objects.filter(specialist_id__in=specialist_ids).update(
+            is_eligible=Exists(self.get_eligible_specialists().filter(pk=OuterRef('specialist'))),
+            updated_at=timezone.now())
+
+    def move(self, specialist_id, location_id):
+        """Records that the specialist is working at a location."""
+        SpecialistMatchProfile.objects.filter(specialist_id=specialist_id).update(
+            point=Subquery(Location.objects.filter(pk=location_id).values('point')[:1]), updated_at=timezone.now())
+
+    def rebuild(self, batch_size=5000):
+        """Recomputes every profile from the specialists and their requests. Returns the number of profiles."""
+        with transaction.atomic():
+            SpecialistMatchProfile.objects.bulk_create(
+                [SpecialistMatchProfile(specialist_id=pk) for pk in Specialist.objects.values_list('pk', flat=True)],
+                batch_size=batch_size, ignore_conflicts=True)
+            return SpecialistMatchProfile.objects.update(
+                is_eligible=Exists(self.get_eligible_specialists().filter(pk=OuterRef('specialist'))),
+                point=self.get_last_point(), updated_at=timezone.now())
+
+    @staticmethod
+    def get_distance(request: Request):
+        """Kilometers from the specialist to the request, capped at MATCHING_MAX_DISTANCE_KM which is also
+        the distance of specialists with no known location."""
+        point = request.location.point if request.location_id else None
+        if point is None:
+            return Value(0.0, output_field=FloatField())
+        kilometers = ExpressionWrapper(GeometryDistance('match_profile__point', point) / 1000.0,
+                                       output_field=FloatField())
+        return Coalesce(Least(kilometers, Value(MATCHING_MAX_DISTANCE_KM)), Value(MATCHING_MAX_DISTANCE_KM),
+                        output_field=FloatField())
+
+    def match(self, request: Request, limit=10):
+        """The best `limit` specialists for the request, annotated with load, distance and rank."""
+        speciality = request.requested_speciality_id
+        speciality_ids = [speciality] + SpecialityTree().get_ancestor_ids(speciality)
+        with_speciality = Specialist.speciality.through.objects.filter(speciality__in=speciality_ids) \
+            .values('specialist')
+        specialists = Specialist.objects.filter(match_profile__is_eligible=True, pk__in=with_speciality) \
+            .annotate(load=F('active_request_count'),
+                      allowed_requests=ScorePolicyChecker.get_allowed_request_expression('normal_user__score')) \
+            .filter(load__lt=F('allowed_requests')) \
+            .annotate(distance=self.get_distance(request)) \
+            .annotate(rank=ExpressionWrapper(MATCHING_SCORE_WEIGHT * F('normal_user__score') -
+                                             MATCHING_LOAD_WEIGHT * F('load') -
+                                             MATCHING_DISTANCE_WEIGHT * F('distance'), output_field=FloatField()))
+        return specialists.order_by('-rank', 'pk') \
+            .select_related('normal_user__user').prefetch_related('speciality')[:limit]
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.9 on 2026-10-18 17:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_normaluser_score_totals'),
+        ('core', '0004_alter_request_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestPopularityBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('H', 'Hour'), ('D', 'Day')], max_length=1)),
+                ('start', models.DateTimeField()),
+                ('status', models.CharField(choices=[('PEND', 'در حال بررسی'), ('WAIC', 'منتظر پذیرش مشتری از سوی متخصص'), ('WAIS', 'منتظر پذیرش متخصص از سوی مشتری'), ('PROG', 'در حال انجام'), ('DONE', 'انجام شده'), ('CNCL', 'لغو شده'), ('REJC', 'رد شده')], max_length=4)),
+                ('count', models.IntegerField(default=0)),
+                ('speciality', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='accounts.speciality')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='requestpopularitybucket',
+            index=models.Index(fields=['period', 'start'], name='core_popularity_period_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='requestpopularitybucket',
+            constraint=models.UniqueConstraint(fields=('period', 'start', 'speciality', 'status'), name='core_popularity_bucket_key'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations
+from django.db.models import Count
+from django.db.models.functions import TruncHour, TruncDay
+from django.utils import timezone
+
+
+def backfill_popularity_buckets(apps, schema_editor):
+    Request = apps.get_model('core', 'Request')
+    RequestPopularityBucket = apps.get_model('core', 'RequestPopularityBucket')
+
+    buckets = []
+    for period, trunc in (('H', TruncHour), ('D', TruncDay)):
+        rows = Request.objects.order_by().annotate(start=trunc('created_at', tzinfo=timezone.utc)) \
+            .values_list('start', 'requested_speciality', 'status').annotate(count=Count('id'))
+        buckets += [RequestPopularityBucket(period=period, start=start, speciality_id=speciality_id, status=status,
+                                            count=count)
+                    for start, speciality_id, status, count in rows]
+    RequestPopularityBucket.objects.bulk_create(buckets, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_request_popularity_bucket'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_popularity_buckets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+import django.contrib.gis.db.models.fields
+from django.contrib.gis.geos import Point
+from django.db import migrations
+
+
+def backfill_location_points(apps, schema_editor):
+    Location = apps.get_model('core', 'Location')
+
+    locations = list(Location.objects.only('latitude', 'longitude'))
+    for location in locations:
+        location.point = Point(float(location.longitude), float(location.latitude), srid=4326)
+    Location.objects.bulk_update(locations, ['point'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_backfill_popularity_buckets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='point',
+            field=django.contrib.gis.db.models.fields.PointField(blank=True, geography=True, null=True, srid=4326),
+        ),
+        migrations.RunPython(backfill_location_points, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+import django.contrib.gis.db.models.fields
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef, Subquery
+
+
+def backfill_match_profiles(apps, schema_editor):
+    Specialist = apps.get_model('accounts', 'Specialist')
+    Request = apps.get_model('core', 'Request')
+    SpecialistMatchProfile = apps.get_model('core', 'SpecialistMatchProfile')
+
+    SpecialistMatchProfile.objects.bulk_create(
+        [SpecialistMatchProfile(specialist_id=pk) for pk in Specialist.objects.values_list('pk', flat=True)],
+        batch_size=5000)
+    eligible = Specialist.objects.filter(pk=OuterRef('specialist'), is_validated=True, is_active=True,
+                                         normal_user__user__is_active=True)
+    last_point = Request.objects.filter(specialist=OuterRef('specialist'), status__in=['PROG', 'DONE'],
+                                        location__isnull=False).order_by('-updated_at').values('location__point')[:1]
+    SpecialistMatchProfile.objects.update(is_eligible=Exists(eligible), point=Subquery(last_point))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_normaluser_score_totals'),
+        ('core', '0007_location_point'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpecialistMatchProfile',
+            fields=[
+                ('specialist', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='match_profile', serialize=False, to='accounts.specialist')),
+                ('is_eligible', models.BooleanField(default=False)),
+                ('point', django.contrib.gis.db.models.fields.PointField(blank=True, geography=True, null=True, srid=4326)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_match_profiles, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+def backfill_active_request_counts(apps, schema_editor):
+    Request = apps.get_model('core', 'Request')
+    Specialist = apps.get_model('accounts', 'Specialist')
+
+    counts = Request.objects.filter(specialist__isnull=False).exclude(status__in=['DONE', 'CNCL']) \
+        .order_by().values_list('specialist').annotate(count=Count('id'))
+    specialists = []
+    for specialist_id, count in counts:
+        specialists.append(Specialist(pk=specialist_id, active_request_count=count))
+    Specialist.objects.bulk_update(specialists, ['active_request_count'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_specialist_active_request_count'),
+        ('core', '0008_specialist_match_profile'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_active_request_counts, migrations.RunPython.noop),
+    ]
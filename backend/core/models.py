@@ -1,14 +1,21 @@
 from __future__ import annotations
 
-from datetime import datetime
-
-from django.db import models
-from django.db.models import Q, Count
+from datetime import datetime, timedelta
+
+from django.contrib.gis.db import models
+from django.contrib.gis.db.models.functions import GeometryDistance
+from django.contrib.gis.geos import Point, Polygon
+from django.contrib.gis.measure import D
+from django.db import transaction, IntegrityError
+from django.db.models import Q, Count, F, Sum
+from django.db.models.functions import TruncHour, TruncDay
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
-from accounts.models import Customer, Specialist, Speciality, User, UserCatalogue, SpecialityCatalogue
+from accounts.models import Customer, Specialist, Speciality, User, UserCatalogue, SpecialityCatalogue, SpecialityTree
 from core.constants import *
 from utils.Singleton import Singleton
+from utils.cache import CatalogueCache
 from utils.helper_funcs import ListAdapter
 
 
@@ -18,6 +25,12 @@ class Location(models.Model):
                                    decimal_places=16)
     longitude = models.DecimalField(null=False, blank=False, max_digits=22,
                                     decimal_places=16)
+    # derived from latitude/longitude on save, a geography so distances come out in meters
+    point = models.PointField(geography=True, srid=4326, null=True, blank=True)
+
+    def save(self, *args, **kwargs):
+        self.point = Point(float(self.longitude), float(self.latitude), srid=4326)
+        super().save(*args, **kwargs)
 
     def get_address(self):
         return self.address
@@ -41,22 +54,90 @@ class Location(models.Model):
         return self.address
 
 
+class InvalidLocation(ValueError):
+    pass
+
+
 class LocationCatalogue(metaclass=Singleton):
+    def __init__(self):
+        self._cache = CatalogueCache('locations', Location)
+
     @property
     def locations(self):
         return Location.objects.all()
 
+    def invalidate(self, **kwargs):
+        self._cache.invalidate()
+
     def search(self, query):
-        print("Location Catalogue", query)
-        result = self.locations
+        return self._cache.search(query, self._search)
+
+    def build_filter(self, query, prefix=''):
+        """The filters of search as one Q over fields reached through prefix, e.g. 'location__'.
+
+        Raises InvalidLocation for a malformed query, 'near' or 'bbox'.
+        """
+        if not isinstance(query, dict):
+            raise InvalidLocation(query)
+        condition = Q()
         for field in ['address']:
             if query.get(field):
-                result = result.filter(Q(**{field + '__icontains': query[field]}))
+                condition &= Q(**{prefix + field + '__icontains': query[field]})
         if query.get('latitude'):
-            result = result.filter(latitude__exact=query['latitude'])
+            condition &= Q(**{prefix + 'latitude__exact': query['latitude']})
         if query.get('longitude'):
-            result = result.filter(longitude__exact=query['longitude'])
-
+            condition &= Q(**{prefix + 'longitude__exact': query['longitude']})
+        if query.get('near'):
+            condition &= Q(**{prefix + 'point__dwithin': (self.get_point(query['near']),
+                                                          D(m=self.get_radius(query['near'])))})
+        if query.get('bbox'):
+            condition &= Q(**{prefix + 'point__intersects': self.get_bbox(query['bbox'])})
+        return condition
+
+    def get_distance(self, query, prefix=''):
+        """Distance to the centre of a 'near' query, ordering by it is a k-nearest scan of the spatial index."""
+        if not query or not query.get('near'):
+            return None
+        return GeometryDistance(prefix + 'point', self.get_point(query['near']))
+
+    @staticmethod
+    def get_point(query):
+        try:
+            latitude, longitude = float(query['latitude']), float(query['longitude'])
+        except (KeyError, TypeError, ValueError):
+            raise InvalidLocation(query)
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            raise InvalidLocation(query)
+        return Point(longitude, latitude, srid=4326)
+
+    @staticmethod
+    def get_radius(query):
+        try:
+            radius = float(query['radius'])
+        except (KeyError, TypeError, ValueError):
+            raise InvalidLocation(query)
+        if not 0 <= radius < float('inf'):
+            raise InvalidLocation(query)
+        return radius
+
+    @staticmethod
+    def get_bbox(query):
+        try:
+            south, west, north, east = (float(query[field]) for field in
+                                        ['min_latitude', 'min_longitude', 'max_latitude', 'max_longitude'])
+        except (KeyError, TypeError, ValueError):
+            raise InvalidLocation(query)
+        if not (-90 <= south <= north <= 90 and -180 <= west <= east <= 180):
+            raise InvalidLocation(query)
+        bbox = Polygon.from_bbox((west, south, east, north))
+        bbox.srid = 4326
+        return bbox
+
+    def _search(self, query):
+        result = self.locations.filter(self.build_filter(query))
+        distance = self.get_distance(query)
+        if distance is not None:
+            result = result.order_by(distance)
         return result
 
 
@@ -72,6 +153,9 @@ class Request(models.Model):
         CANCELED = 'CNCL', _(CANCELED_STRING)
         REJECTED = 'REJC', _(REJECTED_STRING)
 
+    # a specialist's requests in any other status count towards their score-policy limit
+    FINISHED_STATUSES = [RequestStatus.DONE, RequestStatus.CANCELED]
+
     customer = models.ForeignKey(Customer, null=False, blank=False, on_delete=models.DO_NOTHING)
     specialist = models.ForeignKey(Specialist, null=True, blank=True, on_delete=models.DO_NOTHING)
     requested_speciality = models.ForeignKey(Speciality, null=False, blank=False, on_delete=models.DO_NOTHING)
@@ -165,6 +249,24 @@ class Request(models.Model):
         self.set_completed_at(datetime.now())
         self.save()
 
+    def set_active_limit(self, limit):
+        """The next save gives the request to its specialist only if they then have at most limit active
+        requests, and raises RequestLimitReached otherwise."""
+        self._active_limit = limit
+
+    def get_active_specialist_id(self):
+        """The specialist this request counts towards, see Specialist.active_request_count."""
+        return self.specialist_id if self.status not in self.FINISHED_STATUSES else None
+
+    def save(self, *args, **kwargs):
+        # core.signals locks the stored row to count the change against it, the lock has to last until the write
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+class RequestLimitReached(Exception):
+    pass
+
 
 class RequestCatalogue(metaclass=Singleton):
     sortable_fields=['status','completed_at','updated_at','customer__normal_user__score']
@@ -178,21 +280,20 @@ class RequestCatalogue(metaclass=Singleton):
         if query.get('id'):
             result = result.filter(pk__in=ListAdapter().python_ensure_list(query['id']))
 
+        # nested user and location queries become joins on the request query rather than IN subqueries
         if query.get('customer'):
             customer_query = {
                 **query.get('customer'),
                 'role': User.UserRole.Customer
             }
-            users = UserCatalogue().search(query=customer_query)
-            result = result.filter(customer__normal_user__user__in=users)
+            result = result.filter(UserCatalogue().build_filter(customer_query, 'customer__normal_user__user__'))
 
         if query.get('specialist'):
             specialist_query = {
                 **query.get('specialist'),
                 'role': User.UserRole.Specialist
             }
-            users = UserCatalogue().search(query=specialist_query)
-            result = result.filter(specialist__normal_user__user__in=users)
+            result = result.filter(UserCatalogue().build_filter(specialist_query, 'specialist__normal_user__user__'))
 
         if query.get('speciality'):
 
@@ -203,9 +304,10 @@ class RequestCatalogue(metaclass=Singleton):
 
             result = result.filter(requested_speciality__in=ListAdapter().python_ensure_list(speciality_query))
 
+        distance = None
         if query.get('location'):
-            locations = LocationCatalogue().search(query=query.get('location'))
-            result = result.filter(location__in=locations)
+            result = result.filter(LocationCatalogue().build_filter(query.get('location'), 'location__'))
+            distance = LocationCatalogue().get_distance(query.get('location'), 'location__')
 
         if query.get('status'):
             result = result.filter(status__iexact=query.get('status'))
@@ -236,8 +338,48 @@ class RequestCatalogue(metaclass=Singleton):
                         good_fields.append(field)
             return result.order_by(*good_fields)
 
+        if distance is not None:
+            # nearest first, so the first k of a page are the k nearest
+            return result.order_by(distance)
         return result
 
+    def add_active(self, specialist_id, delta, limit=None):
+        """Changes the specialist's active request count in one UPDATE. With a limit the UPDATE only applies if the
+        count stays within it, so concurrent accepts can't pass it, and RequestLimitReached is raised if not."""
+        specialists = Specialist.objects.filter(pk=specialist_id)
+        if limit is not None:
+            specialists = specialists.filter(active_request_count__lte=limit - delta)
+        if not specialists.update(active_request_count=F('active_request_count') + delta) and limit is not None:
+            raise RequestLimitReached(specialist_id)
+
+    def get_active_count(self, specialist_id):
+        return Specialist.objects.filter(pk=specialist_id).values_list('active_request_count', flat=True).first() or 0
+
+    def reconcile_active_counts(self):
+        """Recounts every specialist's active requests; returns the number of counts changed."""
+        with transaction.atomic():
+            counts = dict(self.requests.filter(specialist__isnull=False).exclude(status__in=Request.FINISHED_STATUSES)
+                          .order_by().values_list('specialist').annotate(Count('id')))
+            changed = []
+            for specialist in Specialist.objects.select_for_update().only('pk', 'active_request_count'):
+                count = counts.get(specialist.pk, 0)
+                if specialist.active_request_count != count:
+                    specialist.active_request_count = count
+                    changed.append(specialist)
+            Specialist.objects.bulk_update(changed, ['active_request_count'], batch_size=1000)
+        return len(changed)
+
+    def with_related(self, queryset):
+        """Preloads every relation RequestSerializer walks, so serializing a page costs a fixed number of queries."""
+        return queryset.select_related(
+            'customer__normal_user__user',
+            'specialist__normal_user__user',
+            'requested_speciality',
+            'location',
+        ).prefetch_related(
+            'specialist__speciality',
+        )
+
     def get_requests(self):
         return self.requests
 
@@ -251,3 +393,159 @@ class RequestCatalogue(metaclass=Singleton):
     def sort_by_popularity_category(self, queryset):
         return queryset.values('requested_speciality__parent').annotate(
             count=Count('requested_speciality__parent')).order_by("-count")
+
+
+class RequestPopularityBucket(models.Model):
+    """Requests created in one UTC hour or day, per requested speciality and current status."""
+
+    class Period(models.TextChoices):
+        HOUR = 'H', _('Hour')
+        DAY = 'D', _('Day')
+
+    period = models.CharField(max_length=1, choices=Period.choices)
+    start = models.DateTimeField()
+    speciality = models.ForeignKey(Speciality, on_delete=models.CASCADE, related_name='+')
+    status = models.CharField(max_length=4, choices=Request.RequestStatus.choices)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'start', 'speciality', 'status'],
+                                    name='core_popularity_bucket_key'),
+        ]
+        indexes = [
+            models.Index(fields=['period', 'start'], name='core_popularity_period_idx'),
+        ]
+
+
+class RequestPopularity(metaclass=Singleton):
+    """Request counts per speciality, answered from hourly and daily rollups kept up to date by core.signals.
+
+    Time windows are resolved to whole hours: whole days inside the window are read from the daily buckets
+    and the hours at its edges from the hourly ones.
+    """
+    # filters the rollups can answer, any other RequestCatalogue filter falls back to counting requests
+    ROLLUP_FILTERS = {'status', 'speciality'}
+    PERIOD_TRUNCATIONS = {
+        RequestPopularityBucket.Period.HOUR: TruncHour,
+        RequestPopularityBucket.Period.DAY: TruncDay,
+    }
+
+    @staticmethod
+    def get_bucket_starts(created_at):
+        hour = created_at.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        return {
+            RequestPopularityBucket.Period.HOUR: hour,
+            RequestPopularityBucket.Period.DAY: hour.replace(hour=0),
+        }
+
+    def add(self, created_at, speciality_id, status, delta):
+        for period, start in self.get_bucket_starts(created_at).items():
+            buckets = RequestPopularityBucket.objects.filter(period=period, start=start, speciality_id=speciality_id,
+                                                             status=status)
+            if buckets.update(count=F('count') + delta):
+                continue
+            try:
+                with transaction.atomic():
+                    RequestPopularityBucket.objects.create(period=period, start=start, speciality_id=speciality_id,
+                                                           status=status, count=delta)
+            except IntegrityError:
+                # another request created the bucket first
+                buckets.update(count=F('count') + delta)
+
+    def move(self, created_at, old, new):
+        """Moves a request between (speciality_id, status) pairs."""
+        if old == new:
+            return
+        self.add(created_at, *old, -1)
+        self.add(created_at, *new, 1)
+
+    def rebuild(self):
+        """Recomputes every bucket from the requests; returns the number of buckets written."""
+        buckets = []
+        with transaction.atomic():
+            RequestPopularityBucket.objects.all().delete()
+            for period, trunc in self.PERIOD_TRUNCATIONS.items():
+                rows = Request.objects.order_by().annotate(start=trunc('created_at', tzinfo=timezone.utc)) \
+                    .values_list('start', 'requested_speciality', 'status').annotate(count=Count('id'))
+                buckets += [RequestPopularityBucket(period=period, start=start, speciality_id=speciality_id,
+                                                    status=status, count=count)
+                            for start, speciality_id, status, count in rows]
+            RequestPopularityBucket.objects.bulk_create(buckets, batch_size=1000)
+        return len(buckets)
+
+    def can_answer(self, query):
+        return set(key for key, value in query.items() if value) <= self.ROLLUP_FILTERS
+
+    def count(self, query, after=None, before=None):
+        """Maps speciality id to the number of requests matching the query created in [after, before).
+
+        A 'speciality' filter is an id, a list of ids or a dict with just an 'id'; a dict with any other key
+        raises ValueError rather than being read as its id alone.
+        """
+        speciality = query.get('speciality')
+        if isinstance(speciality, dict) and set(speciality) - {'id'}:
+            raise ValueError(f"unsupported speciality filter {sorted(set(speciality) - {'id'})}")
+        if not self.can_answer(query):
+            requests = RequestCatalogue().search(query)
+            if after:
+                requests = requests.filter(created_at__gte=after)
+            if before:
+                requests = requests.filter(created_at__lt=before)
+            return dict(requests.order_by().values_list('requested_speciality').annotate(Count('id')))
+
+        buckets = RequestPopularityBucket.objects.filter(self.get_window(after, before))
+        if query.get('status'):
+            buckets = buckets.filter(status=str(query['status']).upper())
+        if query.get('speciality'):
+            speciality = query['speciality']
+            speciality = speciality.get('id') if isinstance(speciality, dict) else speciality
+            buckets = buckets.filter(speciality__in=ListAdapter().python_ensure_list(speciality))
+        return {speciality: count for speciality, count in
+                buckets.order_by().values_list('speciality').annotate(Sum('count')) if count}
+
+    def get_window(self, after=None, before=None):
+        hour, day = RequestPopularityBucket.Period.HOUR, RequestPopularityBucket.Period.DAY
+        if after is None and before is None:
+            return Q(period=day)
+        first_hour = self.get_bucket_starts(after)[hour] if after else None
+        last_hour = self.get_bucket_starts(before - timedelta(microseconds=1))[hour] + timedelta(hours=1) \
+            if before else None
+        first_day = self.get_bucket_starts(first_hour + timedelta(days=1) - timedelta(hours=1))[day] \
+            if first_hour else None
+        last_day = self.get_bucket_starts(last_hour)[day] if last_hour else None
+        if first_day and last_day and first_day >= last_day:
+            return Q(period=hour, start__gte=first_hour, start__lt=last_hour)
+
+        days = Q(period=day)
+        edges = Q(pk__in=[])
+        if first_day:
+            days &= Q(start__gte=first_day)
+            edges |= Q(period=hour, start__gte=first_hour, start__lt=first_day)
+        if last_day:
+            days &= Q(start__lt=last_day)
+            edges |= Q(period=hour, start__gte=last_day, start__lt=last_hour)
+        return days | edges
+
+    def roll_up(self, counts, level=0):
+        """Adds each speciality's count to its ancestor `level` steps up; those without one are left out."""
+        if not level:
+            return counts
+        tree = SpecialityTree()
+        rolled = {}
+        for speciality, count in counts.items():
+            ancestors = tree.get_ancestor_ids(speciality)
+            if len(ancestors) >= level:
+                rolled[ancestors[level - 1]] = rolled.get(ancestors[level - 1], 0) + count
+        return rolled
+
+
+class SpecialistMatchProfile(models.Model):
+    """What core.matching.SpecialistMatcher keeps per specialist, refreshed by core.signals."""
+    specialist = models.OneToOneField(Specialist, primary_key=True, on_delete=models.CASCADE,
+                                      related_name='match_profile')
+    # validated, active and with an active account
+    is_eligible = models.BooleanField(default=False)
+    # location of the last request the specialist worked on, candidates are ranked by distance from it
+    point = models.PointField(geography=True, srid=4326, null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
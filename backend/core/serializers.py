@@ -7,7 +7,7 @@ from core.models import Request, Location
 class LocationSerializer(ModelSerializer):
     class Meta:
         model = Location
-        fields = '__all__'
+        exclude = ['point']
 
 
 class RequestSerializer(ModelSerializer):
@@ -0,0 +1,87 @@
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete
+from django.dispatch import receiver
+
+from accounts.models import Specialist, User
+from core.matching import SpecialistMatcher
+from core.models import Location, LocationCatalogue, Request, RequestCatalogue, RequestPopularity
+
+
+@receiver([post_save, post_delete], sender=Location)
+def invalidate_locations(sender, **kwargs):
+    LocationCatalogue().invalidate()
+
+
+@receiver(pre_save, sender=Request)
+def remember_and_count_previous_state(sender, instance, **kwargs):
+    instance._popularity_key = None
+    old = None
+    if instance.pk and not instance._state.adding:
+        # locked until Request.save commits, so a concurrent save of the same request waits and then sees this one
+        previous = Request.objects.select_for_update().filter(pk=instance.pk) \
+            .values_list('requested_speciality', 'status', 'specialist').first()
+        if previous is not None:
+            instance._popularity_key = previous[:2]
+            if previous[1] not in Request.FINISHED_STATUSES:
+                old = previous[2]
+    # before the row is written, so a request over the specialist's limit is never saved
+    new = instance.get_active_specialist_id()
+    if old == new:
+        return
+    if new is not None:
+        RequestCatalogue().add_active(new, 1, getattr(instance, '_active_limit', None))
+    if old is not None:
+        RequestCatalogue().add_active(old, -1)
+
+
+@receiver(post_save, sender=Request)
+def update_popularity(sender, instance, created, **kwargs):
+    key = (instance.requested_speciality_id, instance.status)
+    old_key = getattr(instance, '_popularity_key', None)
+    if created or old_key is None:
+        RequestPopularity().add(instance.created_at, *key, 1)
+    else:
+        RequestPopularity().move(instance.created_at, old_key, key)
+
+
+@receiver(pre_delete, sender=Request)
+def remember_deleted_state(sender, instance, **kwargs):
+    # the in-memory instance can be stale, the stored row is what was counted; deleting runs in a transaction
+    previous = Request.objects.select_for_update().filter(pk=instance.pk) \
+        .values_list('requested_speciality', 'status', 'specialist').first()
+    instance._popularity_key = previous[:2] if previous else None
+    instance._active_specialist_id = previous[2] if previous and previous[1] not in Request.FINISHED_STATUSES \
+        else None
+
+
+@receiver(post_delete, sender=Request)
+def remove_popularity(sender, instance, **kwargs):
+    if getattr(instance, '_popularity_key', None) is not None:
+        RequestPopularity().add(instance.created_at, *instance._popularity_key, -1)
+
+
+@receiver(post_delete, sender=Request)
+def uncount_active_request(sender, instance, **kwargs):
+    if getattr(instance, '_active_specialist_id', None) is not None:
+        RequestCatalogue().add_active(instance._active_specialist_id, -1)
+
+
+@receiver(post_save, sender=Specialist)
+def refresh_match_profile(sender, instance, **kwargs):
+    SpecialistMatcher().refresh([instance.pk])
+
+
+@receiver(post_save, sender=User)
+def refresh_user_match_profile(sender, instance, update_fields=None, **kwargs):
+    # logging in only touches last_login, which does not change eligibility
+    if instance.role != User.UserRole.Specialist or (update_fields and set(update_fields) <= {'last_login'}):
+        return
+    SpecialistMatcher().refresh(Specialist.objects.filter(normal_user__user=instance).values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Request)
+def move_match_profile(sender, instance, created, **kwargs):
+    old_key = getattr(instance, '_popularity_key', None)
+    if old_key is not None and old_key[1] == instance.status:
+        return
+    if instance.specialist_id and instance.location_id and instance.status in SpecialistMatcher.SERVED_STATUSES:
+        SpecialistMatcher().move(instance.specialist_id, instance.location_id)
@@ -1,3 +1,502 @@
-from django.test import TestCase
+import json
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
 
-# Create your tests here.
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from accounts.models import NormalUser, SpecialityTree
+from core.matching import SpecialistMatcher
+from core.models import Request, RequestCatalogue, LocationCatalogue, InvalidLocation, SpecialistMatchProfile, \
+    RequestPopularity, RequestPopularityBucket
+from feedback.models import ScorePolicy, ScorePolicyTable
+from utils.testing import create_customer, create_speciality, create_request, create_specialist, create_location, \
+    create_user
+
+
+class RequestSearchViewTest(APITestCase):
+    def setUp(self):
+        self.customer = create_customer()
+        self.speciality = create_speciality()
+        self.specialist = create_specialist([self.speciality])
+        for i in range(25):
+            create_request(self.customer, self.speciality, specialist=self.specialist if i % 2 else None,
+                           location=create_location())
+        self.client.force_authenticate(self.customer.normal_user.user)
+
+    def search(self, **query):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('request-search'), {'q': json.dumps(query)})
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(context.captured_queries)
+
+    def test_without_limit_returns_every_request(self):
+        requests, _ = self.search()
+        self.assertEqual(len(requests), 25)
+
+    def test_pages_cover_every_request_once(self):
+        ids, offset = [], 0
+        while offset is not None:
+            page, _ = self.search(offset=offset, limit=10)
+            ids += [request['id'] for request in page['requests']]
+            offset = page['next_offset']
+        self.assertEqual(len(ids), 25)
+        self.assertEqual(len(set(ids)), 25)
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        # the first search also loads the speciality tree
+        self.search(limit=1)
+        _, queries = self.search(limit=2)
+        with self.assertNumQueries(queries):
+            page, _ = self.search(offset=10, limit=10)
+        self.assertEqual(len(page['requests']), 10)
+        with self.assertNumQueries(queries):
+            self.search()
+
+
+class RequestSearchPlanTest(TestCase):
+    QUERY = {
+        'customer': {'first_name': 'Sara', 'email': 'example.com'},
+        'specialist': {'username': 'user'},
+        'location': {'address': '35.7'},
+    }
+
+    def setUp(self):
+        speciality = create_speciality()
+        self.customer = create_customer(first_name='Sara')
+        specialist = create_specialist([speciality])
+        self.matching = create_request(self.customer, speciality, specialist=specialist, location=create_location())
+        # no specialist, so the specialist join drops it
+        create_request(self.customer, speciality, location=create_location())
+        create_request(create_customer(first_name='Reza'), speciality, specialist=specialist,
+                       location=create_location())
+
+    def test_nested_filters_find_the_matching_requests(self):
+        self.assertEqual(list(RequestCatalogue().search(self.QUERY)), [self.matching])
+
+    def test_nested_filters_are_joins(self):
+        sql = str(RequestCatalogue().search(self.QUERY).query)
+        self.assertEqual(sql.count('SELECT'), 1)
+        self.assertEqual(sql.count('INNER JOIN "accounts_user"'), 2)
+        self.assertEqual(sql.count('INNER JOIN "core_location"'), 1)
+
+    def test_plan_has_no_subplans(self):
+        plan = RequestCatalogue().search(self.QUERY).explain()
+        self.assertNotIn('SubPlan', plan)
+        self.assertNotIn('InitPlan', plan)
+
+
+class LocationSearchTest(APITestCase):
+    CENTRE = {'latitude': 35.70, 'longitude': 51.40}
+
+    def setUp(self):
+        # about 0, 1.1, 11 and 89 km north of the centre
+        self.locations = [create_location(latitude, 51.40) for latitude in [35.70, 35.71, 35.80, 36.50]]
+
+    def search(self, query):
+        return list(LocationCatalogue().search(query))
+
+    def test_near_keeps_locations_within_the_radius_nearest_first(self):
+        self.assertEqual(self.search({'near': {**self.CENTRE, 'radius': 5000}}), self.locations[:2])
+        self.assertEqual(self.search({'near': {**self.CENTRE, 'radius': 20000}}), self.locations[:3])
+        self.assertEqual(self.search({'near': {'latitude': 36.6, 'longitude': 51.4, 'radius': 200000}}),
+                         list(reversed(self.locations)))
+
+    def test_bbox_keeps_locations_inside_it(self):
+        bbox = {'min_latitude': 35.705, 'min_longitude': 51.3, 'max_latitude': 35.9, 'max_longitude': 51.5}
+        self.assertEqual(set(self.search({'bbox': bbox})), set(self.locations[1:3]))
+
+    def test_near_and_bbox_combine(self):
+        bbox = {'min_latitude': 35.705, 'min_longitude': 51.3, 'max_latitude': 36.9, 'max_longitude': 51.5}
+        self.assertEqual(self.search({'near': {**self.CENTRE, 'radius': 20000}, 'bbox': bbox}), self.locations[1:3])
+
+    def test_requests_are_ordered_by_distance_to_near(self):
+        customer = create_customer()
+        speciality = create_speciality()
+        requests = [create_request(customer, speciality, location=location) for location in reversed(self.locations)]
+        found = RequestCatalogue().search({'location': {'near': {**self.CENTRE, 'radius': 20000}}})
+        self.assertEqual(list(found), list(reversed(requests))[:3])
+
+    def test_malformed_location_queries_are_rejected(self):
+        for query in [
+            {'near': 'here'},
+            {'near': [35.7, 51.4]},
+            {'near': self.CENTRE},
+            {'near': {**self.CENTRE, 'radius': -1}},
+            {'near': {**self.CENTRE, 'radius': 'far'}},
+            {'near': {'latitude': 91, 'longitude': 51.4, 'radius': 10}},
+            {'bbox': {'min_latitude': 36, 'min_longitude': 51, 'max_latitude': 35, 'max_longitude': 52}},
+            {'bbox': 'tehran'},
+        ]:
+            with self.assertRaises(InvalidLocation, msg=query):
+                self.search(query)
+
+    def test_request_search_answers_malformed_locations_with_400(self):
+        self.client.force_authenticate(create_customer().normal_user.user)
+        for location in [{'near': 'here'}, {'near': self.CENTRE}, 'tehran']:
+            response = self.client.get(reverse('request-search'), {'q': json.dumps({'location': location})})
+            self.assertEqual(response.status_code, 400, location)
+
+
+class SpecialistMatcherTest(TestCase):
+    def setUp(self):
+        # the snapshots outlive the rolled back rows of earlier tests
+        SpecialityTree().invalidate()
+        ScorePolicyTable().invalidate()
+        self.category = create_speciality('category')
+        self.leaf = create_speciality('leaf', parent=self.category)
+        self.sibling = create_speciality('sibling', parent=self.category)
+        self.customer = create_customer()
+        self.request = create_request(self.customer, self.leaf)
+
+    def match(self, request=None):
+        return list(SpecialistMatcher().match(request or self.request, 10))
+
+    def test_only_validated_active_specialists_with_active_accounts_match(self):
+        eligible = create_specialist([self.leaf])
+        create_specialist([self.leaf], is_validated=False)
+        create_specialist([self.leaf], is_active=False)
+        create_specialist([self.leaf], is_active=False, is_validated=False)
+        user = create_specialist([self.leaf]).normal_user.user
+        user.set_active(False)
+        user.save()
+        self.assertEqual(self.match(), [eligible])
+
+    def test_specialists_of_the_speciality_or_an_ancestor_match(self):
+        of_leaf = create_specialist([self.leaf], score=2)
+        of_category = create_specialist([self.category], score=1)
+        create_specialist([self.sibling])
+        self.assertEqual(self.match(), [of_leaf, of_category])
+        # a specialist of the leaf doesn't cover the whole category
+        self.assertEqual(self.match(create_request(self.customer, self.category)), [of_category])
+
+    def test_specialists_at_their_allowed_requests_do_not_match(self):
+        ScorePolicy.objects.create(minimum_score=0, allowed_requests=1)
+        ScorePolicy.objects.create(minimum_score=50, allowed_requests=2)
+        low = create_specialist([self.leaf], score=10)
+        high = create_specialist([self.leaf], score=60)
+        self.assertEqual(set(self.match()), {low, high})
+        create_request(self.customer, self.sibling, specialist=low, status=Request.RequestStatus.IN_PROGRESS)
+        create_request(self.customer, self.sibling, specialist=high, status=Request.RequestStatus.IN_PROGRESS)
+        self.assertEqual(self.match(), [high])
+        create_request(self.customer, self.sibling, specialist=high, status=Request.RequestStatus.IN_PROGRESS)
+        self.assertEqual(self.match(), [])
+
+    def test_specialists_below_every_policy_do_not_match(self):
+        ScorePolicy.objects.create(minimum_score=50, allowed_requests=2)
+        create_specialist([self.leaf], score=49.5)
+        self.assertEqual(self.match(), [])
+
+    def test_closer_specialists_rank_higher(self):
+        request = create_request(self.customer, self.leaf, location=create_location(35.70, 51.40))
+        far, near = create_specialist([self.leaf]), create_specialist([self.leaf])
+        for specialist, latitude in [(far, 35.90), (near, 35.71)]:
+            done = create_request(self.customer, self.sibling, specialist=specialist,
+                                  location=create_location(latitude, 51.40))
+            done.set_status(Request.RequestStatus.DONE)
+            done.save()
+        self.assertEqual(self.match(request), [near, far])
+
+
+class AllowedRequestsExpressionTest(TestCase):
+    SCORES = [-1, 0, 10, 49.9999, 50, 50.0001, 79.9999, 80, 100]
+
+    def setUp(self):
+        ScorePolicyTable().invalidate()
+        for score in self.SCORES:
+            create_user(score=score)
+
+    def assert_expression_matches_table(self):
+        users = NormalUser.objects.annotate(
+            allowed=ScorePolicyTable().get_allowed_requests_expression('score')).values_list('score', 'allowed')
+        self.assertEqual(len(users), len(self.SCORES))
+        for score, allowed in users:
+            self.assertEqual(allowed, ScorePolicyTable().get_allowed_requests(score), score)
+
+    def test_without_policies(self):
+        self.assert_expression_matches_table()
+
+    def test_at_threshold_boundaries(self):
+        for minimum_score, allowed_requests in [(0, 1), (50, 3), (80, 5)]:
+            ScorePolicy.objects.create(minimum_score=minimum_score, allowed_requests=allowed_requests)
+        self.assert_expression_matches_table()
+
+    def test_with_policies_of_the_same_minimum_score(self):
+        # created out of order, the later of the two at 50 wins in both
+        ScorePolicy.objects.create(minimum_score=80, allowed_requests=5)
+        ScorePolicy.objects.create(minimum_score=50, allowed_requests=3)
+        ScorePolicy.objects.create(minimum_score=50, allowed_requests=4)
+        ScorePolicy.objects.create(minimum_score=10, allowed_requests=1)
+        self.assert_expression_matches_table()
+        self.assertEqual(ScorePolicyTable().get_allowed_requests(50), 4)
+
+
+class MatchProfileSignalTest(TestCase):
+    def setUp(self):
+        self.speciality = create_speciality()
+        self.specialist = create_specialist([self.speciality], is_validated=False)
+
+    def get_profile(self):
+        return SpecialistMatchProfile.objects.get(specialist=self.specialist)
+
+    def test_saving_the_specialist_refreshes_eligibility(self):
+        self.assertFalse(self.get_profile().is_eligible)
+        self.specialist.set_validated(True)
+        self.specialist.save(update_fields=['is_validated'])
+        self.assertTrue(self.get_profile().is_eligible)
+        self.specialist.set_active(False)
+        self.specialist.save(update_fields=['is_active'])
+        self.assertFalse(self.get_profile().is_eligible)
+
+    def test_saving_the_account_refreshes_eligibility(self):
+        self.specialist.set_validated(True)
+        self.specialist.save(update_fields=['is_validated'])
+        user = self.specialist.normal_user.user
+        user.set_active(False)
+        user.save()
+        self.assertFalse(self.get_profile().is_eligible)
+        user.set_active(True)
+        user.save()
+        self.assertTrue(self.get_profile().is_eligible)
+
+    def test_logging_in_does_not_refresh(self):
+        SpecialistMatchProfile.objects.filter(specialist=self.specialist).update(is_eligible=True)
+        self.specialist.normal_user.user.save(update_fields=['last_login'])
+        self.assertTrue(self.get_profile().is_eligible)
+
+    def test_starting_a_request_moves_the_specialist_to_its_location(self):
+        location = create_location(35.75, 51.45)
+        request = create_request(create_customer(), self.speciality, specialist=self.specialist, location=location,
+                                 status=Request.RequestStatus.WAITING_FOR_CUSTOMER_ACCEPTANCE_FROM_SPECIALIST)
+        self.assertIsNone(self.get_profile().point)
+        request.set_status(Request.RequestStatus.IN_PROGRESS)
+        request.save()
+        point = self.get_profile().point
+        self.assertAlmostEqual(point.y, 35.75)
+        self.assertAlmostEqual(point.x, 51.45)
+
+
+class ActiveRequestCountTest(TestCase):
+    def setUp(self):
+        self.speciality = create_speciality()
+        self.customer = create_customer()
+        self.specialist = create_specialist([self.speciality])
+
+    def assert_count(self, count):
+        self.specialist.refresh_from_db(fields=['active_request_count'])
+        self.assertEqual(self.specialist.get_active_request_count(), count)
+
+    def submit(self):
+        return create_request(self.customer, self.speciality)
+
+    def select(self, request):
+        request.set_specialist(self.specialist)
+        request.set_status(Request.RequestStatus.WAITING_FOR_CUSTOMER_ACCEPTANCE_FROM_SPECIALIST)
+        request.save()
+
+    def accept(self, request):
+        request.set_status(Request.RequestStatus.IN_PROGRESS)
+        request.save()
+
+    def test_request_counts_from_selection_until_it_is_finished(self):
+        request = self.submit()
+        self.assert_count(0)
+        self.select(request)
+        self.assert_count(1)
+        self.accept(request)
+        self.assert_count(1)
+        request.mark_as_finished()
+        self.assert_count(0)
+        request.delete()
+        self.assert_count(0)
+
+    def test_rejecting_back_to_pending_uncounts(self):
+        request = self.submit()
+        self.select(request)
+        request.set_status(Request.RequestStatus.PENDING)
+        request.set_specialist(None)
+        request.save()
+        self.assert_count(0)
+
+    def test_removing_the_specialist_uncounts(self):
+        request = self.submit()
+        self.select(request)
+        request.remove_specialist()
+        self.assert_count(0)
+
+    def test_cancelling_uncounts_once(self):
+        request = self.submit()
+        self.select(request)
+        self.accept(request)
+        request.cancel()
+        self.assert_count(0)
+        request.cancel()
+        self.assert_count(0)
+
+    def test_deleting_an_active_request_uncounts(self):
+        request = self.submit()
+        self.select(request)
+        request.delete()
+        self.assert_count(0)
+
+    def test_stale_instances_count_against_the_stored_row(self):
+        request = self.submit()
+        self.select(request)
+        stale = Request.objects.get(pk=request.pk)
+        request.mark_as_finished()
+        stale.cancel()
+        self.assert_count(0)
+        stale = Request.objects.get(pk=request.pk)
+        stale.set_status(Request.RequestStatus.IN_PROGRESS)
+        Request.objects.filter(pk=request.pk).update(status=Request.RequestStatus.CANCELED)
+        # deleting goes by the stored, finished status rather than the instance's
+        stale.delete()
+        self.assert_count(0)
+
+    def test_deleting_a_stale_instance_uncounts_the_stored_popularity(self):
+        request = self.submit()
+        stale = Request.objects.get(pk=request.pk)
+        self.select(request)
+        stale.delete()
+        self.assert_count(0)
+        self.assertEqual(RequestPopularity().count({'speciality': self.speciality.pk}), {})
+
+
+class ConcurrentActiveRequestCountTest(TransactionTestCase):
+    def test_concurrent_saves_apply_the_change_once(self):
+        speciality = create_speciality()
+        specialist = create_specialist([speciality])
+        request = create_request(create_customer(), speciality, specialist=specialist,
+                                 status=Request.RequestStatus.IN_PROGRESS)
+        loaded = threading.Barrier(2)
+
+        def finish(change):
+            try:
+                # both load the request in progress before either saves
+                stale = Request.objects.get(pk=request.pk)
+                loaded.wait()
+                change(stale)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=finish, args=(change,))
+                   for change in [Request.mark_as_finished, Request.cancel]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        specialist.refresh_from_db(fields=['active_request_count'])
+        self.assertEqual(specialist.get_active_request_count(), 0)
+
+
+class SelectSpecialistLimitTest(APITestCase):
+    def setUp(self):
+        ScorePolicyTable().invalidate()
+        ScorePolicy.objects.create(minimum_score=0, allowed_requests=1)
+        self.speciality = create_speciality()
+        self.customer = create_customer()
+        self.specialist = create_specialist([self.speciality])
+        self.busy = create_request(self.customer, self.speciality, specialist=self.specialist,
+                                   status=Request.RequestStatus.IN_PROGRESS)
+        self.request = create_request(self.customer, self.speciality)
+
+    def post(self, name, user, **data):
+        self.client.force_authenticate(user)
+        return self.client.post(reverse(name), {'request_id': self.request.pk, **data}, format='json')
+
+    def select(self):
+        return self.post('request-select-specialist', self.customer.normal_user.user,
+                         specialist_id=self.specialist.normal_user.user.pk)
+
+    def assert_count(self, count):
+        self.specialist.refresh_from_db(fields=['active_request_count'])
+        self.assertEqual(self.specialist.get_active_request_count(), count)
+
+    def test_specialist_at_the_limit_cannot_be_selected(self):
+        self.assertEqual(self.select().status_code, 400)
+        self.request.refresh_from_db()
+        self.assertEqual(self.request.get_status(), Request.RequestStatus.PENDING)
+        self.assertIsNone(self.request.specialist_id)
+        self.assert_count(1)
+
+    def test_selected_specialist_can_accept_up_to_the_limit(self):
+        self.busy.mark_as_finished()
+        self.assertEqual(self.select().status_code, 200)
+        self.assert_count(1)
+        response = self.post('request-finalize-by-specialist', self.specialist.normal_user.user, is_accept='1')
+        self.assertEqual(response.status_code, 200)
+        self.request.refresh_from_db()
+        self.assertEqual(self.request.get_status(), Request.RequestStatus.IN_PROGRESS)
+        self.assert_count(1)
+
+
+class RequestPopularityTest(TestCase):
+    START = datetime(2026, 3, 1, tzinfo=dt_timezone.utc)
+    # hours after START the requests were created at, around hour and day boundaries
+    OFFSETS = [0, 0.5, 1, 23, 23.99, 24, 25.5, 47, 48, 60, 71.9, 72, 95]
+
+    def setUp(self):
+        self.speciality = create_speciality()
+        customer = create_customer()
+        self.created = [self.START + timedelta(hours=offset) for offset in self.OFFSETS]
+        for created_at in self.created:
+            request = create_request(customer, self.speciality)
+            Request.objects.filter(pk=request.pk).update(created_at=created_at)
+        RequestPopularity().rebuild()
+
+    def at(self, hours):
+        return self.START + timedelta(hours=hours)
+
+    def expected(self, after, before):
+        # windows are resolved to whole hours, the edge hours are counted whole
+        first = after.replace(minute=0, second=0, microsecond=0) if after else None
+        last = (before - timedelta(microseconds=1)).replace(minute=0, second=0, microsecond=0) + timedelta(hours=1) \
+            if before else None
+        return sum(1 for created_at in self.created
+                   if (first is None or created_at >= first) and (last is None or created_at < last))
+
+    def count(self, after=None, before=None):
+        return RequestPopularity().count({}, after, before).get(self.speciality.pk, 0)
+
+    def test_bucket_starts_are_utc_hour_and_day(self):
+        tehran = dt_timezone(timedelta(hours=3, minutes=30))
+        starts = RequestPopularity.get_bucket_starts(datetime(2026, 3, 2, 2, 59, 59, 999999, tzinfo=tehran))
+        self.assertEqual(starts[RequestPopularityBucket.Period.HOUR], datetime(2026, 3, 1, 23, tzinfo=dt_timezone.utc))
+        self.assertEqual(starts[RequestPopularityBucket.Period.DAY], datetime(2026, 3, 1, tzinfo=dt_timezone.utc))
+
+    def test_windows_count_the_hours_they_touch(self):
+        windows = [
+            (None, None), (self.at(1.5), None), (None, self.at(48)), (None, self.at(48.01)),
+            (self.at(23.5), self.at(24.5)), (self.at(0.25), self.at(71)), (self.at(24), self.at(72)),
+            (self.at(25), self.at(26)), (self.at(24), self.at(24)), (self.at(-5), self.at(200)),
+        ]
+        for after, before in windows:
+            self.assertEqual(self.count(after, before), self.expected(after, before), (after, before))
+
+    def test_window_of_whole_days_reads_only_daily_buckets(self):
+        window = RequestPopularity().get_window(self.at(24), self.at(72))
+        buckets = RequestPopularityBucket.objects.filter(window)
+        self.assertEqual(set(buckets.values_list('period', flat=True)), {RequestPopularityBucket.Period.DAY})
+        self.assertEqual(sum(buckets.values_list('count', flat=True)), self.expected(self.at(24), self.at(72)))
+
+    def test_signals_keep_the_buckets_a_rebuild_would_write(self):
+        request = create_request(create_customer(), self.speciality)
+        request.cancel()
+        create_request(create_customer(), self.speciality).delete()
+        kept = list(RequestPopularityBucket.objects.filter(count__gt=0).order_by('period', 'start', 'status')
+                    .values_list('period', 'start', 'speciality', 'status', 'count'))
+        RequestPopularity().rebuild()
+        rebuilt = list(RequestPopularityBucket.objects.order_by('period', 'start', 'status')
+                       .values_list('period', 'start', 'speciality', 'status', 'count'))
+        self.assertEqual(kept, rebuilt)
+        self.assertEqual(RequestPopularity().count({'status': Request.RequestStatus.CANCELED,
+                                                    'speciality': self.speciality.pk}), {self.speciality.pk: 1})
+
+    def test_speciality_filter_takes_only_an_id(self):
+        self.assertEqual(RequestPopularity().count({'speciality': {'id': self.speciality.pk}}),
+                         {self.speciality.pk: len(self.created)})
+        with self.assertRaises(ValueError):
+            RequestPopularity().count({'speciality': {'id': self.speciality.pk, 'title': 'x'}})
@@ -2,7 +2,8 @@ from django.urls import path
 
 from .views import RequestFinishView, RequestSearchView, LocationView, RequestSubmitView, RequestCancelByManagerView, RequestStatusView, \
     RequestInitialAcceptBySpecialistView, RequestAcceptanceFinalizeByCustomerView, SelectSpecialistForRequestView, \
-    RequestAcceptanceFinalizeBySpecialistView, RequestCancelByCustomerView, RequestPopularityView, RequestEditView
+    RequestAcceptanceFinalizeBySpecialistView, RequestCancelByCustomerView, RequestPopularityView, RequestEditView, \
+    SpecialistMatchView
 
 urlpatterns = [
     path('request/search/', RequestSearchView.as_view(), name='request-search'),
@@ -19,6 +20,7 @@ urlpatterns = [
      path('request/finish/', RequestFinishView.as_view(),
          name='request-finished'),
     path('request/select/specialist/', SelectSpecialistForRequestView.as_view(), name='request-select-specialist'),
+    path('request/match/<request_id>/', SpecialistMatchView.as_view(), name='request-match-specialists'),
     path('request/accept/specialist/final/', RequestAcceptanceFinalizeBySpecialistView.as_view(),
          name='request-finalize-by-specialist'),
     path('request/edit/<request_id>/', RequestEditView.as_view(), name='edit-request'),
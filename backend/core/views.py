@@ -11,18 +11,22 @@ from rest_framework.response import Response
 from rest_framework.status import HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND
 from rest_framework.views import APIView
 
-from accounts.models import User, UserCatalogue, SpecialityCatalogue, Specialist
-from accounts.serializers import SpecialitySerializer
-from arno.settings import USE_SCORE_LIMIT
+from accounts.models import User, UserCatalogue, SpecialityCatalogue, Specialist, SpecialityTree
+from accounts.serializers import SpecialistSerializer
+from arno.settings import USE_SCORE_LIMIT, MATCHING_MAX_LIMIT
 from core.constants import *
-from core.models import Request, Location, RequestCatalogue
+from core.matching import SpecialistMatcher
+from core.models import Request, Location, RequestCatalogue, RequestPopularity, RequestLimitReached, \
+    InvalidLocation
 from core.serializers import RequestSerializer, LocationSerializer, RequestSubmitSerializer
-from feedback.models import ScorePolicyChecker, ScoreCalculator
+from feedback.models import ScorePolicyChecker
 from log.models import Logger
 from notification.notifications import RequestInitialAcceptBySpecialistNotification, \
     RequestAcceptanceFinalizeByCustomerNotification, RequestRejectFinalizeByCustomerNotification, BaseNotification, \
     SelectSpecialistForRequestNotification, RequestAcceptanceFinalizeBySpecialistNotification, \
     RequestRejectFinalizeBySpecialistNotification
+from utils.helper_funcs import TimestampAdapter
+from utils.pagination import OffsetPaginator
 from utils.permissions import PermissionFactory
 
 
@@ -45,9 +49,18 @@ class RequestSearchView(generics.GenericAPIView):
                 query['speciality']['id'] = list(map(lambda x: x.id, request.user.full_user.get_speciality()))
             else:
                 query['speciality']['id'] = []
-        requests = RequestCatalogue().search(query)
-        serialized = RequestSerializer(requests, many=True)
-        return JsonResponse(serialized.data, safe=False)
+        try:
+            requests = RequestCatalogue().with_related(RequestCatalogue().search(query))
+        except InvalidLocation:
+            return JsonResponse({'error': INVALID_LOCATION_ERROR}, status=HTTP_400_BAD_REQUEST)
+        if query.get('limit') is None and query.get('offset') is None:
+            # clients that don't page still get every match as a plain list
+            return JsonResponse(RequestSerializer(requests, many=True).data, safe=False)
+        requests, next_offset = OffsetPaginator().paginate_with_next(requests, query.get('offset'), query.get('limit'))
+        return JsonResponse({
+            'requests': RequestSerializer(requests, many=True).data,
+            'next_offset': next_offset,
+        })
 
 
 class LocationView(APIView):
@@ -205,22 +218,33 @@ class RequestPopularityView(APIView):
 
     @Logger().log_name()
     def get(self, request):
-        query = json.loads(request.GET.get('q'))
-        category = request.GET.get('category', None)
-        requests = RequestCatalogue().search(query=query)
-        if category:
-            request_sorted = RequestCatalogue().sort_by_popularity_category(requests)
-        else:
-            request_sorted = RequestCatalogue().sort_by_popularity(requests)
+        """Request counts per speciality, most requested first.
+
+        'category' counts per parent speciality and 'level' per ancestor that many steps up; 'after' and
+        'before' limit the counts to requests created in that window.
+        """
+        query = json.loads(request.GET.get('q', '{}'))
+        try:
+            level = 1 if request.GET.get('category') else int(request.GET.get('level', 0))
+        except ValueError:
+            return JsonResponse({'error': _(INVALID_REQUEST)}, status=HTTP_400_BAD_REQUEST)
+        try:
+            after, before = [TimestampAdapter().parse(request.GET[field]) if request.GET.get(field) else None
+                             for field in ('after', 'before')]
+        except ValueError:
+            return JsonResponse({'error': _(INVALID_TIMESTAMP_ERROR)}, status=HTTP_400_BAD_REQUEST)
+
+        popularity = RequestPopularity()
+        try:
+            counts = popularity.count(query, after, before)
+        except ValueError:
+            return JsonResponse({'error': _(INVALID_REQUEST)}, status=HTTP_400_BAD_REQUEST)
+        counts = popularity.roll_up(counts, level)
         result = []
-        for request in request_sorted:
-
-            speciality = request.get('requested_speciality' + ('' if not category else '__parent'))
-            if speciality:
-                speciality = SpecialityCatalogue().search(query={"id": speciality}).first()
-                print(speciality.id)
-                result.append({'speciality': SpecialitySerializer(speciality).data,
-                               'count': request.get('count')})
+        for speciality, count in sorted(counts.items(), key=lambda item: item[1], reverse=True):
+            representation = SpecialityTree().to_representation(speciality)
+            if representation:
+                result.append({'speciality': representation, 'count': count})
         return JsonResponse({
             'popularity': result
         })
@@ -312,11 +336,8 @@ class RequestInitialAcceptBySpecialistView(APIView):
             }, status=HTTP_400_BAD_REQUEST)
 
         if USE_SCORE_LIMIT:
-            on_going_request_count = RequestCatalogue().search(query={'specialist': {'id': user.full_user.id}}).exclude(
-                status__exact=Request.RequestStatus.DONE).exclude(status__exact=Request.RequestStatus.CANCELED).count()
-            print("on going ",on_going_request_count)
-            ScoreCalculator(user.general_user).update_score()
-            if on_going_request_count >= ScorePolicyChecker(user.general_user.score).get_allowed_request():
+            if RequestCatalogue().get_active_count(user.full_user.id) >= \
+                    ScorePolicyChecker(user.general_user.score).get_allowed_request():
                 return Response({
                     'error': _(REQUEST_LIMIT_REACHED_ERROR)
                 }, status=HTTP_400_BAD_REQUEST)
@@ -332,7 +353,15 @@ class RequestInitialAcceptBySpecialistView(APIView):
 
         core_request.set_status(Request.RequestStatus.WAITING_FOR_SPECIALIST_ACCEPTANCE_FROM_CUSTOMER)
         core_request.set_specialist(request.user.full_user)
-        core_request.save()
+        if USE_SCORE_LIMIT:
+            # checked again by the counter's conditional UPDATE, in case another accept got in first
+            core_request.set_active_limit(ScorePolicyChecker(request.user.general_user.score).get_allowed_request())
+        try:
+            core_request.save()
+        except RequestLimitReached:
+            return Response({
+                'error': _(REQUEST_LIMIT_REACHED_ERROR)
+            }, status=HTTP_400_BAD_REQUEST)
 
         self.notification_builder(core_request).build()
 
@@ -369,7 +398,10 @@ class SelectSpecialistForRequestView(APIView):
                 'error': _(REQUEST_NOT_IN_PENDING_ERROR)
             }, status=HTTP_400_BAD_REQUEST)
 
-        if request.get_requested_speciality() not in specialist.full_user.get_speciality():
+        # a broader speciality covers the ones under it, as in SpecialistMatcher
+        speciality_ids = [request.requested_speciality_id] + \
+            SpecialityTree().get_ancestor_ids(request.requested_speciality_id)
+        if not specialist.full_user.get_speciality().filter(pk__in=speciality_ids).exists():
             return Response({
                 'error': _(SPECIALIST_DONT_HAVE_SPECIALITY_ERROR)
             }, status=HTTP_400_BAD_REQUEST)
@@ -393,13 +425,58 @@ class SelectSpecialistForRequestView(APIView):
 
         core_request.set_status(Request.RequestStatus.WAITING_FOR_CUSTOMER_ACCEPTANCE_FROM_SPECIALIST)
         core_request.set_specialist(specialist)
-        core_request.save()
+        if USE_SCORE_LIMIT:
+            # selecting counts the request towards the specialist, so it is held to their limit as accepting is
+            core_request.set_active_limit(ScorePolicyChecker(specialist.normal_user.score).get_allowed_request())
+        try:
+            core_request.save()
+        except RequestLimitReached:
+            return Response({
+                'error': _(SPECIALIST_REQUEST_LIMIT_REACHED_ERROR)
+            }, status=HTTP_400_BAD_REQUEST)
         self.notification_builder(core_request).build()
         return JsonResponse({
             'request ': RequestSerializer(core_request).data
         })
 
 
+class SpecialistMatchView(APIView):
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [PermissionFactory(User.UserRole.Customer).get_permission_class()]
+
+    @Logger().log_name()
+    def get(self, request, request_id):
+        core_request = Request.objects.select_related('location').filter(pk=request_id).first() \
+            if str(request_id).isdigit() else None
+        if core_request is None:
+            return Response({
+                'error': _(REQUEST_NOT_FOUND_ERROR)
+            }, status=HTTP_404_NOT_FOUND)
+        if core_request.customer_id != request.user.full_user.id:
+            return Response({
+                'error': _(REQUEST_NOT_FOR_YOU_ERROR)
+            }, status=HTTP_400_BAD_REQUEST)
+        if core_request.get_status() != Request.RequestStatus.PENDING:
+            return Response({
+                'error': _(REQUEST_NOT_IN_PENDING_ERROR)
+            }, status=HTTP_400_BAD_REQUEST)
+
+        try:
+            limit = int(request.GET.get('limit', 10))
+        except ValueError:
+            limit = 10
+        limit = max(1, min(limit, MATCHING_MAX_LIMIT))
+        specialists = SpecialistMatcher().match(core_request, limit)
+        return JsonResponse({
+            'specialists': [{
+                **SpecialistSerializer(specialist).data,
+                'active_requests': specialist.load,
+                'distance': specialist.distance,
+                'rank': specialist.rank,
+            } for specialist in specialists]
+        })
+
+
 class RequestAcceptanceFinalizeView(APIView, ABC):
     notification_builder_accept = None
     notification_builder_reject = None
@@ -435,12 +512,8 @@ class RequestAcceptanceFinalizeView(APIView, ABC):
         if is_accept == "1":
             if USE_SCORE_LIMIT:
                 if request.user.get_role() == User.UserRole.Specialist:
-                    on_going_request_count = RequestCatalogue(). \
-                        search(query={'specialist': {'id': request.user.full_user.id}}).exclude(
-                        status__exact=Request.RequestStatus.DONE).exclude(
-                        status__exact=Request.RequestStatus.CANCELED).count()
-                    ScoreCalculator(request.user.general_user).update_score()
-                    if on_going_request_count >= ScorePolicyChecker(
+                    # the request already counts towards the specialist since the customer selected them
+                    if RequestCatalogue().get_active_count(request.user.full_user.id) > ScorePolicyChecker(
                             request.user.general_user.score).get_allowed_request():
                         return Response({
                             'error': _(REQUEST_LIMIT_REACHED_ERROR)
@@ -536,7 +609,7 @@ class RequestStatusView(APIView):
             requests = Request.objects.filter(specialist=request.user.full_user)
         else:
             return Response(data=_(NOT_CUSTOMER_OR_SPECIALIST_ERROR), status=HTTP_400_BAD_REQUEST)
-        serialized = RequestSerializer(requests, many=True)
+        serialized = RequestSerializer(RequestCatalogue().with_related(requests), many=True)
         return JsonResponse({
             'requests': serialized.data
         })
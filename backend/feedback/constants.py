@@ -1,6 +1,9 @@
 NO_EVALUATION_METRIC_FOUND_ERROR = u"معیار ارزیابی یافت نشد"
+INVALID_METRIC_SCORE_ERROR = u"امتیاز معیار نامعتبر است"
 NO_ID_PROVIDED_ERROR = u"آی دی داده نشده است"
 FEEDBACK_NOT_FOUND_ERROR = u"بازخورد یافت نشد"
 REQUEST_NOT_FOUND_ERROR = u"درخواست یافت نشد"
 SCORE_POLICY_NOT_FOUND_ERROR = u"سیاست امتیاز یافت نشد"
-ACCESS_DENIED_ERROR = u"دسترسی غیر مجاز است"
\ No newline at end of file
+ACCESS_DENIED_ERROR = u"دسترسی غیر مجاز است"
+INVALID_TIMESTAMP_ERROR = u"زمان داده شده نامعتبر است"
+SCORE_REBUILD_JOB_NOT_FOUND_ERROR = u"عملیات بازمحاسبه امتیاز یافت نشد"
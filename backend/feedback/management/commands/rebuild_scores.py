@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from feedback.models import ScoreRebuilder
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the score of every customer and specialist from their received feedbacks'
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        count = ScoreRebuilder().rebuild(progress=self.report_progress)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} scores in {time.monotonic() - started:.2f}s"))
+
+    def report_progress(self, processed, total):
+        self.stdout.write(f"{processed}/{total}")
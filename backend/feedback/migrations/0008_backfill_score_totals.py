@@ -0,0 +1,40 @@
+from django.db import migrations
+from django.db.models import F, Sum, Count
+
+
+def backfill_score_totals(apps, schema_editor):
+    NormalUser = apps.get_model('accounts', 'NormalUser')
+    MetricScore = apps.get_model('feedback', 'MetricScore')
+
+    totals = {}
+    # feedbacks written by the request's customer rate its specialist, every other feedback rates the customer
+    rated_lookups = [
+        ('feedback__request__specialist__normal_user',
+         MetricScore.objects.filter(feedback__user=F('feedback__request__customer__normal_user'),
+                                    feedback__request__specialist__isnull=False)),
+        ('feedback__request__customer__normal_user',
+         MetricScore.objects.exclude(feedback__user=F('feedback__request__customer__normal_user'))),
+    ]
+    for rated, scores in rated_lookups:
+        for row in scores.values(rated).annotate(total=Sum('score'), count=Count('id')):
+            score_sum, score_count = totals.get(row[rated], (0, 0))
+            totals[row[rated]] = (score_sum + row['total'], score_count + row['count'])
+
+    users = list(NormalUser.objects.filter(pk__in=totals))
+    for user in users:
+        user.score_sum, user.score_count = totals[user.pk]
+        user.score = user.score_sum / user.score_count
+    NormalUser.objects.bulk_update(users, ['score', 'score_sum', 'score_count'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_normaluser_score_totals'),
+        ('core', '0004_alter_request_status'),
+        ('feedback', '0007_alter_systemfeedback_options'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_score_totals, migrations.RunPython.noop),
+    ]
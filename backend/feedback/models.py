@@ -1,15 +1,20 @@
 import sys
+from bisect import bisect_left, bisect_right
 from typing import List
 
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 
-from django.db.models import Q
+from django.db.models import Q, F, Sum, Count, Case, When, Value, ExpressionWrapper, FloatField, Avg, OuterRef, \
+    Subquery, IntegerField
+from django.db.models.functions import Coalesce
 
 import accounts.models
 from accounts.models import NormalUser
 from arno.settings import USE_SCORE_LIMIT
 from core.models import Request
 from utils.Singleton import Singleton
+from utils.cache import VersionedLocalCache, CatalogueCache
 
 from django.utils.translation import gettext_lazy as _
 from utils.helper_funcs import ListAdapter
@@ -41,13 +46,21 @@ class EvaluationMetric(models.Model):
 
 
 class EvaluationMetricCatalogue(metaclass=Singleton):
+    def __init__(self):
+        self._cache = CatalogueCache('evaluation-metrics', EvaluationMetric)
+
     @property
     def metrics(self):
         return EvaluationMetric.objects.all()
 
+    def invalidate(self, **kwargs):
+        self._cache.invalidate()
+
     def search(self, query):
+        return self._cache.search(query, self._search)
+
+    def _search(self, query):
         result = self.metrics
-        print(query)
 
         if not query:
             return result
@@ -60,7 +73,6 @@ class EvaluationMetricCatalogue(metaclass=Singleton):
                 result = result.filter(
                     Q(**{field + '__icontains': query[field]}))
         if query.get('user_type'):
-            print(query.get('user_type'))
             result = result.filter(user_type__iexact=query['user_type'])
         # filter User objects that exist in Customer Table
         return result
@@ -69,6 +81,58 @@ class EvaluationMetricCatalogue(metaclass=Singleton):
         return self.metrics
 
 
+class EvaluationMetricRegistry(metaclass=Singleton):
+    """Every evaluation metric kept in process memory by user_type and id, metrics change rarely."""
+
+    def __init__(self):
+        self._snapshot = VersionedLocalCache('evaluation-metric-registry', self._build)
+
+    def _build(self):
+        metrics = {}
+        for metric in EvaluationMetric.objects.all():
+            metrics.setdefault(metric.user_type, {})[metric.pk] = metric
+        return metrics
+
+    def invalidate(self):
+        self._snapshot.invalidate()
+
+    def get(self, user_type, id):
+        return self._snapshot.get().get(user_type, {}).get(id)
+
+    def build_scores(self, user_type, metric_scores):
+        """Turns submitted [{'metric_id': .., 'rating': ..}] into unsaved MetricScores in one pass.
+
+        Raises EvaluationMetric.DoesNotExist for a metric that isn't one of user_type's and ValueError
+        for a malformed entry; nothing is built unless every entry is valid.
+        """
+        metrics = self._snapshot.get().get(user_type, {})
+        scores = []
+        for metric_score in metric_scores:
+            try:
+                metric = metrics.get(self.parse_integer(metric_score['metric_id']))
+                score = self.parse_integer(metric_score.get('rating', 50))
+            except (KeyError, TypeError, AttributeError, ValueError):
+                raise ValueError(f"malformed metric score {metric_score!r}")
+            if metric is None:
+                raise EvaluationMetric.DoesNotExist(f"no {user_type} metric {metric_score['metric_id']}")
+            scores.append(MetricScore(metric=metric, score=score))
+        return scores
+
+    @staticmethod
+    def parse_integer(value):
+        """An int from an int, an integral float or a string of one; int() alone would turn 4.7 into 4."""
+        if isinstance(value, bool):
+            raise ValueError(value)
+        if isinstance(value, str):
+            value = value.strip()
+            if value.lstrip('+-').isdigit():
+                return int(value)
+            value = float(value)
+        if isinstance(value, float) and not value.is_integer():
+            raise ValueError(value)
+        return int(value)
+
+
 class MetricScore(models.Model):
     metric = models.ForeignKey(EvaluationMetric, on_delete=models.CASCADE)
     score = models.IntegerField(null=False, blank=False)
@@ -113,6 +177,9 @@ class Feedback(models.Model):
 
     def delete(self, *args, **kwargs):
         print("deleting")
+        calculator = ScoreCalculator.for_feedback(self)
+        if calculator:
+            calculator.remove_feedback(self)
         for s in self.metric_scores.all():
             s.delete()
         return super().delete(*args, **kwargs)
@@ -128,10 +195,70 @@ class Feedback(models.Model):
 
 
 class FeedbackCatalogue(metaclass=Singleton):
+    SATISFACTION_ORDERINGS = {
+        'avg': ['average_score'],
+        'bad_feedbacks': ['-bad_feedbacks_count'],
+        'total_feedbacks': ['-total_feedbacks_count'],
+        'ratio': ['-bad_ratio'],
+    }
+
     @property
     def feedbacks(self):
         return Feedback.objects.all()
 
+    def with_average_score(self, queryset, name='average_score'):
+        """Annotates the SQL equivalent of Feedback.get_average_score under `name`."""
+        average = MetricScore.objects.filter(feedback=OuterRef('pk')).order_by() \
+            .values('feedback').annotate(average=Avg('score')).values('average')
+        return queryset.annotate(**{name: Coalesce(Subquery(average, output_field=FloatField()), Value(100.0))})
+
+    def search_satisfaction(self, role, threshold, after=None, ordering='avg'):
+        """One row per NormalUser of the role who wrote at least one feedback averaging below threshold.
+
+        Each row holds the user id, the average of their feedback averages and their total and bad feedback counts.
+        """
+        feedbacks = self.feedbacks.filter(user__user__role=role)
+        if after:
+            feedbacks = feedbacks.filter(created_at__gte=after)
+        result = self.with_average_score(feedbacks, 'feedback_average').values('user').annotate(
+            average_score=Avg('feedback_average'),
+            total_feedbacks_count=Count('id'),
+            bad_feedbacks_count=Count('id', filter=Q(feedback_average__lt=threshold)),
+        ).filter(bad_feedbacks_count__gt=0).annotate(
+            bad_ratio=ExpressionWrapper(F('bad_feedbacks_count') * 1.0 / F('total_feedbacks_count'),
+                                        output_field=FloatField())
+        )
+        return result.order_by(*self.SATISFACTION_ORDERINGS.get(ordering, self.SATISFACTION_ORDERINGS['avg']))
+
+    def replace(self, request: Request, user: NormalUser, description, scores: List[MetricScore]):
+        """Stores the user's feedback on a request in place of the ones they gave before, in one transaction.
+
+        The request row is locked first, so concurrent resubmissions run one after the other and each removes
+        what the previous one wrote; the rated user's score moves by the difference of old and new scores.
+        """
+        with transaction.atomic():
+            request = Request.objects.select_for_update().get(pk=request.pk)
+            old_ids = list(self.feedbacks.filter(request=request, user=user).values_list('pk', flat=True))
+            old_scores = MetricScore.objects.filter(feedback__in=old_ids)
+            old_totals = old_scores.aggregate(total=Sum('score'), count=Count('id'))
+            old_score_ids = list(old_scores.values_list('pk', flat=True))
+            if old_ids:
+                # the through rows go with the feedbacks, the scores they pointed to have to go on their own
+                Feedback.objects.filter(pk__in=old_ids).delete()
+                MetricScore.objects.filter(pk__in=old_score_ids).delete()
+
+            MetricScore.objects.bulk_create(scores)
+            feedback = Feedback.objects.create(request=request, user=user, description=description)
+            Feedback.metric_scores.through.objects.bulk_create([
+                Feedback.metric_scores.through(feedback_id=feedback.pk, metricscore_id=score.pk) for score in scores
+            ])
+
+            calculator = ScoreCalculator.for_feedback(feedback)
+            if calculator:
+                calculator.apply_delta(sum(score.score for score in scores) - (old_totals['total'] or 0),
+                                       len(scores) - old_totals['count'])
+        return feedback
+
     def search(self, query):
         result = self.feedbacks
 
@@ -217,6 +344,23 @@ class SystemFeedbackCatalogue(metaclass=Singleton):
     def feedbacks(self):
         return SystemFeedback.objects.all()
 
+    def mark_viewed(self, ids=None, before=None):
+        """Moves new feedbacks with the given ids and/or created before the given time to viewed.
+
+        Replied feedbacks keep their status. Returns the ids of the feedbacks that changed.
+        """
+        feedbacks = self.feedbacks.filter(status=SystemFeedback.SystemFeedbackStatus.New)
+        if ids is not None:
+            feedbacks = feedbacks.filter(pk__in=ids)
+        if before is not None:
+            feedbacks = feedbacks.filter(created_at__lt=before)
+        with transaction.atomic():
+            # the locked rows are re-checked against the status filter, so a concurrent reply is not overwritten
+            changed = list(feedbacks.select_for_update().order_by('pk').values_list('pk', flat=True))
+            if changed:
+                self.feedbacks.filter(pk__in=changed).update(status=SystemFeedback.SystemFeedbackStatus.Viewed)
+        return changed
+
     def search(self, query):
         result = self.feedbacks
         for field in ['type', 'status']:
@@ -254,39 +398,181 @@ class ScorePolicy(models.Model):
 
 
 class ScoreCalculator:
+    DEFAULT_SCORE = 100
 
     def __init__(self, normal_user: NormalUser):
         self.normal_user = normal_user
 
-    def update_score(self):
-        print("UPDATE SCORE")
+    @classmethod
+    def for_feedback(cls, feedback: Feedback):
+        """Calculator of the user a feedback rates: the request's specialist if the customer wrote it, else the customer."""
+        request = feedback.request
+        if feedback.user_id == request.customer.normal_user_id:
+            return cls(request.specialist.normal_user) if request.specialist_id else None
+        return cls(request.customer.normal_user)
+
+    def get_received_scores(self):
         if self.normal_user.user.get_role() == accounts.models.User.UserRole.Customer:
-            requests = Request.objects.filter(
-                customer__id=self.normal_user.user.full_user.id)
+            return MetricScore.objects.filter(feedback__request__customer__normal_user=self.normal_user) \
+                .exclude(feedback__user=self.normal_user)
         elif self.normal_user.user.get_role() == accounts.models.User.UserRole.Specialist:
-            requests = Request.objects.filter(
-                specialist__id=self.normal_user.user.full_user.id)
+            return MetricScore.objects.filter(feedback__request__specialist__normal_user=self.normal_user,
+                                              feedback__user=F('feedback__request__customer__normal_user'))
         else:
             raise Exception()
 
-        feedbacks = []
-        for request in requests:
-            feedbacks_ = Feedback.objects.filter(request__id=request.id).exclude(
-                user_id=self.normal_user.id)
-            feedbacks.extend(feedbacks_)
-
-        counter = 0
-        sum = 0
-        for feedback in feedbacks:
-            for metric_score in feedback.metric_scores.all():
-                sum += metric_score.score
-                counter += 1
-
-        if counter == 0:
-            self.normal_user.set_score(100)
-        else:
-            self.normal_user.set_score(sum / counter)
-        self.normal_user.save()
+    def update_score(self):
+        """Rebuilds the running totals from scratch with a single aggregate query."""
+        totals = self.get_received_scores().aggregate(total=Sum('score'), count=Count('id'))
+        self.normal_user.score_sum = totals['total'] or 0
+        self.normal_user.score_count = totals['count']
+        self.normal_user.set_score(self.normal_user.score_sum / self.normal_user.score_count
+                                   if self.normal_user.score_count else self.DEFAULT_SCORE)
+        self.normal_user.save(update_fields=['score', 'score_sum', 'score_count'])
+
+    def add_feedback(self, feedback: Feedback):
+        totals = feedback.metric_scores.aggregate(total=Sum('score'), count=Count('id'))
+        self.apply_delta(totals['total'] or 0, totals['count'])
+
+    def remove_feedback(self, feedback: Feedback):
+        totals = feedback.metric_scores.aggregate(total=Sum('score'), count=Count('id'))
+        self.apply_delta(-(totals['total'] or 0), -totals['count'])
+
+    def apply_delta(self, score_sum, score_count):
+        """Adds metric scores to (or with negative values removes them from) the running totals in one UPDATE."""
+        if not score_count and not score_sum:
+            return
+        # every F() on the right hand side reads the row as it was before this UPDATE
+        NormalUser.objects.filter(pk=self.normal_user.pk).update(
+            score_sum=F('score_sum') + score_sum,
+            score_count=F('score_count') + score_count,
+            score=Case(
+                When(score_count__gt=-score_count,
+                     then=ExpressionWrapper((F('score_sum') + score_sum) / (F('score_count') + score_count),
+                                            output_field=FloatField())),
+                default=Value(float(self.DEFAULT_SCORE)),
+                output_field=FloatField()
+            )
+        )
+        self.normal_user.refresh_from_db(fields=['score', 'score_sum', 'score_count'])
+        # user searches can be sorted by score
+        accounts.models.UserCatalogue().invalidate()
+
+
+class ScoreRebuilder:
+    """Recomputes the score totals of every NormalUser from their metric scores, one locked chunk at a time.
+
+    Each chunk locks its users before reading their scores. A feedback saved meanwhile either commits its scores
+    and its apply_delta first and is read, or waits on the lock and applies its delta to the rebuilt totals.
+    """
+    CHUNK_SIZE = 1000
+
+    def get_totals(self, ids):
+        """Maps the id of every rated NormalUser in ids to the (sum, count) of the metric scores they received."""
+        rated = Case(
+            When(feedback__user=F('feedback__request__customer__normal_user'),
+                 then=F('feedback__request__specialist__normal_user')),
+            default=F('feedback__request__customer__normal_user'),
+        )
+        rows = MetricScore.objects.filter(Q(feedback__request__specialist__normal_user__in=ids) |
+                                          Q(feedback__request__customer__normal_user__in=ids)) \
+            .annotate(rated=rated).filter(rated__in=ids).values('rated') \
+            .annotate(total=Sum('score'), count=Count('id')).order_by()
+        return {row['rated']: (row['total'], row['count']) for row in rows}
+
+    def rebuild(self, progress=None):
+        ids = list(NormalUser.objects.order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(ids), self.CHUNK_SIZE):
+            chunk = ids[start:start + self.CHUNK_SIZE]
+            with transaction.atomic():
+                list(NormalUser.objects.select_for_update().filter(pk__in=chunk).order_by('pk')
+                     .values_list('pk', flat=True))
+                totals = self.get_totals(chunk)
+                users = []
+                for pk in chunk:
+                    score_sum, score_count = totals.get(pk, (0, 0))
+                    users.append(NormalUser(pk=pk, score_sum=score_sum, score_count=score_count,
+                                            score=score_sum / score_count if score_count
+                                            else ScoreCalculator.DEFAULT_SCORE))
+                NormalUser.objects.bulk_update(users, ['score', 'score_sum', 'score_count'])
+            if progress:
+                progress(start + len(users), len(ids))
+        accounts.models.UserCatalogue().invalidate()
+        return len(ids)
+
+
+class ScoreRebuildJob(models.Model):
+    class JobStatus(models.TextChoices):
+        Pending = 'P', _('Pending')
+        Running = 'R', _('Running')
+        Done = 'D', _('Done')
+        Failed = 'F', _('Failed')
+
+    status = models.CharField(max_length=1, choices=JobStatus.choices, default=JobStatus.Pending)
+    processed = models.IntegerField(default=0)
+    total = models.IntegerField(default=0)
+    error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def get_status(self):
+        return self.status
+
+    def run(self):
+        ScoreRebuildJob.objects.filter(pk=self.pk).update(status=self.JobStatus.Running)
+        try:
+            ScoreRebuilder().rebuild(progress=self.report_progress)
+        except Exception as e:
+            ScoreRebuildJob.objects.filter(pk=self.pk).update(
+                status=self.JobStatus.Failed, error=str(e), finished_at=timezone.now())
+            raise
+        ScoreRebuildJob.objects.filter(pk=self.pk).update(status=self.JobStatus.Done, finished_at=timezone.now())
+
+    def report_progress(self, processed, total):
+        ScoreRebuildJob.objects.filter(pk=self.pk).update(processed=processed, total=total)
+
+
+class ScorePolicyTable(metaclass=Singleton):
+    """Score policies sorted by minimum_score, kept in process memory and searched with bisect."""
+    DEFAULT_ALLOWED_REQUESTS = 20
+    SAME_SCORE_TOLERANCE = 0.0001
+
+    def __init__(self):
+        self._snapshot = VersionedLocalCache('score-policies', self._build)
+
+    def _build(self):
+        policies = list(ScorePolicy.objects.order_by('minimum_score', 'pk')
+                        .values_list('pk', 'minimum_score', 'allowed_requests'))
+        return [policy[1] for policy in policies], policies
+
+    def invalidate(self):
+        self._snapshot.invalidate()
+
+    def get_allowed_requests(self, score):
+        thresholds, policies = self._snapshot.get()
+        if not policies:
+            return self.DEFAULT_ALLOWED_REQUESTS
+        # the last policy whose minimum_score the score reaches, none reached allows nothing
+        index = bisect_right(thresholds, score)
+        return policies[index - 1][2] if index else 0
+
+    def get_allowed_requests_expression(self, score_field):
+        """get_allowed_requests as a database expression over score_field, to compare with in a query."""
+        thresholds, policies = self._snapshot.get()
+        if not policies:
+            return Value(self.DEFAULT_ALLOWED_REQUESTS, output_field=IntegerField())
+        # highest minimum_score first, the first policy the score reaches wins as in get_allowed_requests
+        return Case(*[When(**{score_field + '__gte': minimum_score}, then=Value(allowed_requests))
+                      for pk, minimum_score, allowed_requests in reversed(policies)],
+                    default=Value(0), output_field=IntegerField())
+
+    def find_same_score(self, score):
+        """Id of the policy whose minimum_score equals score within SAME_SCORE_TOLERANCE, or None."""
+        thresholds, policies = self._snapshot.get()
+        index = bisect_left(thresholds, score - self.SAME_SCORE_TOLERANCE)
+        if index < len(thresholds) and abs(thresholds[index] - score) < self.SAME_SCORE_TOLERANCE:
+            return policies[index][0]
+        return None
 
 
 class ScorePolicyChecker:
@@ -296,19 +582,11 @@ class ScorePolicyChecker:
 
     def get_allowed_request(self):
         if not USE_SCORE_LIMIT:
-            return 20
-        score_policies = ScorePolicy.objects.all().order_by('minimum_score')
-        if not score_policies.exists():
-            print("no score policy")
-            best_allowed_request = 20
-        else:
-            print("set to 0")
-            best_allowed_request = 0
-        for score_policy in score_policies:
-            print(score_policy.minimum_score)
-            if self.score >= score_policy.minimum_score:
-                best_allowed_request = score_policy.allowed_requests
-            else:
-                break
-        print(best_allowed_request)
-        return best_allowed_request
+            return ScorePolicyTable.DEFAULT_ALLOWED_REQUESTS
+        return ScorePolicyTable().get_allowed_requests(self.score)
+
+    @staticmethod
+    def get_allowed_request_expression(score_field):
+        if not USE_SCORE_LIMIT:
+            return Value(ScorePolicyTable.DEFAULT_ALLOWED_REQUESTS, output_field=IntegerField())
+        return ScorePolicyTable().get_allowed_requests_expression(score_field)
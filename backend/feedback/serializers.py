@@ -1,6 +1,7 @@
 from accounts import serializers
 from core.serializers import RequestSerializer
-from feedback.models import SystemFeedback, SystemFeedbackReply, EvaluationMetric, Feedback, MetricScore, ScorePolicy
+from feedback.models import SystemFeedback, SystemFeedbackReply, EvaluationMetric, Feedback, MetricScore, ScorePolicy, \
+    ScoreRebuildJob
 
 
 class EvaluationMetricSerializer(serializers.ModelSerializer):
@@ -99,3 +100,9 @@ class ScorePolicySerializer(serializers.ModelSerializer):
     class Meta:
         model = ScorePolicy
         fields = '__all__'
+
+
+class ScoreRebuildJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ScoreRebuildJob
+        fields = '__all__'
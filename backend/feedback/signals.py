@@ -0,0 +1,16 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from feedback.models import ScorePolicy, ScorePolicyTable, EvaluationMetric, EvaluationMetricCatalogue, \
+    EvaluationMetricRegistry
+
+
+@receiver([post_save, post_delete], sender=ScorePolicy)
+def invalidate_score_policies(sender, **kwargs):
+    ScorePolicyTable().invalidate()
+
+
+@receiver([post_save, post_delete], sender=EvaluationMetric)
+def invalidate_evaluation_metrics(sender, **kwargs):
+    EvaluationMetricCatalogue().invalidate()
+    EvaluationMetricRegistry().invalidate()
@@ -1,3 +1,168 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APITestCase
 
-# Create your tests here.
+from accounts.models import User, NormalUser
+from core.models import Request
+from feedback.models import SystemFeedback, EvaluationMetric, MetricScore, FeedbackCatalogue, ScoreRebuilder, Feedback
+from utils.testing import create_customer, create_user, create_specialist, create_speciality, create_request
+
+
+class MarkSystemFeedbackViewedTest(APITestCase):
+    def setUp(self):
+        author = create_customer().normal_user
+        self.feedbacks = [SystemFeedback.objects.create(user=author, text=str(i)) for i in range(3)]
+        self.client.force_authenticate(create_user(User.UserRole.TechnicalManager))
+
+    def mark_viewed(self, **data):
+        return self.client.post(reverse('system-search'), data, format='json')
+
+    def get_new(self):
+        return set(SystemFeedback.objects.filter(status=SystemFeedback.SystemFeedbackStatus.New)
+                   .values_list('pk', flat=True))
+
+    def test_marks_only_the_given_ids(self):
+        response = self.mark_viewed(ids=f'{self.feedbacks[0].pk},{self.feedbacks[1].pk}')
+        self.assertEqual(response.json(), {'ids': [self.feedbacks[0].pk, self.feedbacks[1].pk]})
+        self.assertEqual(self.get_new(), {self.feedbacks[2].pk})
+
+    def test_replied_feedbacks_keep_their_status(self):
+        SystemFeedback.objects.filter(pk=self.feedbacks[0].pk).update(status=SystemFeedback.SystemFeedbackStatus.Replied)
+        response = self.mark_viewed(ids=[self.feedbacks[0].pk])
+        self.assertEqual(response.json(), {'ids': []})
+        self.assertEqual(SystemFeedback.objects.get(pk=self.feedbacks[0].pk).status,
+                         SystemFeedback.SystemFeedbackStatus.Replied)
+
+    def test_unparseable_ids_are_rejected(self):
+        for ids in ['1,x', {'id': 1}, [1, None], 1.5]:
+            response = self.mark_viewed(ids=ids)
+            self.assertEqual(response.status_code, 400, ids)
+        self.assertEqual(len(self.get_new()), 3)
+
+
+class FeedbackRatingTest(APITestCase):
+    def setUp(self):
+        speciality = create_speciality()
+        customer = create_customer()
+        self.request = create_request(customer, speciality, specialist=create_specialist([speciality]),
+                                      status=Request.RequestStatus.DONE)
+        self.metric = EvaluationMetric.objects.create(title='quality', description='',
+                                                      user_type=User.UserRole.Specialist)
+        self.client.force_authenticate(customer.normal_user.user)
+
+    def submit(self, rating):
+        return self.client.post(reverse('feedback'), {
+            'request_id': self.request.pk, 'metric_scores': [{'metric_id': self.metric.pk, 'rating': rating}],
+        }, format='json')
+
+    def test_integer_ratings_are_kept(self):
+        for rating in [4, 4.0, '4']:
+            self.assertEqual(self.submit(rating).status_code, 200, rating)
+        self.assertEqual(list(MetricScore.objects.values_list('score', flat=True)), [4])
+
+    def test_non_integer_ratings_are_rejected(self):
+        for rating in [4.7, '4.7', 'four', True, None]:
+            self.assertEqual(self.submit(rating).status_code, 400, rating)
+        self.assertFalse(MetricScore.objects.exists())
+
+
+class FeedbackResubmissionTest(APITestCase):
+    def setUp(self):
+        self.speciality = create_speciality()
+        self.specialist = create_specialist([self.speciality])
+        self.metrics = [EvaluationMetric.objects.create(title=f'metric {i}', description='',
+                                                        user_type=User.UserRole.Specialist) for i in range(2)]
+        self.request = self.create_done_request()
+
+    def create_done_request(self):
+        customer = create_customer()
+        return create_request(customer, self.speciality, specialist=self.specialist, status=Request.RequestStatus.DONE)
+
+    def submit(self, ratings, request=None):
+        request = request or self.request
+        self.client.force_authenticate(request.customer.normal_user.user)
+        response = self.client.post(reverse('feedback'), {
+            'request_id': request.pk,
+            'metric_scores': [{'metric_id': metric.pk, 'rating': rating}
+                              for metric, rating in zip(self.metrics, ratings)],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def assert_totals(self, score_sum, score_count):
+        rated = NormalUser.objects.get(pk=self.specialist.normal_user_id)
+        self.assertEqual((rated.score_sum, rated.score_count), (score_sum, score_count))
+        self.assertAlmostEqual(rated.score, score_sum / score_count)
+
+    def test_resubmission_moves_the_totals_by_the_difference(self):
+        self.submit([4, 2])
+        self.assert_totals(6, 2)
+        self.submit([5])
+        self.assert_totals(5, 1)
+        # another customer's feedback stays counted when the first one resubmits
+        self.submit([1], request=self.create_done_request())
+        self.assert_totals(6, 2)
+        self.submit([3, 3])
+        self.assert_totals(7, 3)
+
+    def test_replaced_metric_scores_are_deleted(self):
+        self.submit([4, 2])
+        replaced = list(MetricScore.objects.filter(feedback__request=self.request).values_list('pk', flat=True))
+        self.submit([5])
+        self.assertFalse(MetricScore.objects.filter(pk__in=replaced).exists())
+        self.assertEqual(list(MetricScore.objects.filter(metric__in=self.metrics).values_list('score', flat=True)), [5])
+        self.assertEqual(Feedback.objects.filter(request=self.request).count(), 1)
+        self.assertEqual(Feedback.metric_scores.through.objects.filter(feedback__request=self.request).count(), 1)
+
+
+class FeedbackSubmissionQueriesTest(APITestCase):
+    def setUp(self):
+        speciality = create_speciality()
+        customer = create_customer()
+        self.request = create_request(customer, speciality, specialist=create_specialist([speciality]),
+                                      status=Request.RequestStatus.DONE)
+        self.metrics = [EvaluationMetric.objects.create(title=f'metric {i}', description='',
+                                                        user_type=User.UserRole.Specialist) for i in range(10)]
+        self.client.force_authenticate(customer.normal_user.user)
+
+    def submit(self, metrics):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse('feedback'), {
+                'request_id': self.request.pk,
+                'metric_scores': [{'metric_id': metric.pk, 'rating': 4} for metric in metrics],
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def test_queries_do_not_grow_with_the_number_of_metrics(self):
+        # the first submission also loads the metric snapshot, the later ones replace a feedback
+        self.submit(self.metrics[:1])
+        self.assertEqual(self.submit(self.metrics), self.submit(self.metrics[:1]))
+        self.assertEqual(MetricScore.objects.count(), 1)
+
+
+class ScoreRebuilderTest(TestCase):
+    FIELDS = ('score_sum', 'score_count', 'score')
+
+    def setUp(self):
+        speciality = create_speciality()
+        metric = EvaluationMetric.objects.create(title='quality', description='', user_type=User.UserRole.Specialist)
+        self.specialists = [create_specialist([speciality]).normal_user for _ in range(3)]
+        for rating, specialist in zip([3, 5], self.specialists):
+            customer = create_customer()
+            request = create_request(customer, speciality, specialist=specialist.specialist_normal_user,
+                                     status=Request.RequestStatus.DONE)
+            FeedbackCatalogue().replace(request, customer.normal_user, '', [MetricScore(metric=metric, score=rating)])
+
+    def get_totals(self):
+        users = NormalUser.objects.filter(pk__in=[specialist.pk for specialist in self.specialists]).order_by('pk')
+        return list(users.values_list(*self.FIELDS))
+
+    def test_rebuild_in_chunks_restores_the_running_totals(self):
+        self.assertEqual(self.get_totals(), [(3, 1, 3), (5, 1, 5), (0, 0, 100)])
+        NormalUser.objects.update(score_sum=7, score_count=7, score=1)
+        rebuilder = ScoreRebuilder()
+        rebuilder.CHUNK_SIZE = 2
+        rebuilder.rebuild()
+        self.assertEqual(self.get_totals(), [(3, 1, 3), (5, 1, 5), (0, 0, 100)])
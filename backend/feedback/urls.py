@@ -1,7 +1,7 @@
 from django.urls import path
 
 from feedback.views import SubmitSystemFeedbackView, SearchSystemFeedbackView, SubmitSystemFeedbackReplyView, \
-    EvaluationMetricView, FeedbackView, ForceUpdateScoresView, ScorePolicyView
+    EvaluationMetricView, FeedbackView, ForceUpdateScoresView, ScorePolicyView, ScoreRebuildJobView
 
 urlpatterns = [
     path('system/submit/', SubmitSystemFeedbackView.as_view(), name='system-submit'),
@@ -12,6 +12,7 @@ urlpatterns = [
     path('request/', FeedbackView.as_view(), name='feedback'),
     path('request/<service_request_id>/', FeedbackView.as_view(), name='feedback'),
     path('score/force-update/', ForceUpdateScoresView.as_view(), name='score-update-all'),
+    path('score/force-update/jobs/<int:job_id>/', ScoreRebuildJobView.as_view(), name='score-update-job'),
     path('score/force-update/<user_id>/', ForceUpdateScoresView.as_view(), name='score-update'),
     path('score/policy/', ScorePolicyView.as_view(), name='score-policy'),
     path('score/policy/<score_policy_id>/', ScorePolicyView.as_view(), name='score-policy'),
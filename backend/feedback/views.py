@@ -3,21 +3,24 @@ import json
 from django.http import JsonResponse
 from rest_framework.response import Response
 from rest_condition import And, Or, Not
-from .serializers import MetricScoreSerializer, ScorePolicySerializer, SystemFeedbackCreationSerializer, SystemFeedbackReplySerializer
-from .models import EvaluationMetric, MetricScore, ScoreCalculator, ScorePolicy
+from .serializers import ScorePolicySerializer, SystemFeedbackCreationSerializer, SystemFeedbackReplySerializer, \
+    ScoreRebuildJobSerializer
+from .models import EvaluationMetric, MetricScore, ScoreCalculator, ScorePolicy, ScoreRebuildJob, ScorePolicyTable
 from knox.auth import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.status import HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND, HTTP_403_FORBIDDEN
+from rest_framework.status import HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND, HTTP_403_FORBIDDEN, HTTP_202_ACCEPTED
 from rest_framework.views import APIView
 from django.utils.translation import gettext_lazy as _
 
 from accounts.models import User, NormalUser
 from core.models import RequestCatalogue
-from feedback.models import SystemFeedbackCatalogue, SystemFeedback, EvaluationMetricCatalogue, FeedbackCatalogue
+from feedback.models import SystemFeedbackCatalogue, SystemFeedback, EvaluationMetricCatalogue, FeedbackCatalogue, \
+    EvaluationMetricRegistry
 from feedback.serializers import SystemFeedbackSerializer, SystemFeedbackReadonlyReplySerializer, EvaluationMetricSerializer, \
     FeedbackSerializer, FeedbackReadOnlySerializer
 from log.models import Logger
-from utils.helper_funcs import ListAdapter
+from utils.background import BackgroundRunner
+from utils.helper_funcs import ListAdapter, TimestampAdapter
 from utils.permissions import PermissionFactory, IsReadyOnlyRequest
 from feedback.constants import *
 
@@ -133,20 +136,24 @@ class SearchSystemFeedbackView(APIView):
 
     @Logger().log_name()
     def post(self, request):
+        """Marks system feedbacks viewed, by 'ids' and/or all of them created before the 'before' timestamp."""
         ids = request.data.get('ids')
-        id_list = ListAdapter().python_ensure_list(ids)
-        objs = []
-        for id in id_list:
-            try:
-                feedback: SystemFeedback = SystemFeedback.objects.get(pk=id)
-            except:
-                continue
-            if not feedback:
-                continue
-            feedback.set_status(SystemFeedback.SystemFeedbackStatus.Viewed)
-            objs.append(feedback)
-        SystemFeedback.objects.bulk_update(objs, ['status'])
-        return Response({'ids': map(lambda x: x.id, objs)})
+        before = request.data.get('before')
+        if ids is None and before is None:
+            return JsonResponse({'error': _(NO_ID_PROVIDED_ERROR)}, status=HTTP_400_BAD_REQUEST)
+        try:
+            id_list = ListAdapter().python_ensure_list(ids) if ids is not None else None
+        except (TypeError, ValueError):
+            id_list = None
+        # ids of a shape ListAdapter doesn't know come back as None, which would mean every one of them
+        if ids is not None and id_list is None:
+            return JsonResponse({'error': _(NO_ID_PROVIDED_ERROR)}, status=HTTP_400_BAD_REQUEST)
+        try:
+            before = TimestampAdapter().parse(before) if before is not None else None
+        except ValueError:
+            return JsonResponse({'error': _(INVALID_TIMESTAMP_ERROR)}, status=HTTP_400_BAD_REQUEST)
+        ids = SystemFeedbackCatalogue().mark_viewed(ids=id_list, before=before)
+        return Response({'ids': ids})
 
 
 class SubmitSystemFeedbackReplyView(APIView):
@@ -225,55 +232,19 @@ class FeedbackView(APIView):
 
         service_request = RequestCatalogue().search(query)
 
-        old_feedbacks = FeedbackCatalogue().search(
-            {'request': request_id, 'user': request.user.id})
-
         if not service_request:
             return JsonResponse({'error': REQUEST_NOT_FOUND_ERROR}, status=HTTP_404_NOT_FOUND)
 
-        eval_metrics = EvaluationMetricCatalogue().search(query=eval_metric_query)
-
-        metric_scores_data = []
-        for metric_score_dict in metric_scores:
-            try:
-                metric = eval_metrics.get(
-                    pk=int(metric_score_dict['metric_id']))
-            except EvaluationMetric.DoesNotExist:
-                return JsonResponse({'error': NO_EVALUATION_METRIC_FOUND_ERROR}, status=HTTP_400_BAD_REQUEST)
-
-            data = {
-                'metric': int(metric_score_dict['metric_id']),
-                'score': metric_score_dict.get('rating', 50),
-            }
-
-            serializer = MetricScoreSerializer(data=data)
-            serializer.is_valid(raise_exception=True)
-            metric_score = serializer.save()
-            metric_scores_data.append(metric_score.pk)
-
-        data = {
-            'metric_scores': metric_scores_data,
-            'request': request_id,
-            'user': NormalUser.objects.get(user__pk=request.user.id).pk,
-            'description': description
-        }
-
-        if old_feedbacks:
-            print("old_feedback", old_feedbacks)
-            for f in old_feedbacks:  # dont use bulk delete
-                f.delete()
-
-        serializer = FeedbackSerializer(data=data)
-        serializer.is_valid(raise_exception=True)
-        feedback = serializer.save()
-        if request.user.get_role() == User.UserRole.Specialist:
-            ScoreCalculator(
-                feedback.request.customer.normal_user).update_score()
-        else:
-            ScoreCalculator(
-                feedback.request.specialist.normal_user).update_score()
+        try:
+            scores = EvaluationMetricRegistry().build_scores(eval_metric_query['user_type'], metric_scores)
+        except EvaluationMetric.DoesNotExist:
+            return JsonResponse({'error': NO_EVALUATION_METRIC_FOUND_ERROR}, status=HTTP_400_BAD_REQUEST)
+        except ValueError:
+            return JsonResponse({'error': INVALID_METRIC_SCORE_ERROR}, status=HTTP_400_BAD_REQUEST)
 
-        return JsonResponse(serializer.data)
+        feedback = FeedbackCatalogue().replace(service_request[0], NormalUser.objects.get(user__pk=request.user.id),
+                                               description, scores)
+        return JsonResponse(FeedbackSerializer(feedback).data)
 
 
 class ForceUpdateScoresView(APIView):
@@ -284,15 +255,31 @@ class ForceUpdateScoresView(APIView):
     @Logger().log_name()
     def post(self, request, user_id=''):
         if user_id == '':
-            users = NormalUser.objects.all()
-        else:
-            users = NormalUser.objects.filter(pk=user_id)
+            # recomputing everyone can outlive the worker timeout, so it runs as a job the client polls
+            job = ScoreRebuildJob.objects.create()
+            BackgroundRunner().submit(job.run)
+            return JsonResponse({'success': True, 'job': ScoreRebuildJobSerializer(job).data},
+                                status=HTTP_202_ACCEPTED)
+        users = NormalUser.objects.filter(pk=user_id)
         for user in users:
             ScoreCalculator(user).update_score()
 
         return JsonResponse({'success': True})
 
 
+class ScoreRebuildJobView(APIView):
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [PermissionFactory(User.UserRole.TechnicalManager).get_permission_class() |
+                          PermissionFactory(User.UserRole.CompanyManager).get_permission_class()]
+
+    def get(self, request, job_id):
+        try:
+            job = ScoreRebuildJob.objects.get(pk=job_id)
+        except ScoreRebuildJob.DoesNotExist:
+            return JsonResponse({'error': SCORE_REBUILD_JOB_NOT_FOUND_ERROR}, status=HTTP_404_NOT_FOUND)
+        return JsonResponse(ScoreRebuildJobSerializer(job).data)
+
+
 class ScorePolicyView(APIView):
     authentication_classes = [TokenAuthentication]
     permission_classes = [Or(PermissionFactory(User.UserRole.TechnicalManager).get_permission_class(),
@@ -317,11 +304,10 @@ class ScorePolicyView(APIView):
         return JsonResponse(serialized.data, safe=False)
 
     def find_same_score(self, score):
-        score_policies = ScorePolicy.objects.all()
-        for score_policy in score_policies:
-            if abs(score_policy.minimum_score - float(score)) < 0.0001:
-                return score_policy
-        return None
+        score_policy_id = ScorePolicyTable().find_same_score(float(score))
+        if score_policy_id is None:
+            return None
+        return ScorePolicy.objects.filter(pk=score_policy_id).first()
 
     @Logger().log_name()
     def post(self, request, score_policy_id=''):
@@ -1,7 +1,13 @@
 bind = '0.0.0.0:8000'
 wsgi_app = "arno.wsgi:application"
 workers = 1
+threads = 8
 accesslog = '-'
 loglevel = 'critical'
 capture_output = True
 enable_stdio_inheritance = True
+
+
+def worker_exit(server, worker):
+    from log.models import LogSink
+    LogSink().shutdown()
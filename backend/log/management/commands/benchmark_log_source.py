@@ -0,0 +1,52 @@
+import inspect
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from log.models import LogSourceResolver
+
+
+def legacy_source():
+    # the inspect.stack() based lookup Logger.log used before LogSourceResolver
+    stack = inspect.stack()
+    try:
+        the_class = stack[1][0].f_locals["self"].__class__.__name__
+        the_method = stack[1][0].f_code.co_name
+        frm = inspect.stack()[1]
+        mod = inspect.getmodule(frm[0])
+        return f"{mod.__name__}.{the_class}.{the_method}"
+    except:
+        return ""
+
+
+class SampleView:
+    def get(self, lookup):
+        return lookup()
+
+
+def call_at_depth(depth, fn):
+    if depth == 0:
+        return SampleView().get(fn)
+    return call_at_depth(depth - 1, fn)
+
+
+class Command(BaseCommand):
+    help = 'Measures the per-call cost of resolving the source of a log record'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--depth', type=int, default=60, help='extra frames below the logging call')
+        parser.add_argument('--number', type=int, default=200)
+
+    def handle(self, *args, **options):
+        depth = options['depth']
+        number = options['number']
+        resolver = LogSourceResolver()
+        candidates = [
+            ('call overhead', lambda: ""),
+            ('inspect.stack()', legacy_source),
+            ('LogSourceResolver', lambda: resolver.resolve()),
+        ]
+        for name, fn in candidates:
+            seconds = min(timeit.repeat(lambda: call_at_depth(depth, fn), number=number, repeat=5))
+            self.stdout.write(f"{name:<20} {seconds / number * 1e6:12.2f} us/call  "
+                              f"({call_at_depth(depth, fn)})")
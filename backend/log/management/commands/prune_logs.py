@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from log.models import Log, LogRetention
+
+
+class Command(BaseCommand):
+    help = 'Archives logs older than LOG_RETENTION_DAYS to compressed JSONL files and deletes them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--level', action='append', choices=Log.LogLevel.values,
+                            help='only prune this level, can be repeated')
+        parser.add_argument('--batch-size', type=int, help='rows archived and deleted per batch')
+        parser.add_argument('--no-archive', action='store_true', help='delete expired rows without archiving them')
+
+    def handle(self, *args, **options):
+        retention = LogRetention()
+        if options['batch_size']:
+            retention.batch_size = options['batch_size']
+        levels = options['level'] or Log.LogLevel.values
+        now = timezone.now()
+
+        total = 0
+        started = time.monotonic()
+        for level in levels:
+            cutoff = retention.get_cutoff(level, now)
+            if cutoff is None:
+                self.stdout.write(f"[{level}] kept forever")
+                continue
+            level_started = time.monotonic()
+            removed = 0
+            for count in retention.prune_level(level, now, archive=not options['no_archive']):
+                removed += count
+            elapsed = time.monotonic() - level_started
+            total += removed
+            self.stdout.write(f"[{level}] removed {removed} rows older than {cutoff:%Y-%m-%d %H:%M} "
+                              f"in {elapsed:.2f}s ({self.rate(removed, elapsed):.0f} rows/s)")
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Removed {total} rows in {elapsed:.2f}s ({self.rate(total, elapsed):.0f} rows/s)"))
+
+    def rate(self, rows, seconds):
+        return rows / seconds if seconds > 0 else 0
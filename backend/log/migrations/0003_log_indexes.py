@@ -0,0 +1,48 @@
+# Generated by Django 3.2.9 on 2026-10-18 17:42
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+TRIGRAM_INDEXES = [
+    ('log_message_trgm_idx', 'message'),
+    ('log_source_trgm_idx', 'source'),
+]
+
+
+def create_trigram_indexes(apps, schema_editor):
+    # icontains compiles to UPPER(column) LIKE UPPER(pattern) on postgres, so index that expression
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, column in TRIGRAM_INDEXES:
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON log_log USING gin (UPPER({column}) gin_trgm_ops)')
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _ in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('log', '0002_alter_log_created_at'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+        migrations.AddIndex(
+            model_name='log',
+            index=models.Index(fields=['-created_at', '-id'], name='log_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='log',
+            index=models.Index(fields=['level', '-created_at', '-id'], name='log_level_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='log',
+            index=models.Index(fields=['source', '-created_at', '-id'], name='log_source_created_idx'),
+        ),
+    ]
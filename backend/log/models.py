@@ -1,9 +1,21 @@
-import inspect
+import atexit
+import gzip
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import timedelta
 
-from django.db import models
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, connection
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 # Create your models here.
+from arno.settings import LOG_RETENTION_DAYS, LOG_RETENTION_BATCH_SIZE, LOG_ARCHIVE_DIR
 from utils.Singleton import Singleton
 from utils.helper_funcs import ListAdapter
 
@@ -19,10 +31,15 @@ class Log(models.Model):
     level = models.CharField(max_length=1, choices=LogLevel.choices, default=LogLevel.DEBUG)
     source = models.CharField(max_length=255, blank=True, null=True)
     message = models.TextField(null=True, blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='log_created_id_idx'),
+            models.Index(fields=['level', '-created_at', '-id'], name='log_level_created_idx'),
+            models.Index(fields=['source', '-created_at', '-id'], name='log_source_created_idx'),
+        ]
         verbose_name = _('Log')
         verbose_name_plural = _('Logs')
 
@@ -42,26 +59,139 @@ class Log(models.Model):
         return self.created_at
 
 
+class LogSink(metaclass=Singleton):
+    """Buffers log records in memory and writes them with bulk_create from a background thread.
+
+    The LOG_BUFFER_* settings are read when they are used, so override_settings applies to a running sink.
+    """
+    OVERFLOW_DROP = 'drop'
+    OVERFLOW_BLOCK = 'block'
+
+    def __init__(self):
+        self.dropped = 0
+        self._pid = None
+        self._thread = None
+        self._queue = None
+        self._stopped = threading.Event()
+        self._start_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def emit(self, log: Log):
+        self._ensure_started()
+        try:
+            if settings.LOG_BUFFER_OVERFLOW == self.OVERFLOW_BLOCK:
+                self._queue.put(log, timeout=settings.LOG_BUFFER_BLOCK_TIMEOUT)
+            else:
+                self._queue.put_nowait(log)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        if self._queue is None:
+            return
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) >= settings.LOG_BUFFER_BATCH_SIZE:
+                self._write(batch)
+                batch = []
+        self._write(batch)
+
+    def shutdown(self, timeout=5):
+        self._stopped.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+        self.flush()
+
+    def _ensure_started(self):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            # a forked worker inherits the parent's queue but not its flusher thread
+            self._queue = queue.Queue(maxsize=settings.LOG_BUFFER_SIZE)
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='log-sink', daemon=True)
+            self._thread.start()
+            if self._pid is None:
+                atexit.register(self.shutdown)
+            self._pid = os.getpid()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            batch = self._take_batch()
+            if batch:
+                self._write(batch)
+
+    def _take_batch(self):
+        batch = []
+        deadline = time.monotonic() + settings.LOG_BUFFER_FLUSH_INTERVAL
+        while len(batch) < settings.LOG_BUFFER_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        if not batch:
+            return
+        with self._write_lock:
+            try:
+                Log.objects.bulk_create(batch, batch_size=settings.LOG_BUFFER_BATCH_SIZE)
+            except Exception as e:
+                print("Error flushing logs", e)
+            finally:
+                # batches are seconds apart, don't hold a connection open in between
+                connection.close()
+
+
+class LogSourceResolver(metaclass=Singleton):
+    """Builds the `module.Class.method` source of a caller from its frame, memoized per code object."""
+
+    def __init__(self):
+        self._sources = {}
+
+    def resolve(self, depth=1):
+        """Returns the source of the frame `depth` levels above the caller of this method."""
+        try:
+            frame = sys._getframe(depth + 1)
+        except ValueError:
+            return ""
+        code = frame.f_code
+        instance = frame.f_locals.get('self') if code.co_argcount else None
+        key = (code, instance.__class__ if instance is not None else None)
+        source = self._sources.get(key)
+        if source is None:
+            module = frame.f_globals.get('__name__', '')
+            if instance is not None:
+                source = f"{module}.{instance.__class__.__name__}.{code.co_name}"
+            else:
+                source = f"{module}.{code.co_name}"
+            self._sources[key] = source
+        return source
+
+
 class Logger(metaclass=Singleton):
     def log(self, message, level=Log.LogLevel.INFO, source=None):
-        stack = inspect.stack()
         if source is None:
-            try:
-                the_class = stack[1][0].f_locals["self"].__class__.__name__
-                the_method = stack[1][0].f_code.co_name
-                frm = inspect.stack()[1]
-                mod = inspect.getmodule(frm[0])
-                source = f"{mod.__name__}.{the_class}.{the_method}" if source is None else source
-            except:
-                print("Error getting source")
-                source = ""
-        log = Log.objects.create(message=message, level=level, source=source)
-        log.save()
+            source = LogSourceResolver().resolve()
+        log = Log(message=message, level=level, source=source)
+        if settings.LOG_BUFFER_ENABLED:
+            LogSink().emit(log)
+        else:
+            log.save()
 
     def log_name(self, log_level=Log.LogLevel.DEBUG):
         def _print_name(fn):
             def wrapper(*args, **kwargs):
-                print('{}.{}'.format(fn.__module__, fn.__qualname__))
                 source = f'{fn.__module__}.{fn.__qualname__}'
                 Logger().log("Method started successfully.", source=source, level=log_level)
                 retval = fn(*args, **kwargs)
@@ -85,8 +215,12 @@ class LogCatalogue(metaclass=Singleton):
             result = result.filter(pk__in=ListAdapter().python_ensure_list(query['id']))
 
         if query.get('level'):
-            result = result.filter(level__iexact=query.get('level'))
+            result = result.filter(level=query.get('level').upper())
+
+        if query.get('source_exact'):
+            result = result.filter(source=query.get('source_exact'))
 
+        # icontains on these fields is served by the trigram indexes created in migration 0003
         for field in ['source', 'message']:
             if query.get(field):
                 result = result.filter(**{field + "__icontains": query.get(field)})
@@ -99,6 +233,47 @@ class LogCatalogue(metaclass=Singleton):
             if query.get(field):
                 result = result.filter(**{'_'.join(field.split('_')[:-1]) + "__lte": query.get(field)})
 
-        result = result.order_by('-created_at')
+        result = result.order_by('-created_at', '-id')
 
         return result
+
+
+class LogRetention:
+    """Archives logs older than their level's TTL to gzipped JSONL files and deletes them in bounded batches."""
+    ARCHIVED_FIELDS = ('id', 'level', 'source', 'message', 'created_at')
+
+    def __init__(self, retention_days=None, batch_size=LOG_RETENTION_BATCH_SIZE, archive_dir=LOG_ARCHIVE_DIR):
+        self.retention_days = LOG_RETENTION_DAYS if retention_days is None else retention_days
+        self.batch_size = batch_size
+        self.archive_dir = archive_dir
+
+    def get_cutoff(self, level, now=None):
+        days = self.retention_days.get(level)
+        if days is None:
+            return None
+        return (now or timezone.now()) - timedelta(days=days)
+
+    def get_archive_path(self, level, now=None):
+        return os.path.join(self.archive_dir, f"log-{level}-{(now or timezone.now()).strftime('%Y%m%d')}.jsonl.gz")
+
+    def expired(self, level, cutoff):
+        return Log.objects.filter(level=level, created_at__lt=cutoff).order_by('created_at', 'id')
+
+    def prune_level(self, level, now=None, archive=True):
+        """Yields the number of rows removed by each batch until nothing older than the cutoff is left."""
+        cutoff = self.get_cutoff(level, now)
+        if cutoff is None:
+            return
+        if archive and not os.path.isdir(self.archive_dir):
+            os.makedirs(self.archive_dir)
+        while True:
+            rows = list(self.expired(level, cutoff).values(*self.ARCHIVED_FIELDS)[:self.batch_size])
+            if not rows:
+                return
+            if archive:
+                # gzip streams can be concatenated, so every batch appends a new member to the same file
+                with gzip.open(self.get_archive_path(level, now), 'at', encoding='utf-8') as archive_file:
+                    for row in rows:
+                        archive_file.write(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n')
+            Log.objects.filter(pk__in=[row['id'] for row in rows]).delete()
+            yield len(rows)
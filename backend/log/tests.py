@@ -1,3 +1,45 @@
-from django.test import TestCase
+import json
+from unittest import mock
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from accounts.models import User
+from log.models import Log, Logger, LogSink
+from utils.testing import create_user
+
+
+class LogSearchViewTest(APITestCase):
+    def setUp(self):
+        self.logs = [Log.objects.create(source='test', message=str(i)) for i in range(3)]
+        self.client.force_authenticate(create_user(User.UserRole.TechnicalManager))
+
+    def search(self, **query):
+        response = self.client.get(reverse('log-search'), {'q': json.dumps({'source_exact': 'test', **query})})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_logs_are_a_plain_list_when_not_paged(self):
+        self.assertEqual([log['id'] for log in self.search()], [log.pk for log in reversed(self.logs)])
+
+    def test_logs_are_paged_when_asked(self):
+        page = self.search(limit=2)
+        self.assertEqual([log['id'] for log in page['logs']], [self.logs[2].pk, self.logs[1].pk])
+        page = self.search(limit=2, cursor=page['next_cursor'])
+        self.assertEqual([log['id'] for log in page['logs']], [self.logs[0].pk])
+        self.assertIsNone(page['next_cursor'])
+
+
+class LogSinkTest(TestCase):
+    def test_buffer_is_off_in_tests(self):
+        Logger().log('written now', source='test')
+        self.assertTrue(Log.objects.filter(source='test', message='written now').exists())
+
+    def test_write_reads_the_batch_size_and_closes_the_connection(self):
+        logs = [Log(source='test', message=str(i)) for i in range(5)]
+        with override_settings(LOG_BUFFER_BATCH_SIZE=2), mock.patch('log.models.connection') as connection, \
+                self.assertNumQueries(3):
+            LogSink()._write(logs)
+        connection.close.assert_called_once_with()
+        self.assertEqual(Log.objects.filter(source='test').count(), 5)
@@ -3,11 +3,13 @@ import json
 from django.http import JsonResponse
 # Create your views here.
 from knox.auth import TokenAuthentication
-from rest_framework import generics
+from rest_framework import generics, status
 
 from accounts.models import User
+from log.constants import *
 from log.models import LogCatalogue
 from log.serializers import LogSerializer
+from utils.pagination import KeysetPaginator, InvalidCursor
 from utils.permissions import PermissionFactory
 
 
@@ -18,6 +20,13 @@ class LogSearchView(generics.GenericAPIView):
 
     def get(self, request):
         query = json.loads(request.GET.get('q'))
-        requests = LogCatalogue().search(query)
-        serialized = LogSerializer(requests, many=True)
-        return JsonResponse(serialized.data, safe=False)
+        logs = LogCatalogue().search(query)
+        if query.get('cursor') is None and query.get('limit') is None:
+            # clients that don't page still get every match as a plain list
+            return JsonResponse(LogSerializer(logs, many=True).data, safe=False)
+        try:
+            page, next_cursor = KeysetPaginator().paginate(logs, query.get('cursor'), query.get('limit'))
+        except InvalidCursor:
+            return JsonResponse({'error': INVALID_CURSOR_ERROR}, status=status.HTTP_400_BAD_REQUEST)
+        serialized = LogSerializer(page, many=True)
+        return JsonResponse({'logs': serialized.data, 'next_cursor': next_cursor})
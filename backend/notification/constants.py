@@ -1,4 +1,6 @@
 NOTIFICATION_NOT_FOUND_ERROR = u"اعلان پیدا نشد"
+NO_ID_PROVIDED_ERROR = u"آی دی یا زمان داده نشده است"
+INVALID_TIMESTAMP_ERROR = u"زمان داده شده نامعتبر است"
 RequestInitialAcceptBySpecialistNotification_title = u"اعلام آمادگی کارشناسی برای درخواست شما"
 RequestInitialAcceptBySpecialistNotification_message = u"متخصص با نام {} برای درخواست شما با شرح {} اعلام آمادگی کرده است.\n"
 
@@ -0,0 +1,24 @@
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+from notification.push import PushPublisher
+from utils.websocket import TokenAuthMiddleware
+
+
+class PushConsumer(AsyncJsonWebsocketConsumer):
+    group = None
+
+    async def connect(self):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
+        self.group = PushPublisher.group_name(user.pk)
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        await self.accept(TokenAuthMiddleware.PROTOCOL)
+
+    async def disconnect(self, code):
+        if self.group:
+            await self.channel_layer.group_discard(self.group, self.channel_name)
+
+    async def push(self, event):
+        await self.send_json({'event': event['event'], 'data': event['data']})
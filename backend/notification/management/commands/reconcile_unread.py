@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat.models import ConversationCatalogue
+from notification.models import NotificationCatalogue
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the unread notification counters and the unread counts of conversations from their source tables'
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        notifications = NotificationCatalogue().reconcile_unread()
+        conversations = ConversationCatalogue().reconcile_unread()
+        self.stdout.write(self.style.SUCCESS(
+            f"Fixed {notifications} notification counters and {conversations} conversations "
+            f"in {time.monotonic() - started:.2f}s"))
@@ -0,0 +1,23 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+def backfill_notification_counters(apps, schema_editor):
+    Notification = apps.get_model('notification', 'Notification')
+    NotificationCounter = apps.get_model('notification', 'NotificationCounter')
+
+    NotificationCounter.objects.bulk_create([
+        NotificationCounter(user_id=user_id, unread_count=count) for user_id, count in
+        Notification.objects.filter(is_read=False).values_list('user').annotate(Count('id'))
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notification', '0003_notification_counter'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_notification_counters, migrations.RunPython.noop),
+    ]
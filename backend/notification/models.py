@@ -1,8 +1,10 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Count
 from django.utils.translation import gettext_lazy as _
 
 from accounts.models import User
 from utils.Singleton import Singleton
+from utils.cache import VersionCounter
 
 
 class Notification(models.Model):
@@ -19,6 +21,11 @@ class Notification(models.Model):
     user = models.ForeignKey(User, null=False, blank=False, on_delete=models.CASCADE)
     notification_type = models.CharField(max_length=3, choices=NotificationType.choices, default=NotificationType.INFO)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'is_read', '-date'], name='notification_user_unread_idx'),
+        ]
+
     def __str__(self):
         return f"{self.title} - {self.message}"
 
@@ -62,6 +69,15 @@ class Notification(models.Model):
         self.link = link
 
 
+class NotificationCounter(models.Model):
+    """Unread notifications of a user, kept in step with Notification by NotificationCatalogue."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='notification_counter')
+    unread_count = models.IntegerField(default=0)
+
+    def get_unread_count(self):
+        return self.unread_count
+
+
 class NotificationCatalogue(metaclass=Singleton):
     @property
     def notifications(self):
@@ -70,8 +86,64 @@ class NotificationCatalogue(metaclass=Singleton):
     def get_by_id(self, id):
         return self.notifications.get(pk=id)
 
+    def get_version(self, user_id):
+        """Changes whenever a notification of the user is created or read."""
+        return VersionCounter(f'notification-version:{user_id}').get()
+
+    def touch(self, user_id):
+        VersionCounter(f'notification-version:{user_id}').bump()
+
+    def mark_read(self, user, ids=None, before=None):
+        """Marks the unread notifications of the user with the given ids and/or older than before as read.
+
+        Returns the ids of the notifications that changed.
+        """
+        notifications = self.notifications.filter(user=user, is_read=False)
+        if ids is not None:
+            notifications = notifications.filter(pk__in=ids)
+        if before is not None:
+            notifications = notifications.filter(date__lt=before)
+        with transaction.atomic():
+            # a concurrent call waits on the rows and re-checks is_read, so each one is reported once
+            changed = list(notifications.select_for_update().order_by('pk').values_list('pk', flat=True))
+            if changed:
+                self.notifications.filter(pk__in=changed).update(is_read=True)
+                self.add_unread(user.pk, -len(changed))
+                self.touch(user.pk)
+        return changed
+
+    def get_unread_count(self, user):
+        counter = NotificationCounter.objects.filter(user=user).first()
+        return counter.get_unread_count() if counter else 0
+
+    def add_unread(self, user_id, delta):
+        if NotificationCounter.objects.filter(user_id=user_id).update(unread_count=F('unread_count') + delta):
+            return
+        try:
+            with transaction.atomic():
+                NotificationCounter.objects.create(user_id=user_id, unread_count=max(delta, 0))
+        except IntegrityError:
+            # another request created the row first
+            NotificationCounter.objects.filter(user_id=user_id).update(unread_count=F('unread_count') + delta)
+
+    def reconcile_unread(self):
+        """Rebuilds every unread counter from the notifications; returns the number of counters changed."""
+        with transaction.atomic():
+            counts = dict(self.notifications.filter(is_read=False).values_list('user').annotate(Count('id')))
+            changed = []
+            for counter in NotificationCounter.objects.select_for_update():
+                count = counts.pop(counter.user_id, 0)
+                if counter.unread_count != count:
+                    counter.unread_count = count
+                    changed.append(counter)
+            NotificationCounter.objects.bulk_update(changed, ['unread_count'], batch_size=1000)
+            NotificationCounter.objects.bulk_create([
+                NotificationCounter(user_id=user_id, unread_count=count) for user_id, count in counts.items()
+            ], batch_size=1000)
+        return len(changed) + len(counts)
+
     def get_unread(self, user):
-        return self.notifications.filter(user=user, is_read=False).order_by('-date')
+        return self.notifications.filter(user=user, is_read=False).select_related('user').order_by('-date')
 
     def get_read(self, user):
         return self.notifications.filter(user=user, is_read=True).order_by('-date')
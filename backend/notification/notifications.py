@@ -1,10 +1,19 @@
 from abc import ABC
+from collections import Counter
 
+from django.db import transaction
+from django.db.models import Q, F
+
+from accounts.models import User
 from chat.models import Message
 from core.models import Request
+from log.models import Logger, Log
 from notification.constants import *
-from notification.models import Notification
+from notification.models import Notification, NotificationCatalogue
+from notification.push import PushPublisher
+from notification.serializers import NotificationSerializer
 from utils.Singleton import Singleton
+from utils.background import BackgroundRunner
 
 
 class NotificationBuilder(metaclass=Singleton):
@@ -16,120 +25,169 @@ class NotificationBuilder(metaclass=Singleton):
         notif.set_type(type)
         notif.set_is_read(False)
         notif.set_link(link)
-        notif.save()
+        self.create_notifications([notif])
+
+    def create_notifications(self, notifications):
+        with transaction.atomic():
+            Notification.objects.bulk_create(notifications)
+            for user_id, count in Counter(notif.user_id for notif in notifications).items():
+                NotificationCatalogue().add_unread(user_id, count)
+                NotificationCatalogue().touch(user_id)
+        for notif in notifications:
+            PushPublisher().publish(notif.user_id, 'notification', NotificationSerializer(notif).data)
+
+
+class NotificationDispatcher(metaclass=Singleton):
+    """Renders and stores notifications in batches, after the current transaction commits and off the request."""
+
+    # how each kind of user reference reaches the account, see BaseNotification.recipient
+    USER_LOOKUPS = {
+        'normal_user': 'normal_user_user__pk',
+        'customer': 'normal_user_user__customer_normal_user__pk',
+        'specialist': 'normal_user_user__specialist_normal_user__pk',
+    }
+
+    def dispatch(self, notifications):
+        notifications = list(notifications)
+        if notifications:
+            transaction.on_commit(lambda: BackgroundRunner().submit(self.deliver, notifications))
+
+    def deliver(self, notifications):
+        users = self.get_users([notification.recipient for notification in notifications] +
+                               [notification.actor for notification in notifications])
+        rendered = []
+        for notification in notifications:
+            if notification.recipient in users and notification.actor in users:
+                rendered.append(notification.render(users[notification.recipient], users[notification.actor]))
+            else:
+                # e.g. a request that lost its specialist, or an account deleted before delivery
+                Logger().log(f"Dropped {type(notification).__name__}: no account for recipient "
+                             f"{notification.recipient} or actor {notification.actor}", level=Log.LogLevel.WARNING)
+        NotificationBuilder().create_notifications(rendered)
+
+    def get_users(self, refs):
+        """Loads the accounts behind (kind, pk) references with one query, keyed by reference."""
+        ids = {kind: set() for kind in self.USER_LOOKUPS}
+        for kind, pk in refs:
+            if pk is not None:
+                ids[kind].add(pk)
+        condition = Q()
+        for kind, lookup in self.USER_LOOKUPS.items():
+            if ids[kind]:
+                condition |= Q(**{lookup + '__in': ids[kind]})
+        if not condition:
+            return {}
+
+        users = {}
+        annotations = {'ref_' + kind: F(lookup) for kind, lookup in self.USER_LOOKUPS.items()}
+        for user in User.objects.filter(condition).annotate(**annotations):
+            for kind in self.USER_LOOKUPS:
+                pk = getattr(user, 'ref_' + kind)
+                if pk in ids[kind]:
+                    users[kind, pk] = user
+        return users
 
 
 class BaseNotification(ABC):
     entity = None
+    title = ""
+    type = Notification.NotificationType.INFO
+    # (kind, pk) references to the users, kinds are the keys of NotificationDispatcher.USER_LOOKUPS
+    recipient = None
+    actor = None
 
     def __init__(self, entity):
         self.entity = entity
 
-    def build(self):
-        pass
+    def get_message(self, actor: User):
+        return ""
 
+    def get_link(self, actor: User):
+        return ""
 
-class RequestInitialAcceptBySpecialistNotification(BaseNotification):
-    def __init__(self, request: Request):
-        super().__init__(request)
+    def render(self, recipient: User, actor: User) -> Notification:
+        return Notification(user=recipient, title=self.title, message=self.get_message(actor),
+                            notification_type=self.type, is_read=False, link=self.get_link(actor))
 
     def build(self):
-        request: Request = self.entity
-        message = RequestInitialAcceptBySpecialistNotification_message.format(
-            request.specialist.normal_user.user.full_name, request.description
-        )
-        NotificationBuilder().create_notification(request.customer.normal_user.user,
-                                                  title=RequestInitialAcceptBySpecialistNotification_title,
-                                                  message=message,
-                                                  type=Notification.NotificationType.INFO,
-                                                  link=f"/dashboard/request_details/{request.id}")
-
-
-class RequestAcceptanceFinalizeByCustomerNotification(BaseNotification):
-    def __init__(self, request: Request):
-        super().__init__(request)
+        NotificationDispatcher().dispatch([self])
 
-    def build(self):
-        request: Request = self.entity
-        message = RequestAcceptanceFinalizeByCustomerNotification_message.format(request.description,
-                                                                                 request.customer.normal_user.user.full_name)
-        NotificationBuilder().create_notification(request.specialist.normal_user.user,
-                                                  title=RequestAcceptanceFinalizeByCustomerNotification_title,
-                                                  message=message,
-                                                  type=Notification.NotificationType.INFO,
-                                                  link=f"/dashboard/request_details/{request.id}")
 
+class RequestNotification(BaseNotification):
+    """Sent to one side of a request about what the other side did."""
+    to_customer = True
 
-class RequestRejectFinalizeByCustomerNotification(BaseNotification):
     def __init__(self, request: Request):
         super().__init__(request)
+        # read now, the request can change before the notification is rendered (a rejected one loses its specialist)
+        customer = ('customer', request.customer_id)
+        specialist = ('specialist', request.specialist_id)
+        self.recipient, self.actor = (customer, specialist) if self.to_customer else (specialist, customer)
+        self.description = request.description
+        self.link = f"/dashboard/request_details/{request.id}"
 
-    def build(self):
-        request: Request = self.entity
-        message = RequestRejectFinalizeByCustomerNotification_message.format(request.description,
-                                                                             request.customer.normal_user.user.full_name)
-        NotificationBuilder().create_notification(request.specialist.normal_user.user,
-                                                  title=RequestRejectFinalizeByCustomerNotification_title,
-                                                  message=message,
-                                                  type=Notification.NotificationType.INFO,
-                                                  link=f"/dashboard/request_details/{request.id}")
+    def get_link(self, actor: User):
+        return self.link
 
 
-class RequestAcceptanceFinalizeBySpecialistNotification(BaseNotification):
-    def __init__(self, request: Request):
-        super().__init__(request)
+class RequestInitialAcceptBySpecialistNotification(RequestNotification):
+    title = RequestInitialAcceptBySpecialistNotification_title
+    to_customer = True
 
-    def build(self):
-        request: Request = self.entity
-        message = RequestAcceptanceFinalizeBySpecialistNotification_message.format(
-            request.specialist.normal_user.user.full_name, request.description)
-        NotificationBuilder().create_notification(request.customer.normal_user.user,
-                                                  title=RequestAcceptanceFinalizeBySpecialistNotification_title,
-                                                  message=message,
-                                                  type=Notification.NotificationType.INFO,
-                                                  link=f"/dashboard/request_details/{request.id}")
+    def get_message(self, actor: User):
+        return RequestInitialAcceptBySpecialistNotification_message.format(actor.full_name, self.description)
 
 
-class RequestRejectFinalizeBySpecialistNotification(BaseNotification):
-    def __init__(self, request: Request):
-        super().__init__(request)
+class RequestAcceptanceFinalizeByCustomerNotification(RequestNotification):
+    title = RequestAcceptanceFinalizeByCustomerNotification_title
+    to_customer = False
 
-    def build(self):
-        request: Request = self.entity
-        message = RequestRejectFinalizeBySpecialistNotification_message.format(
-            request.specialist.normal_user.user.full_name, request.description)
-        NotificationBuilder().create_notification(request.customer.normal_user.user,
-                                                  title=RequestRejectFinalizeBySpecialistNotification_title,
-                                                  message=message,
-                                                  type=Notification.NotificationType.INFO,
-                                                  link=f"/dashboard/request_details/{request.id}")
+    def get_message(self, actor: User):
+        return RequestAcceptanceFinalizeByCustomerNotification_message.format(self.description, actor.full_name)
 
 
-class SelectSpecialistForRequestNotification(BaseNotification):
-    def __init__(self, request: Request):
-        super().__init__(request)
+class RequestRejectFinalizeByCustomerNotification(RequestNotification):
+    title = RequestRejectFinalizeByCustomerNotification_title
+    to_customer = False
 
-    def build(self):
-        request: Request = self.entity
-        message = SelectSpecialistForRequestNotification_message.format(request.customer.normal_user.user.full_name,
-                                                                        request.description)
-        NotificationBuilder().create_notification(request.specialist.normal_user.user,
-                                                  title=SelectSpecialistForRequestNotification_title,
-                                                  message=message,
-                                                  type=Notification.NotificationType.INFO,
-                                                  link=f"/dashboard/request_details/{request.id}")
+    def get_message(self, actor: User):
+        return RequestRejectFinalizeByCustomerNotification_message.format(self.description, actor.full_name)
+
+
+class RequestAcceptanceFinalizeBySpecialistNotification(RequestNotification):
+    title = RequestAcceptanceFinalizeBySpecialistNotification_title
+    to_customer = True
+
+    def get_message(self, actor: User):
+        return RequestAcceptanceFinalizeBySpecialistNotification_message.format(actor.full_name, self.description)
+
+
+class RequestRejectFinalizeBySpecialistNotification(RequestNotification):
+    title = RequestRejectFinalizeBySpecialistNotification_title
+    to_customer = True
+
+    def get_message(self, actor: User):
+        return RequestRejectFinalizeBySpecialistNotification_message.format(actor.full_name, self.description)
+
+
+class SelectSpecialistForRequestNotification(RequestNotification):
+    title = SelectSpecialistForRequestNotification_title
+    to_customer = False
+
+    def get_message(self, actor: User):
+        return SelectSpecialistForRequestNotification_message.format(actor.full_name, self.description)
 
 
 class NewMessageNotification(BaseNotification):
+    title = NewMessageNotification_title
+
     def __init__(self, message: Message):
         super().__init__(message)
+        self.recipient = ('normal_user', message.receiver_id)
+        self.actor = ('normal_user', message.sender_id)
 
-    def build(self):
-        message: Message = self.entity
-        notification_message = NewMessageNotification_message.format(message.sender.user.full_name)
-        NotificationBuilder().create_notification(message.receiver.user,
-                                                  title=NewMessageNotification_title,
-                                                  message=notification_message,
-                                                  type=Notification.NotificationType.INFO,
-                                                  link=f"/dashboard/chats/{message.sender.user.id}"
-                                                  )
+    def get_message(self, actor: User):
+        return NewMessageNotification_message.format(actor.full_name)
+
+    def get_link(self, actor: User):
+        return f"/dashboard/chats/{actor.id}"
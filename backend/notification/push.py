@@ -0,0 +1,31 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+from utils.Singleton import Singleton
+
+
+class PushPublisher(metaclass=Singleton):
+    """Sends events to the open websockets of a user, see notification.consumers.PushConsumer."""
+
+    @staticmethod
+    def group_name(user_id):
+        return f'user-{user_id}'
+
+    def publish(self, user_id, event, data):
+        # clients fetch the object right after the push, so it must be committed first
+        transaction.on_commit(lambda: self._send(user_id, event, data))
+
+    def _send(self, user_id, event, data):
+        layer = get_channel_layer()
+        if layer is None:
+            return
+        try:
+            async_to_sync(layer.group_send)(self.group_name(user_id), {
+                'type': 'push',
+                'event': event,
+                'data': data,
+            })
+        except Exception as e:
+            # clients still poll, a lost push only delays delivery
+            print("Push failed", user_id, event, e)
@@ -0,0 +1,7 @@
+from django.urls import path
+
+from notification.consumers import PushConsumer
+
+websocket_urlpatterns = [
+    path('ws/push/', PushConsumer.as_asgi(), name='push'),
+]
@@ -1,3 +1,224 @@
-from django.test import TestCase
+import asyncio
+import time
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from knox.models import AuthToken
+from rest_framework.test import APITestCase
+
+from chat.models import MessageCatalogue
+from log.models import Logger, Log
+from notification.models import Notification, NotificationCatalogue
+from notification.notifications import NotificationDispatcher, NewMessageNotification, \
+    SelectSpecialistForRequestNotification, RequestInitialAcceptBySpecialistNotification
+from notification.push import PushPublisher
+from notification.routing import websocket_urlpatterns
+from notification.views import NotificationView
+from utils.background import BackgroundRunner
+from utils.testing import create_user, create_customer, create_specialist, create_speciality, create_request
+from utils.websocket import TokenAuthMiddleware
+
+
+class NotificationLongPollTest(APITestCase):
+    def setUp(self):
+        self.user = create_user()
+        _, token = AuthToken.objects.create(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+
+    def get_etag(self):
+        return NotificationView.get_etag(NotificationCatalogue().get_version(self.user.pk))
+
+    def poll(self, **headers):
+        started = time.monotonic()
+        response = self.client.get(reverse('notification-view-unread'), {'wait': 1}, **headers)
+        return response, time.monotonic() - started
+
+    def test_poll_without_matching_etag_answers_at_once(self):
+        response, elapsed = self.poll(HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], self.get_etag())
+        self.assertLess(elapsed, 0.5)
+
+    def test_poll_with_current_etag_waits_then_answers_not_modified(self):
+        response, elapsed = self.poll(HTTP_IF_NONE_MATCH=self.get_etag())
+        self.assertEqual(response.status_code, 304)
+        self.assertGreaterEqual(elapsed, 1)
+
+    def test_unauthenticated_poll_does_not_wait(self):
+        self.client.credentials()
+        response, elapsed = self.poll(HTTP_IF_NONE_MATCH='"1"')
+        self.assertEqual(response.status_code, 401)
+        self.assertLess(elapsed, 0.5)
+
+
+class WaitForChangeTest(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.etag = NotificationView.get_etag(NotificationCatalogue().get_version(self.user.pk))
+
+    async def change_later(self, delay):
+        await asyncio.sleep(delay)
+        cache.incr(f'notification-version:{self.user.pk}')
+
+    async def test_returns_once_the_version_changes(self):
+        started = time.monotonic()
+        await asyncio.gather(NotificationView.wait_for_change(self.user.pk, self.etag, 5), self.change_later(0.2))
+        self.assertLess(time.monotonic() - started, 2)
+
+    async def test_waiting_does_not_block_the_event_loop(self):
+        ticks = []
+
+        async def tick():
+            for _ in range(5):
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.1)
+
+        started = time.monotonic()
+        await asyncio.gather(NotificationView.wait_for_change(self.user.pk, self.etag, 1), tick())
+        self.assertEqual(len(ticks), 5)
+        self.assertLess(ticks[-1] - started, 0.8)
+
+
+class MarkReadTest(APITestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.notifications = [Notification.objects.create(user=self.user, title=str(i)) for i in range(3)]
+        NotificationCatalogue().add_unread(self.user.pk, 3)
+        self.client.force_authenticate(self.user)
+
+    def mark_read(self, **data):
+        return self.client.post(reverse('notification-view-unread'), data, format='json')
+
+    def get_unread(self):
+        return set(Notification.objects.filter(user=self.user, is_read=False).values_list('pk', flat=True))
+
+    def test_marks_only_the_given_ids(self):
+        response = self.mark_read(ids=[self.notifications[0].pk, self.notifications[1].pk])
+        self.assertEqual(response.json(), {'ids': [self.notifications[0].pk, self.notifications[1].pk]})
+        self.assertEqual(self.get_unread(), {self.notifications[2].pk})
+        self.assertEqual(NotificationCatalogue().get_unread_count(self.user), 1)
+
+    def test_already_read_notifications_are_not_counted_again(self):
+        self.mark_read(ids=[self.notifications[0].pk])
+        response = self.mark_read(ids=[self.notifications[0].pk])
+        self.assertEqual(response.json(), {'ids': []})
+        self.assertEqual(NotificationCatalogue().get_unread_count(self.user), 2)
+
+    def test_other_users_notifications_are_left_alone(self):
+        other = Notification.objects.create(user=create_user(), title='other')
+        response = self.mark_read(ids=[other.pk])
+        self.assertEqual(response.json(), {'ids': []})
+        self.assertFalse(Notification.objects.get(pk=other.pk).is_read)
+
+    def test_unparseable_ids_are_rejected(self):
+        for ids in ['1,x', {'id': 1}, [1, None], 1.5]:
+            response = self.mark_read(ids=ids)
+            self.assertEqual(response.status_code, 400, ids)
+        self.assertEqual(len(self.get_unread()), 3)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class PushConsumerTest(TransactionTestCase):
+    # the consumer reads the token on another thread and connection, so the rows have to be committed
+
+    def setUp(self):
+        self.application = TokenAuthMiddleware(URLRouter(websocket_urlpatterns))
+        self.user = create_user()
+        _, self.token = AuthToken.objects.create(self.user)
+
+    async def connect(self, path='/ws/push/', subprotocols=None):
+        communicator = WebsocketCommunicator(self.application, path, subprotocols=subprotocols)
+        connected, subprotocol = await communicator.connect()
+        return communicator, connected, subprotocol
+
+    async def test_connections_without_a_valid_token_are_rejected(self):
+        for subprotocols in [None, ['knox'], ['knox', 'not-a-token'], [self.token]]:
+            communicator, connected, _ = await self.connect(subprotocols=subprotocols)
+            self.assertFalse(connected, subprotocols)
+            await communicator.disconnect()
+
+    async def test_token_in_the_query_string_is_ignored(self):
+        communicator, connected, _ = await self.connect(path=f'/ws/push/?token={self.token}')
+        self.assertFalse(connected)
+        await communicator.disconnect()
+
+    async def test_knox_token_connects(self):
+        communicator, connected, subprotocol = await self.connect(subprotocols=['knox', self.token])
+        self.assertTrue(connected)
+        self.assertEqual(subprotocol, 'knox')
+        await communicator.disconnect()
+
+    async def test_push_reaches_only_its_user(self):
+        other = await database_sync_to_async(create_user)()
+        _, other_token = await database_sync_to_async(AuthToken.objects.create)(other)
+        mine, _, _ = await self.connect(subprotocols=['knox', self.token])
+        theirs, _, _ = await self.connect(subprotocols=['knox', other_token])
+        await sync_to_async(PushPublisher().publish)(self.user.pk, 'message', {'id': 1})
+        self.assertEqual(await mine.receive_json_from(), {'event': 'message', 'data': {'id': 1}})
+        self.assertTrue(await theirs.receive_nothing())
+        await mine.disconnect()
+        await theirs.disconnect()
+
+
+class NotificationDispatcherTest(TestCase):
+    def setUp(self):
+        self.customer = create_customer()
+        self.specialist = create_specialist()
+        self.request = create_request(self.customer, create_speciality(), specialist=self.specialist)
+
+    def message(self, sender, receiver):
+        return NewMessageNotification(MessageCatalogue().send(sender.normal_user, receiver.normal_user, 'hello'))
+
+    def get_notified(self):
+        users = [self.customer.normal_user.user_id, self.specialist.normal_user.user_id]
+        return list(Notification.objects.filter(user__in=users).order_by('pk').values_list('user', flat=True))
+
+    def test_recipients_of_every_kind_are_resolved(self):
+        NotificationDispatcher().deliver([
+            SelectSpecialistForRequestNotification(self.request),
+            RequestInitialAcceptBySpecialistNotification(self.request),
+            self.message(self.customer, self.specialist),
+        ])
+        specialist_user, customer_user = self.specialist.normal_user.user_id, self.customer.normal_user.user_id
+        self.assertEqual(self.get_notified(), [specialist_user, customer_user, specialist_user])
+
+    def test_a_batch_costs_the_same_queries_as_one_notification(self):
+        # the first delivery also creates the recipient's unread counter
+        NotificationDispatcher().deliver([self.message(self.customer, self.specialist)])
+        single = [self.message(self.customer, self.specialist)]
+        with CaptureQueriesContext(connection) as single_queries:
+            NotificationDispatcher().deliver(single)
+        batch = [self.message(self.customer, self.specialist) for _ in range(5)]
+        with CaptureQueriesContext(connection) as batch_queries:
+            NotificationDispatcher().deliver(batch)
+        self.assertEqual(len(batch_queries), len(single_queries))
+        self.assertEqual(NotificationCatalogue().get_unread_count(self.specialist.normal_user.user), 7)
+
+    def test_missing_recipients_are_logged_and_dropped(self):
+        self.request.remove_specialist()
+        with mock.patch.object(Logger(), 'log') as log:
+            NotificationDispatcher().deliver([
+                SelectSpecialistForRequestNotification(self.request),
+                self.message(self.specialist, self.customer),
+            ])
+        self.assertEqual(self.get_notified(), [self.customer.normal_user.user_id])
+        log.assert_called_once()
+        self.assertIn('SelectSpecialistForRequestNotification', log.call_args.args[0])
+        self.assertEqual(log.call_args.kwargs['level'], Log.LogLevel.WARNING)
+
+    def test_failed_deliveries_are_logged(self):
+        with mock.patch.object(Logger(), 'log') as log, \
+                mock.patch.object(NotificationDispatcher(), 'get_users', side_effect=RuntimeError('down')):
+            future = BackgroundRunner().submit(NotificationDispatcher().deliver, [])
+            self.assertIsInstance(future.exception(timeout=5), RuntimeError)
+        log.assert_called_once()
+        self.assertIn('down', log.call_args.args[0])
+        self.assertEqual(log.call_args.kwargs['level'], Log.LogLevel.ERROR)
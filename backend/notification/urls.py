@@ -1,8 +1,9 @@
 from django.urls import path
 
-from notification.views import NotificationView
+from notification.views import NotificationView, UnreadCountsView, unread_notifications_view
 
 urlpatterns = [
-    path('', NotificationView.as_view(), name='notification-view-unread'),
+    path('', unread_notifications_view, name='notification-view-unread'),
+    path('counts/', UnreadCountsView.as_view(), name='notification-unread-counts'),
     path('<notification_id>/', NotificationView.as_view(), name='notification-view'),
 ]
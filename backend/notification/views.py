@@ -1,22 +1,33 @@
-from django.http import JsonResponse
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, HttpResponse
 from django.utils.translation import gettext_lazy as _
 from knox.auth import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.status import HTTP_404_NOT_FOUND
+from rest_framework.status import HTTP_404_NOT_FOUND, HTTP_304_NOT_MODIFIED, HTTP_400_BAD_REQUEST
 from rest_framework.views import APIView
 
+from accounts.models import NormalUser
+from arno.settings import NOTIFICATION_LONG_POLL_MAX_WAIT, NOTIFICATION_LONG_POLL_INTERVAL
+from chat.models import ConversationCatalogue
 from log.models import Logger
 from notification.constants import *
-from notification.models import NotificationCatalogue, Notification
+from notification.models import NotificationCatalogue
 from notification.serializers import NotificationSerializer
-from utils.helper_funcs import ListAdapter
+from utils.helper_funcs import ListAdapter, TimestampAdapter
 
 
 class NotificationView(APIView):
     authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
 
     def get(self, request, notification_id=''):
         many = False
+        etag = None
         if notification_id:
             notification = NotificationCatalogue().get_by_id(notification_id)
             if notification.get_user() != request.user:
@@ -24,28 +35,106 @@ class NotificationView(APIView):
                     'error': _(NOTIFICATION_NOT_FOUND_ERROR)
                 }, status=HTTP_404_NOT_FOUND)
         else:
+            # the version is read before the notifications, so a change in between only costs a refetch
+            etag = self.get_etag(NotificationCatalogue().get_version(request.user.pk))
+            if request.headers.get('If-None-Match') == etag:
+                response = HttpResponse(status=HTTP_304_NOT_MODIFIED)
+                response['ETag'] = etag
+                return response
             notification = NotificationCatalogue().get_unread(request.user)
             many = True
 
         serializer = NotificationSerializer(notification, many=many)
 
-        return JsonResponse({"notifications": serializer.data})
+        response = JsonResponse({"notifications": serializer.data})
+        if etag:
+            response['ETag'] = etag
+        return response
+
+    @staticmethod
+    def get_etag(version):
+        return f'"{version}"'
+
+    @staticmethod
+    def get_wait(request):
+        try:
+            return max(0.0, min(float(request.GET.get('wait', 0)), NOTIFICATION_LONG_POLL_MAX_WAIT))
+        except ValueError:
+            return 0.0
+
+    @classmethod
+    async def wait_for_change(cls, user_id, etag, wait):
+        """Waits, for at most `wait` seconds, until the notification version of the user no longer matches etag."""
+        # the version lives in the shared cache, which is safe to read off the thread that runs sync views
+        get_version = sync_to_async(NotificationCatalogue().get_version, thread_sensitive=False)
+        deadline = time.monotonic() + wait
+        while cls.get_etag(await get_version(user_id)) == etag and time.monotonic() < deadline:
+            await asyncio.sleep(NOTIFICATION_LONG_POLL_INTERVAL)
 
     @Logger().log_name()
     def post(self, request):
+        """Marks notifications read, by 'ids' and/or all of them created before the 'before' timestamp."""
         ids = request.data.get('ids')
-        id_list = ListAdapter().python_ensure_list(ids)
-        objs = []
-        for id in id_list:
-            try:
-                notif = Notification.objects.get(pk=id)
-            except:
-                continue
-            if not notif:
-                continue
-            if notif.get_user() != request.user:
-                continue
-            notif.set_is_read(True)
-            objs.append(notif)
-        Notification.objects.bulk_update(objs, ['is_read'])
-        return Response({'ids': map(lambda x: x.id, objs)})
+        before = request.data.get('before')
+        if ids is None and before is None:
+            return JsonResponse({'error': NO_ID_PROVIDED_ERROR}, status=HTTP_400_BAD_REQUEST)
+        try:
+            id_list = ListAdapter().python_ensure_list(ids) if ids is not None else None
+        except (TypeError, ValueError):
+            id_list = None
+        # ids of a shape ListAdapter doesn't know come back as None, which would mean every one of them
+        if ids is not None and id_list is None:
+            return JsonResponse({'error': NO_ID_PROVIDED_ERROR}, status=HTTP_400_BAD_REQUEST)
+        try:
+            before = TimestampAdapter().parse(before) if before is not None else None
+        except ValueError:
+            return JsonResponse({'error': INVALID_TIMESTAMP_ERROR}, status=HTTP_400_BAD_REQUEST)
+        ids = NotificationCatalogue().mark_read(request.user, ids=id_list, before=before)
+        return Response({'ids': ids})
+
+
+notification_view = NotificationView.as_view()
+
+
+async def unread_notifications_view(request):
+    """NotificationView, except that a poll with ?wait=<seconds> and an If-None-Match of the current version first
+    waits, for at most NOTIFICATION_LONG_POLL_MAX_WAIT seconds, until the version changes.
+
+    The wait happens here on the event loop: under ASGI every sync view runs on one shared thread, so sleeping in
+    NotificationView would hold up every other HTTP request.
+    """
+    etag = request.headers.get('If-None-Match')
+    wait = NotificationView.get_wait(request)
+    if request.method == 'GET' and etag and wait:
+        try:
+            authenticated = await sync_to_async(TokenAuthentication().authenticate)(request)
+        except AuthenticationFailed:
+            authenticated = None
+        # unauthenticated polls don't wait, NotificationView turns them away
+        if authenticated:
+            await NotificationView.wait_for_change(authenticated[0].pk, etag, wait)
+    return await sync_to_async(notification_view)(request)
+
+
+# like every APIView, authentication is by token only
+unread_notifications_view.csrf_exempt = True
+
+
+class UnreadCountsView(APIView):
+    """Badge counts: unread notifications and unread chat messages, in total and per peer."""
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        conversations = []
+        normal_user = NormalUser.objects.filter(user=request.user).first()
+        if normal_user:
+            conversations = [
+                {'peer': peer, 'unread_count': count} for peer, count in
+                ConversationCatalogue().get_unread(normal_user).values_list('peer__user', 'unread_count')
+            ]
+        return JsonResponse({
+            'notifications': NotificationCatalogue().get_unread_count(request.user),
+            'messages': sum(conversation['unread_count'] for conversation in conversations),
+            'conversations': conversations,
+        })
@@ -0,0 +1,36 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+
+from arno.settings import BACKGROUND_WORKERS
+from log.models import Logger, Log
+from utils.Singleton import Singleton
+
+
+class BackgroundRunner(metaclass=Singleton):
+    """Runs callables on a small per-process thread pool, off the request path."""
+
+    def __init__(self):
+        self._pid = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if self._pid != os.getpid():
+                # thread pools don't survive a fork, each worker gets its own
+                self._executor = ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS, thread_name_prefix='background')
+                self._pid = os.getpid()
+        return self._executor.submit(self._run, fn, *args, **kwargs)
+
+    def _run(self, fn, *args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            # nobody waits on the future, this log is all that is left of the failure
+            Logger().log(f"Background task {getattr(fn, '__qualname__', fn)} failed: {e!r}", level=Log.LogLevel.ERROR)
+            raise
+        finally:
+            connection.close()
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, When, Value, IntegerField
+
+from arno.settings import CATALOGUE_CACHE_TIMEOUT, CATALOGUE_CACHE_MAX_IDS
+
+
+class VersionCounter:
+    """A counter in the shared cache that changes whenever the data it stands for does."""
+
+    def __init__(self, key):
+        self.key = key
+
+    def get(self):
+        version = cache.get(self.key)
+        if version is None:
+            # start from the clock so a counter lost to eviction can't come back with a version already seen
+            cache.add(self.key, time.time_ns())
+            version = cache.get(self.key)
+        return version
+
+    def bump(self):
+        """Bumps the version once the current transaction commits."""
+        transaction.on_commit(self._incr)
+
+    def _incr(self):
+        try:
+            cache.incr(self.key)
+        except ValueError:
+            cache.add(self.key, time.time_ns())
+
+
+class VersionedLocalCache:
+    """Keeps a value built from the database in process memory.
+
+    A version counter in the shared cache tells every process when its copy is stale, so an
+    invalidation in one worker reaches all of them on their next read.
+    """
+
+    def __init__(self, name, builder):
+        self.version = VersionCounter(f'local-cache-version:{name}')
+        self.builder = builder
+        self._value = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        version = self.get_version()
+        if self._value is None or self._version != version:
+            with self._lock:
+                if self._value is None or self._version != version:
+                    self._value = self.builder()
+                    self._version = version
+        return self._value
+
+    def get_version(self):
+        return self.version.get()
+
+    def invalidate(self):
+        """Drops this process' copy now and bumps the shared version once the current transaction commits."""
+        self._value = None
+        self.version.bump()
+
+
+class CatalogueCache:
+    """Read-through cache in front of a catalogue's search.
+
+    Searches are kept as the primary keys they matched under a hash of the normalised query and handed back
+    as a queryset over those keys in the same order. All keys carry a shared version, so one invalidate() drops
+    everything cached for the catalogue.
+
+    Only the keys and their order survive: annotations, select_related and the like of the builder's queryset
+    are gone from a cached result, so only catalogues whose callers read plain model fields should use it. The
+    order is restored with a CASE of one WHEN per key, which is why results over max_ids aren't cached.
+    """
+
+    def __init__(self, name, model, timeout=CATALOGUE_CACHE_TIMEOUT, max_ids=CATALOGUE_CACHE_MAX_IDS):
+        self.name = name
+        self.model = model
+        self.timeout = timeout
+        self.max_ids = max_ids
+        self.version = VersionCounter(f'catalogue-version:{name}')
+
+    def search(self, query, builder):
+        key = self.make_key('search', self.normalise(query))
+        cached = cache.get(key)
+        if cached is None:
+            queryset = builder(query)
+            ids = list(queryset.values_list('pk', flat=True)[:self.max_ids + 1])
+            if len(ids) > self.max_ids:
+                # too large to be worth keeping, and a long IN list is slower than the query itself
+                return queryset
+            cached = (list(dict.fromkeys(ids)), queryset.ordered)
+            cache.set(key, cached, self.timeout)
+        ids, ordered = cached
+        result = self.model.objects.filter(pk__in=ids)
+        if ordered and len(ids) > 1:
+            result = result.order_by(Case(*[When(pk=pk, then=Value(position)) for position, pk in enumerate(ids)],
+                                          output_field=IntegerField()))
+        return result
+
+    def invalidate(self, **kwargs):
+        """Usable as a signal receiver; the new version applies once the current transaction commits."""
+        self.version.bump()
+
+    def make_key(self, kind, value):
+        digest = hashlib.sha1(value.encode()).hexdigest()
+        return f'catalogue:{self.name}:{self.version.get()}:{kind}:{digest}'
+
+    @staticmethod
+    def normalise(query):
+        # catalogues skip falsy filters, so {} and {'name': ''} are the same search
+        query = {field: value for field, value in (query or {}).items() if value not in (None, '', [], {})}
+        return json.dumps(query, sort_keys=True, default=str)
@@ -1,3 +1,6 @@
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
 from utils.Singleton import Singleton
 
 
@@ -5,3 +8,14 @@ class ListAdapter(metaclass=Singleton):
     def python_ensure_list(self, ids):
         return list(map(int, ids.split(','))) if isinstance(ids, str) else (
             [ids] if isinstance(ids, int) else (list(map(int, ids)) if isinstance(ids, list) else None))
+
+
+class TimestampAdapter(metaclass=Singleton):
+    def parse(self, value):
+        """Parses an ISO 8601 timestamp, naive ones are taken in the current time zone; raises ValueError."""
+        timestamp = parse_datetime(value) if isinstance(value, str) else None
+        if timestamp is None:
+            raise ValueError(f"invalid timestamp {value!r}")
+        if timezone.is_naive(timestamp):
+            timestamp = timezone.make_aware(timestamp)
+        return timestamp
@@ -0,0 +1,98 @@
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPaginator:
+    """Pages a queryset newest first on (time_field, id) using an opaque cursor instead of OFFSET."""
+
+    def __init__(self, time_field='created_at', default_limit=50, max_limit=500):
+        self.time_field = time_field
+        self.default_limit = default_limit
+        self.max_limit = max_limit
+
+    def get_limit(self, limit):
+        try:
+            limit = int(limit) if limit else self.default_limit
+        except (TypeError, ValueError):
+            limit = self.default_limit
+        return max(1, min(limit, self.max_limit))
+
+    def encode_cursor(self, obj):
+        value = [getattr(obj, self.time_field).isoformat(), obj.pk]
+        return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            raw_time, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            time = parse_datetime(raw_time)
+            pk = int(pk)
+        except (TypeError, ValueError, UnicodeDecodeError, AttributeError):
+            raise InvalidCursor(cursor)
+        if time is None:
+            raise InvalidCursor(cursor)
+        return time, pk
+
+    def paginate(self, queryset, cursor=None, limit=None):
+        """Returns (objects, next_cursor); next_cursor is None on the last page."""
+        return self.paginate_many([queryset], cursor, limit)
+
+    def paginate_many(self, querysets, cursor=None, limit=None):
+        """Paginates the union of disjoint querysets, reading at most one page from each of them.
+
+        Splitting an OR into several querysets lets each one walk its own index in order.
+        """
+        limit = self.get_limit(limit)
+        position = self.decode_cursor(cursor) if cursor else None
+        objects = []
+        for queryset in querysets:
+            queryset = queryset.order_by('-' + self.time_field, '-pk')
+            if position:
+                time, pk = position
+                queryset = queryset.filter(
+                    Q(**{self.time_field + '__lt': time}) | Q(**{self.time_field: time, 'pk__lt': pk}))
+            objects.extend(queryset[:limit + 1])
+        objects.sort(key=lambda obj: (getattr(obj, self.time_field), obj.pk), reverse=True)
+        if len(objects) <= limit:
+            return objects, None
+        objects = objects[:limit]
+        return objects, self.encode_cursor(objects[-1])
+
+
+class OffsetPaginator:
+    """Slices a queryset with LIMIT/OFFSET, for listings whose ordering is chosen by the client."""
+
+    def __init__(self, default_limit=50, max_limit=500, unique_field='pk'):
+        self.default_limit = default_limit
+        self.max_limit = max_limit
+        self.unique_field = unique_field
+
+    def get_window(self, offset=None, limit=None):
+        try:
+            limit = int(limit) if limit else self.default_limit
+            offset = int(offset) if offset else 0
+        except (TypeError, ValueError):
+            limit, offset = self.default_limit, 0
+        return max(0, offset), max(1, min(limit, self.max_limit))
+
+    def order(self, queryset):
+        # pages are only stable if every row has a distinct position
+        return queryset.order_by(*queryset.query.order_by, self.unique_field)
+
+    def paginate(self, queryset, offset=None, limit=None):
+        offset, limit = self.get_window(offset, limit)
+        return self.order(queryset)[offset:offset + limit]
+
+    def paginate_with_next(self, queryset, offset=None, limit=None):
+        """Like paginate, but also returns the offset of the next page, None on the last one, without a COUNT."""
+        offset, limit = self.get_window(offset, limit)
+        page = list(self.order(queryset)[offset:offset + limit + 1])
+        if len(page) <= limit:
+            return page, None
+        return page[:limit], offset + limit
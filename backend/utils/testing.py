@@ -0,0 +1,47 @@
+from datetime import timedelta
+from itertools import count
+
+from django.utils import timezone
+
+from accounts.models import User, NormalUser, Customer, Specialist, Speciality
+from core.models import Location, Request
+
+_sequence = count(1)
+
+
+def create_user(role=User.UserRole.Customer, score=0, **fields) -> User:
+    """A user with a unique username, email and phone, and the NormalUser row normal roles need."""
+    number = next(_sequence)
+    user = User.objects.create(username=f'user{number}', email=f'user{number}@example.com',
+                               phone=f'+1202555{number:04d}', role=role, **fields)
+    if role in [User.UserRole.Customer, User.UserRole.Specialist]:
+        NormalUser.objects.create(user=user, score=score)
+    return user
+
+
+def create_customer(**fields) -> Customer:
+    user = create_user(User.UserRole.Customer, **fields)
+    return Customer.objects.create(normal_user=user.normal_user_user)
+
+
+def create_specialist(specialities=(), is_validated=True, is_active=True, **fields) -> Specialist:
+    user = create_user(User.UserRole.Specialist, **fields)
+    specialist = Specialist.objects.create(normal_user=user.normal_user_user, is_validated=is_validated,
+                                           is_active=is_active)
+    specialist.speciality.set(specialities)
+    return specialist
+
+
+def create_speciality(title='speciality', parent=None) -> Speciality:
+    return Speciality.objects.create(title=f'{title} {next(_sequence)}', description='', parent=parent)
+
+
+def create_location(latitude=35.7, longitude=51.4) -> Location:
+    return Location.objects.create(address=f'{latitude}, {longitude}', latitude=latitude, longitude=longitude)
+
+
+def create_request(customer, speciality, specialist=None, status=Request.RequestStatus.PENDING,
+                   location=None) -> Request:
+    return Request.objects.create(customer=customer, requested_speciality=speciality, specialist=specialist,
+                                  status=status, location=location,
+                                  desired_start_time=timezone.now() + timedelta(days=1))
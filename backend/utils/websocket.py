@@ -0,0 +1,39 @@
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.contrib.auth.models import AnonymousUser
+from knox.auth import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+
+class TokenAuthMiddleware(BaseMiddleware):
+    """Sets scope['user'] from a knox token offered as a websocket subprotocol.
+
+    Browsers can't send headers on websockets, but they can list subprotocols, so clients connect with
+    `new WebSocket(url, ['knox', token])`. The token stays out of URLs and so out of access logs; consumers accept
+    with the PROTOCOL subprotocol, the browser drops the connection if none of its offers is picked.
+    """
+    PROTOCOL = 'knox'
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        scope['user'] = await self.get_user(scope)
+        return await super().__call__(scope, receive, send)
+
+    @classmethod
+    def get_token(cls, scope):
+        subprotocols = list(scope.get('subprotocols') or [])
+        if cls.PROTOCOL not in subprotocols:
+            return None
+        position = subprotocols.index(cls.PROTOCOL) + 1
+        return subprotocols[position] if position < len(subprotocols) else None
+
+    @database_sync_to_async
+    def get_user(self, scope):
+        token = self.get_token(scope)
+        if not token:
+            return AnonymousUser()
+        try:
+            user, _ = TokenAuthentication().authenticate_credentials(token.encode())
+        except AuthenticationFailed:
+            return AnonymousUser()
+        return user